@@ -0,0 +1,226 @@
+from spinedb_api import DatabaseMapping
+from generate_ines_database import generate_source
+import subprocess
+import tempfile
+import tracemalloc
+import json
+import time
+import sys
+import os
+
+here = os.path.dirname(os.path.abspath(__file__))
+
+# scaling grids, each case is a set of generate_source arguments
+grids = {
+    "small": [
+        {"nodes": nodes, "units": 2 * nodes, "links": nodes // 2, "steps": steps}
+        for nodes in (5, 20)
+        for steps in (24, 168)
+    ],
+    "medium": [
+        {
+            "nodes": nodes,
+            "units": 2 * nodes,
+            "links": nodes // 2,
+            "steps": steps,
+            "weather_years": weather_years,
+        }
+        for nodes in (20, 100)
+        for steps in (168, 2184)
+        for weather_years in (1, 5)
+    ],
+    "large": [
+        {
+            "nodes": nodes,
+            "units": 2 * nodes,
+            "links": nodes,
+            "sets": 10,
+            "periods": 4,
+            "steps": steps,
+            "weather_years": weather_years,
+        }
+        for nodes in (100, 500)
+        for steps in (2184, 8760)
+        for weather_years in (5, 30)
+    ],
+}
+
+
+def case_name(case):
+    return "_".join(f"{key}{value}" for key, value in sorted(case.items()))
+
+
+def create_target(url, template):
+    """Creates an empty SpineOpt database from a template json file or database url."""
+    from ines_to_spineopt import create_from_template, load_template
+
+    create_from_template(url, load_template(template)).close()
+
+
+def committed_rows(db_map):
+    """Counts the rows the conversion wrote into the database of db_map."""
+    return sum(
+        db_map.query(subquery).count()
+        for subquery in (
+            db_map.alternative_sq,
+            db_map.entity_sq,
+            db_map.entity_group_sq,
+            db_map.parameter_value_sq,
+        )
+    )
+
+
+def count_rows(url):
+    with DatabaseMapping(url) as db_map:
+        return committed_rows(db_map)
+
+
+def run_measured(command):
+    """Runs a command, returns its wall time, peak RSS in megabytes and output."""
+    with tempfile.TemporaryFile("w+") as stdout, tempfile.TemporaryFile("w+") as stderr:
+        start = time.perf_counter()
+        process = subprocess.Popen(
+            command, cwd=here, stdout=stdout, stderr=stderr, text=True
+        )
+        _, status, usage = os.wait4(process.pid, 0)
+        wall_time = time.perf_counter() - start
+        process.returncode = os.waitstatus_to_exitcode(status)
+        stdout.seek(0)
+        stderr.seek(0)
+        if process.returncode:
+            raise RuntimeError(f"{' '.join(command)} failed:\n{stderr.read()[-2000:]}")
+        return wall_time, usage.ru_maxrss / 1024, stdout.read()
+
+
+def run_main(source_url, target_url):
+    wall_time, peak_rss, _ = run_measured(
+        [sys.executable, "ines_to_spineopt.py", source_url, target_url]
+    )
+    return {
+        "stage": "main",
+        "wall_time": wall_time,
+        "peak_rss_mb": peak_rss,
+        "rows_written": count_rows(target_url),
+    }
+
+
+def run_stages(source_url, target_url):
+    _, _, stdout = run_measured(
+        [sys.executable, os.path.basename(__file__), "--stages", source_url, target_url]
+    )
+    return json.loads(stdout.splitlines()[-1])
+
+
+def measure_stages(source_url, target_url):
+    """Runs the conversion stage by stage in this process and prints the measures.
+
+    Each stage is committed before its rows are counted. The memory peak is
+    traced per stage, above the memory held when the stage starts; the wall
+    times include the tracing overhead.
+    """
+    sys.stdout = sys.stderr
+    import ines_to_spineopt as converter
+
+    converter.configure(converter.ConversionOptions(source_url, target_url))
+    measures = []
+    tracemalloc.start()
+
+    def measured(name, function, writer):
+        rows = committed_rows(writer)
+        tracemalloc.reset_peak()
+        memory_before = tracemalloc.get_traced_memory()[0]
+        start = time.perf_counter()
+        result = function()
+        writer.checkpoint(f"Completed {name}")
+        wall_time = time.perf_counter() - start
+        measures.append(
+            {
+                "stage": name,
+                "wall_time": wall_time,
+                "peak_above_start_mb": (
+                    tracemalloc.get_traced_memory()[1] - memory_before
+                )
+                / 2**20,
+                "rows_written": committed_rows(writer) - rows,
+            }
+        )
+        return result
+
+    with DatabaseMapping(source_url) as source_db:
+        with DatabaseMapping(target_url) as target_db:
+            converter.purge_target(target_db)
+            writer = converter.BulkWriter(target_db)
+            target_db = measured(
+                "copy_generic",
+                lambda: converter.copy_generic(source_db, writer),
+                writer,
+            )
+            source_db = measured(
+                "source_snapshot", lambda: converter.SourceSnapshot(source_db), writer
+            )
+            timeline = measured(
+                "timeline_context",
+                lambda: converter.timeline_context(source_db),
+                writer,
+            )
+            for stage in converter.stages:
+                measured(
+                    stage.name,
+                    lambda: converter.run_stage(stage, source_db, target_db, timeline),
+                    writer,
+                )
+            writer.raise_errors()
+    sys.stdout = sys.__stdout__
+    print(json.dumps(measures))
+
+
+def run_benchmark(template, grid, work_directory, output):
+    os.makedirs(work_directory, exist_ok=True)
+    results = []
+    for case in grids[grid]:
+        name = case_name(case)
+        source_path = os.path.abspath(os.path.join(work_directory, f"{name}.sqlite"))
+        source_url = f"sqlite:///{source_path}"
+        if not os.path.exists(source_path):
+            generate_source(source_url, **case)
+        for mode in ("main", "stages"):
+            target_path = os.path.abspath(
+                os.path.join(work_directory, f"{name}_{mode}_target.sqlite")
+            )
+            if os.path.exists(target_path):
+                os.remove(target_path)
+            target_url = f"sqlite:///{target_path}"
+            create_target(target_url, template)
+            if mode == "main":
+                measures = [run_main(source_url, target_url)]
+            else:
+                measures = run_stages(source_url, target_url)
+            for measure in measures:
+                results.append(dict(case, **measure))
+                if "peak_rss_mb" in measure:
+                    memory = f"{measure['peak_rss_mb']:9.1f} MB rss"
+                else:
+                    memory = f"{measure['peak_above_start_mb']:9.1f} MB stage"
+                print(
+                    f"{name:<50} {measure['stage']:<36} {measure['wall_time']:9.3f} s"
+                    f" {memory} {measure['rows_written']:>9} rows"
+                )
+    with open(output, "w") as file:
+        json.dump(results, file, indent=1)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "--stages":
+        measure_stages(sys.argv[2], sys.argv[3])
+        exit()
+    if len(sys.argv) < 2:
+        exit(
+            "Please provide a SpineOpt template json file or database url, optionally "
+            "followed by --grid=small|medium|large, --work=<directory> and "
+            "--output=<results json>"
+        )
+    options = {"grid": "small", "work": "benchmark", "output": "benchmark.json"}
+    for argument in sys.argv[2:]:
+        name, _, value = argument[2:].partition("=")
+        options[name] = value
+    run_benchmark(sys.argv[1], options["grid"], options["work"], options["output"])
@@ -0,0 +1,410 @@
+from spinedb_api import DatabaseMapping, Map, Array, DateTime, Duration, to_database
+import numpy as np
+import sys
+
+# source entity classes and their dimensions, as read by ines_to_spineopt.py
+entity_classes = {
+    "solve_pattern": (),
+    "period": (),
+    "node": (),
+    "unit": (),
+    "link": (),
+    "set": (),
+    "unit__to_node": ("unit", "node"),
+    "node__to_unit": ("node", "unit"),
+    "node__link__node": ("node", "link", "node"),
+    "unit_flow__unit_flow": ("unit__to_node", "node__to_unit"),
+    "set__node": ("set", "node"),
+    "set__unit": ("set", "unit"),
+    "set__link": ("set", "link"),
+    "set__unit_flow": ("set", "unit__to_node"),
+}
+
+parameter_definitions = {
+    "solve_pattern": ["period", "duration", "start_time", "time_resolution"],
+    "period": ["start_time", "years_represented"],
+    "node": [
+        "node_type",
+        "flow_profile",
+        "flow_scaling_method",
+        "flow_annual",
+        "co2_content",
+        "commodity_price",
+        "storage_capacity",
+        "storage_state_fix_method",
+        "storage_state_fix",
+        "storage_state_binding_method",
+        "storage_state_lower_limit",
+        "storage_state_upper_limit",
+        "storage_investment_method",
+        "storage_retirement_method",
+        "storage_investment_cost",
+        "storage_fixed_cost",
+        "storage_lifetime",
+        "storages_existing",
+        "storages_max_cumulative",
+    ],
+    "unit": [
+        "availability",
+        "investment_method",
+        "retirement_method",
+        "units_existing",
+        "lifetime",
+    ],
+    "link": [
+        "availability",
+        "investment_method",
+        "retirement_method",
+        "investment_cost",
+        "links_existing",
+        "links_max_cumulative",
+        "lifetime",
+    ],
+    "set": ["co2_max_cumulative", "max_cumulative", "flow_max_cumulative"],
+    "unit__to_node": [
+        "capacity",
+        "profile_fix",
+        "profile_limit_upper",
+        "investment_cost",
+        "fixed_cost",
+        "other_operational_cost",
+    ],
+    "node__to_unit": ["capacity", "fixed_cost", "other_operational_cost"],
+    "node__link__node": ["capacity", "efficiency", "operational_cost"],
+    "unit_flow__unit_flow": ["equality_ratio", "less_than_ratio"],
+}
+
+# commodity nodes feeding the units, with their co2 content
+commodities = {"coal": 0.34, "gas": 0.2}
+
+
+def add_value(db_map, class_name, byname, parameter, value, alternative="Base"):
+    db_value, value_type = to_database(value)
+    _, error = db_map.add_parameter_value_item(
+        entity_class_name=class_name,
+        entity_byname=byname,
+        parameter_definition_name=parameter,
+        alternative_name=alternative,
+        value=db_value,
+        type=value_type,
+    )
+    if error:
+        raise RuntimeError(error)
+
+
+def add_entity(db_map, class_name, byname):
+    _, error = db_map.add_entity_item(
+        entity_class_name=class_name, entity_byname=byname
+    )
+    if error:
+        raise RuntimeError(error)
+
+
+def generate_source(
+    url,
+    nodes=10,
+    units=20,
+    links=5,
+    sets=2,
+    periods=2,
+    weather_years=3,
+    steps=168,
+    first_period_year=2030,
+    first_weather_year=2015,
+    seed=0,
+):
+    """Builds an INES source database that ines_to_spineopt.py can convert.
+
+    Every node has a historical flow profile covering all weather years, units
+    alternate between fixed and investable capacity, and the first set limits
+    co2 emissions while the others limit investments.
+    """
+    rng = np.random.default_rng(seed)
+    period_names = [f"p{first_period_year + 5 * i}" for i in range(periods)]
+    years = [first_weather_year + i for i in range(weather_years)]
+    # one step more than the solve so that the last window is complete
+    history = []
+    for year in years:
+        history += (
+            (np.datetime64(f"{year}-01-01T00:00:00") + np.arange(steps + 1) * 3600)
+            .astype("datetime64[s]")
+            .astype(str)
+            .tolist()
+        )
+
+    def period_map(values):
+        return Map(
+            period_names, [float(value) for value in values], index_name="period"
+        )
+
+    def historical_map(scale=1.0):
+        return Map(
+            [DateTime(index) for index in history],
+            (scale * rng.random(len(history))).tolist(),
+            index_name="time",
+        )
+
+    with DatabaseMapping(url, create=True) as db_map:
+        for class_name, dimensions in entity_classes.items():
+            db_map.add_entity_class_item(
+                name=class_name, dimension_name_list=dimensions
+            )
+        for class_name, parameters in parameter_definitions.items():
+            for parameter in parameters:
+                db_map.add_parameter_definition_item(
+                    entity_class_name=class_name, name=parameter
+                )
+        db_map.add_alternative_item(name="high_prices")
+        db_map.add_scenario_item(name="base")
+        db_map.add_scenario_item(name="high_prices")
+        db_map.add_scenario_alternative_item(
+            scenario_name="base", alternative_name="Base", rank=1
+        )
+        db_map.add_scenario_alternative_item(
+            scenario_name="high_prices", alternative_name="Base", rank=1
+        )
+        db_map.add_scenario_alternative_item(
+            scenario_name="high_prices", alternative_name="high_prices", rank=2
+        )
+
+        ## solve pattern and periods
+        add_entity(db_map, "solve_pattern", ("model",))
+        add_value(db_map, "solve_pattern", ("model",), "period", Array(period_names))
+        add_value(
+            db_map,
+            "solve_pattern",
+            ("model",),
+            "start_time",
+            Array([DateTime(f"{year}-01-01T00:00:00") for year in years]),
+        )
+        add_value(
+            db_map, "solve_pattern", ("model",), "duration", Duration(f"{steps}h")
+        )
+        add_value(
+            db_map, "solve_pattern", ("model",), "time_resolution", Duration("1h")
+        )
+        for i, period in enumerate(period_names):
+            add_entity(db_map, "period", (period,))
+            add_value(
+                db_map,
+                "period",
+                (period,),
+                "start_time",
+                DateTime(f"{first_period_year + 5 * i}-01-01T00:00:00"),
+            )
+            add_value(db_map, "period", (period,), "years_represented", 5.0)
+
+        ## nodes
+        demand_nodes = [f"node_{i}" for i in range(nodes)]
+        co2_set = "co2_limit"
+        for node in demand_nodes:
+            add_entity(db_map, "node", (node,))
+        for node in list(commodities) + ["CO2", co2_set]:
+            add_entity(db_map, "node", (node,))
+            add_value(db_map, "node", (node,), "node_type", "commodity")
+        for node, co2_content in commodities.items():
+            add_value(db_map, "node", (node,), "co2_content", co2_content)
+            add_value(
+                db_map,
+                "node",
+                (node,),
+                "commodity_price",
+                period_map(20.0 + rng.random(periods)),
+            )
+            add_value(
+                db_map,
+                "node",
+                (node,),
+                "commodity_price",
+                period_map(40.0 + rng.random(periods)),
+                "high_prices",
+            )
+        add_value(db_map, "node", ("CO2",), "co2_content", 1.0)
+        scaling_methods = ["scale_to_annual", "use_profile_directly"]
+        for i, node in enumerate(demand_nodes):
+            add_value(db_map, "node", (node,), "flow_profile", historical_map())
+            add_value(
+                db_map,
+                "node",
+                (node,),
+                "flow_scaling_method",
+                scaling_methods[i % len(scaling_methods)],
+            )
+            add_value(
+                db_map,
+                "node",
+                (node,),
+                "flow_annual",
+                period_map(1000.0 * (1.0 + rng.random(periods))),
+            )
+            if i % 3:
+                continue
+            # every third node stores energy
+            add_value(db_map, "node", (node,), "node_type", "storage")
+            add_value(db_map, "node", (node,), "storage_capacity", 100.0)
+            add_value(db_map, "node", (node,), "storage_state_fix_method", "fix_start")
+            add_value(db_map, "node", (node,), "storage_state_fix", 0.5)
+            add_value(
+                db_map,
+                "node",
+                (node,),
+                "storage_state_binding_method",
+                "leap_over_within_period",
+            )
+            add_value(db_map, "node", (node,), "storage_state_lower_limit", 0.1)
+            add_value(db_map, "node", (node,), "storage_state_upper_limit", 0.9)
+            add_value(db_map, "node", (node,), "storage_lifetime", 20.0)
+            if i % 2:
+                add_value(
+                    db_map, "node", (node,), "storage_investment_method", "not_allowed"
+                )
+                add_value(
+                    db_map, "node", (node,), "storage_retirement_method", "not_retired"
+                )
+                add_value(db_map, "node", (node,), "storages_existing", 1.0)
+            else:
+                add_value(
+                    db_map, "node", (node,), "storage_investment_method", "no_limits"
+                )
+                add_value(
+                    db_map,
+                    "node",
+                    (node,),
+                    "storage_investment_cost",
+                    period_map(500.0 * np.ones(periods)),
+                )
+                add_value(db_map, "node", (node,), "storage_fixed_cost", 8760.0)
+
+        ## units
+        unit_names = [f"unit_{i}" for i in range(units)]
+        fuels = list(commodities)
+        for i, unit in enumerate(unit_names):
+            output = demand_nodes[i % nodes]
+            add_entity(db_map, "unit", (unit,))
+            add_entity(db_map, "unit__to_node", (unit, output))
+            add_value(db_map, "unit__to_node", (unit, output), "capacity", 100.0)
+            add_value(db_map, "unit__to_node", (unit, output), "fixed_cost", 8760.0)
+            add_value(
+                db_map, "unit__to_node", (unit, output), "other_operational_cost", 2.0
+            )
+            add_value(db_map, "unit", (unit,), "lifetime", 30.0)
+            add_value(
+                db_map,
+                "unit",
+                (unit,),
+                "availability",
+                period_map(0.9 * np.ones(periods)),
+            )
+            if i % 3 == 2:
+                # variable renewable, follows a historical profile
+                add_value(
+                    db_map,
+                    "unit__to_node",
+                    (unit, output),
+                    "profile_limit_upper",
+                    historical_map(),
+                )
+            else:
+                fuel = fuels[i % len(fuels)]
+                add_entity(db_map, "node__to_unit", (fuel, unit))
+                add_value(
+                    db_map, "node__to_unit", (fuel, unit), "other_operational_cost", 1.0
+                )
+                add_entity(db_map, "unit_flow__unit_flow", (unit, output, fuel, unit))
+                if i % 2:
+                    ratio = 0.4 + 0.1 * rng.random()
+                else:
+                    ratio = period_map(0.4 + 0.1 * rng.random(periods))
+                add_value(
+                    db_map,
+                    "unit_flow__unit_flow",
+                    (unit, output, fuel, unit),
+                    "equality_ratio",
+                    ratio,
+                )
+            if i % 2:
+                add_value(db_map, "unit", (unit,), "investment_method", "not_allowed")
+                add_value(db_map, "unit", (unit,), "retirement_method", "not_retired")
+                add_value(db_map, "unit", (unit,), "units_existing", 1.0)
+            else:
+                add_value(db_map, "unit", (unit,), "investment_method", "no_limits")
+                add_value(
+                    db_map,
+                    "unit__to_node",
+                    (unit, output),
+                    "investment_cost",
+                    period_map(1000.0 * (1.0 - 0.1 * np.arange(periods))),
+                )
+
+        ## links between neighbouring nodes
+        for i in range(links):
+            link = f"link_{i}"
+            node_from = demand_nodes[i % nodes]
+            node_to = demand_nodes[(i + 1) % nodes]
+            add_entity(db_map, "link", (link,))
+            add_entity(db_map, "node__link__node", (node_from, link, node_to))
+            add_value(
+                db_map, "node__link__node", (node_from, link, node_to), "capacity", 50.0
+            )
+            add_value(
+                db_map,
+                "node__link__node",
+                (node_from, link, node_to),
+                "efficiency",
+                0.98,
+            )
+            add_value(db_map, "link", (link,), "lifetime", 40.0)
+            if i % 2:
+                add_value(db_map, "link", (link,), "investment_method", "not_allowed")
+                add_value(db_map, "link", (link,), "retirement_method", "not_retired")
+                add_value(db_map, "link", (link,), "links_existing", 1.0)
+            else:
+                add_value(db_map, "link", (link,), "investment_method", "no_limits")
+                add_value(
+                    db_map,
+                    "link",
+                    (link,),
+                    "investment_cost",
+                    period_map(800.0 * np.ones(periods)),
+                )
+
+        ## sets, the first one caps emissions, the others investments
+        add_entity(db_map, "set", (co2_set,))
+        add_value(
+            db_map,
+            "set",
+            (co2_set,),
+            "co2_max_cumulative",
+            period_map(1e6 * (1.0 - 0.2 * np.arange(periods))),
+        )
+        for i in range(sets):
+            set_name = f"set_{i}"
+            add_entity(db_map, "set", (set_name,))
+            add_value(db_map, "set", (set_name,), "max_cumulative", 10.0 * (i + 1))
+            for unit in unit_names[i::sets]:
+                add_entity(db_map, "set__unit", (set_name, unit))
+            for node in demand_nodes[i::sets]:
+                add_entity(db_map, "set__node", (set_name, node))
+            for j in range(i, links, sets):
+                add_entity(db_map, "set__link", (set_name, f"link_{j}"))
+        db_map.commit_session("Generated INES test database")
+
+
+def parse_options(arguments):
+    options = {}
+    for argument in arguments:
+        if not argument.startswith("--") or "=" not in argument:
+            exit(f"Unknown argument {argument}, options are of the form --nodes=10")
+        name, value = argument[2:].split("=", 1)
+        options[name.replace("-", "_")] = int(value)
+    return options
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        exit(
+            "Please provide the url of the database to create, e.g. "
+            "sqlite:///ines_test.sqlite, optionally followed by --nodes=, --units=, "
+            "--links=, --sets=, --periods=, --weather-years= and --steps="
+        )
+    generate_source(sys.argv[1], **parse_options(sys.argv[2:]))
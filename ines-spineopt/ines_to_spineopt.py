@@ -1,13 +1,51 @@
-import spinedb_api as api
-from spinedb_api import DatabaseMapping, DateTime, Map, to_database
-from spinedb_api.parameter_value import convert_map_to_table, IndexedValue
-from sqlalchemy.exc import DBAPIError
-import yaml
+from __future__ import annotations
+from dataclasses import dataclass
+import dataclasses
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import importlib.util
+import multiprocessing
+import functools
+import argparse
 import sys
-from ines_tools import ines_transform
-import pandas as pd
 import json
-import numpy as np
+import time
+import tracemalloc
+import cProfile
+import codecs
+import contextlib
+import zipfile
+import io
+import hashlib
+import os
+import gc
+import re
+
+
+def lazy_import(name):
+    """Returns a module that is only loaded when first used, keeps startup fast."""
+    if name in sys.modules:
+        return sys.modules[name]
+    spec = importlib.util.find_spec(name)
+    if spec is None:
+        raise ModuleNotFoundError(f"No module named {name!r}", name=name)
+    spec.loader = importlib.util.LazyLoader(spec.loader)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+def load_now(module):
+    """Loads a module of lazy_import right away instead of on its first use."""
+    # LazyLoader executes the module on the first access to its attributes
+    vars(module)
+    return module
+
+
+api = lazy_import("spinedb_api")
+yaml = lazy_import("yaml")
+pd = lazy_import("pandas")
+np = lazy_import("numpy")
 
 
 def nested_index_names(value, names=None, depth=0):
@@ -20,7 +58,7 @@ def nested_index_names(value, names=None, depth=0):
             f"Index names at depth {depth} do no match: {value.index_name} vs. {names[-1]}"
         )
     for y in value.values:
-        if isinstance(y, IndexedValue):
+        if isinstance(y, api.IndexedValue):
             nested_index_names(y, names, depth + 1)
     return names
 
@@ -33,37 +71,665 @@ operations = {
     "constant": lambda x, y: y,
 }
 
-if len(sys.argv) > 1:
-    url_db_in = sys.argv[1]
-else:
-    exit(
-        "Please provide input database url and output database url as arguments. They should be of the form "
-        "sqlite:///path/db_file.sqlite"
-        ""
-    )
-if len(sys.argv) > 2:
-    url_db_out = sys.argv[2]
-else:
-    exit(
-        "Please provide input database url and output database url as arguments. They should be of the form "
-        "sqlite:///path/db_file.sqlite"
-        ""
+
+@dataclass
+class ConversionOptions:
+    """Settings of a conversion run, see convert."""
+
+    source_url: str = None
+    target_url: str = None
+    # directory of the yaml mappings and settings.yaml
+    config_dir: str = os.path.dirname(os.path.abspath(__file__))
+    # worker processes for the conversion stages
+    jobs: int = 1
+    # only write what changed into the existing target
+    incremental: bool = False
+    # read historical maps pair by pair instead of parsing them whole
+    stream: bool = False
+    # drop values repeating the Base alternative
+    dedupe: bool = False
+    # write period series with a start and resolution instead of time stamps
+    compact: bool = False
+    # per stage profile report and cProfile dumps
+    profile: str = None
+    cprofile: str = None
+    # directory and size in megabytes of the converted value cache
+    cache: str = None
+    cache_size: float = 1024.0
+    # read the source in pages and commit the target in chunks, with an optional
+    # ceiling in megabytes of resident memory
+    low_memory: bool = False
+    page_size: int = 10000
+    memory_limit: float = None
+    # skip the stages the checkpoint journal of the target records as committed
+    resume: bool = False
+    # SpineOpt template json file or database url, creates missing sqlite targets
+    template: str = None
+    # operational resolution of the target, e.g. 3h, a multiple of the source
+    # time_resolution; the time series are resampled to it
+    resolution: str = None
+    # number and length of the representative periods clustered from the
+    # profiles listed in settings.yaml, e.g. 8 and 1D
+    representative_periods: int = None
+    representative_length: str = "1D"
+
+
+# options of the running conversion, set by configure
+options = ConversionOptions()
+value_cache = None
+
+
+def configure(new_options):
+    global options, value_cache
+    options = new_options
+    if options.memory_limit is not None and not options.low_memory:
+        options = dataclasses.replace(options, low_memory=True)
+    value_cache = None
+    if options.cache is not None:
+        value_cache = ValueCache(options.cache, int(options.cache_size * 1024 * 1024))
+
+
+config_files = {
+    "entities_to_copy": "ines_to_spineopt_entities.yaml",
+    "parameter_transforms": "ines_to_spineopt_parameters.yaml",
+    "parameter_methods": "ines_to_spineopt_methods.yaml",
+    "entities_to_parameters": "ines_to_spineopt_entities_to_parameters.yaml",
+    "settings": "settings.yaml",
+}
+
+
+@functools.lru_cache(maxsize=None)
+def load_config(config_dir):
+    """Reads the yaml mappings and settings of config_dir, once per directory."""
+    config = {}
+    for name, file_name in config_files.items():
+        with open(os.path.join(config_dir, file_name), "r") as file:
+            if name in ("parameter_methods", "settings"):
+                config[name] = yaml.safe_load(file)
+            else:
+                config[name] = yaml.load(file, yaml.BaseLoader)
+    return config
+
+
+@dataclass(frozen=True)
+class SerializedValue:
+    """A parameter value already in database form, written as is."""
+
+    value: bytes
+    type: str
+
+
+def serialize(value):
+    if isinstance(value, SerializedValue):
+        return value.value, value.type
+    return api.to_database(value)
+
+
+class BulkWriter:
+    """Buffers additions to a DatabaseMapping and adds them in batches.
+
+    Can be used in place of the DatabaseMapping by every stage: reads and other
+    calls are forwarded to the wrapped mapping after flushing the buffer.
+    Duplicate entities, alternatives and scenarios are reported immediately,
+    other errors are collected and raised together by ``raise_errors``.
+    """
+
+    # items are added in this order so that references resolve
+    item_types = (
+        "alternative",
+        "scenario",
+        "scenario_alternative",
+        "entity",
+        "entity_group",
+        "parameter_value",
     )
 
-with open("ines_to_spineopt_entities.yaml", "r") as file:
-    entities_to_copy = yaml.load(file, yaml.BaseLoader)
-with open("ines_to_spineopt_parameters.yaml", "r") as file:
-    parameter_transforms = yaml.load(file, yaml.BaseLoader)
-with open("ines_to_spineopt_methods.yaml", "r") as file:
-    parameter_methods = yaml.safe_load(file)
-with open("ines_to_spineopt_entities_to_parameters.yaml", "r") as file:
-    entities_to_parameters = yaml.load(file, yaml.BaseLoader)
-with open("settings.yaml", "r") as file:
-    settings = yaml.safe_load(file)
+    def __init__(
+        self,
+        db_map: api.DatabaseMapping,
+        batch_size: int = 100000,
+        commit_size: int = None,
+        memory_limit: float = None,
+    ):
+        self._db_map = db_map
+        self._batch_size = batch_size
+        self._buffer = {item_type: [] for item_type in self.item_types}
+        self._buffered_keys = {item_type: set() for item_type in self.item_types}
+        self._buffer_size = 0
+        # low-memory mode: commit every commit_size items or when the resident
+        # memory exceeds memory_limit megabytes
+        self._commit_size = commit_size
+        self._memory_limit = memory_limit
+        self._uncommitted = 0
+        self._over_limit_reported = False
+        # with a checkpoint journal, stages commit through checkpoint only
+        self.defer_commits = False
+        self._deferred_comment = None
+        # called before a low-memory chunk is committed in the middle of a stage
+        self.on_chunk_commit = None
+        # number of items taken in, for reporting
+        self.added = 0
+        self.errors = []
+        # commits written to the database and their duration, for reporting
+        self.commits = 0
+        self.commit_time = 0.0
+
+    def __getattr__(self, name):
+        attribute = getattr(self._db_map, name)
+        if not callable(attribute):
+            return attribute
+
+        def flushed_call(*args, **kwargs):
+            self.flush()
+            return attribute(*args, **kwargs)
+
+        return flushed_call
+
+    def _buffer_item(self, item_type, key, item, existing, exist_ok=False):
+        if key in self._buffered_keys[item_type] or (existing and existing()):
+            if exist_ok:
+                return None, None
+            return None, f"there's already a {item_type} with {key}"
+        self._buffered_keys[item_type].add(key)
+        self._buffer[item_type].append(item)
+        self._buffer_size += 1
+        self.added += 1
+        if self._buffer_size >= self._batch_size:
+            self.flush()
+        return item, None
+
+    def add_alternative_item(self, exist_ok=False, **item):
+        return self._buffer_item(
+            "alternative",
+            item["name"],
+            item,
+            lambda: self._db_map.get_alternative_item(name=item["name"]),
+            exist_ok,
+        )
+
+    def add_scenario_item(self, **item):
+        return self._buffer_item(
+            "scenario",
+            item["name"],
+            item,
+            lambda: self._db_map.get_scenario_item(name=item["name"]),
+        )
+
+    def add_scenario_alternative_item(self, **item):
+        return self._buffer_item(
+            "scenario_alternative",
+            (item["scenario_name"], item["alternative_name"]),
+            item,
+            None,
+        )
+
+    def add_entity_item(self, exist_ok=False, **item):
+        if "entity_byname" not in item:
+            item["entity_byname"] = (item["name"],)
+        key = (item["entity_class_name"], tuple(item["entity_byname"]))
+        return self._buffer_item(
+            "entity",
+            key,
+            item,
+            lambda: self._db_map.get_entity_item(
+                entity_class_name=key[0], entity_byname=key[1]
+            ),
+            exist_ok,
+        )
+
+    def add_entity_group_item(self, **item):
+        key = (item["entity_class_name"], item["group_name"], item["member_name"])
+        return self._buffer_item("entity_group", key, item, None)
+
+    def add_parameter_value(self, class_name, parameter, alternative, elements, value):
+        # values are serialized when the buffer is flushed
+        key = (class_name, tuple(elements), parameter, alternative)
+        return self._buffer_item("parameter_value", key, (key, value), None)
+
+    def _take_buffer(self):
+        buffer = self._buffer
+        self._buffer = {item_type: [] for item_type in self.item_types}
+        self._buffered_keys = {item_type: set() for item_type in self.item_types}
+        self._buffer_size = 0
+        parameter_values = []
+        for entry in buffer["parameter_value"]:
+            if isinstance(entry, dict):
+                # already serialized by a stage worker
+                parameter_values.append(entry)
+                continue
+            key, value = entry
+            class_name, elements, parameter, alternative = key
+            db_value, value_type = serialize(value)
+            parameter_values.append(
+                {
+                    "entity_class_name": class_name,
+                    "entity_byname": elements,
+                    "parameter_definition_name": parameter,
+                    "alternative_name": alternative,
+                    "value": db_value,
+                    "type": value_type,
+                }
+            )
+        buffer["parameter_value"] = parameter_values
+        return buffer
+
+    def flush(self):
+        if not self._buffer_size:
+            return
+        buffer = self._take_buffer()
+        for item_type in self.item_types:
+            if buffer[item_type]:
+                added, errors = self._db_map.add_items(
+                    item_type, *buffer[item_type], strict=False
+                )
+                self.errors += [error for error in errors if error]
+                # failed items leave nothing to commit
+                self._uncommitted += sum(1 for item in added if item)
+        if self._commit_size is not None and (
+            self._uncommitted >= self._commit_size
+            or (
+                self._memory_limit is not None
+                and resident_memory() > self._memory_limit
+            )
+        ):
+            self._commit_chunk()
+
+    def _commit_chunk(self):
+        if self.on_chunk_commit is not None:
+            self.on_chunk_commit()
+        self._commit("Low-memory conversion chunk")
+        self._uncommitted = 0
+
+    def _commit(self, comment):
+        start = time.perf_counter()
+        result = self._db_map.commit_session(comment)
+        self.commits += 1
+        self.commit_time += time.perf_counter() - start
+        return result
+
+    def release(self):
+        """Commits what was added so far and drops the items the mapping holds.
+
+        Items read from the target before are invalid afterwards, run_stages
+        calls this between stages in low-memory mode.
+        """
+        self.flush()
+        if self._uncommitted:
+            self._commit_chunk()
+        self._db_map.reset()
+        gc.collect()
+        if (
+            self._memory_limit is not None
+            and not self._over_limit_reported
+            and resident_memory() > self._memory_limit
+        ):
+            self._over_limit_reported = True
+            print(
+                f"resident memory {resident_memory():.0f} MB stays above the "
+                f"{self._memory_limit:.0f} MB limit after releasing the target"
+            )
+
+    def replay(self, recorded):
+        """Adds the items and commits recorded by a StageRecorder.
+
+        A duplicate or a failed commit raises like it does when the stage runs
+        on the target itself.
+        """
+        for item_type, item in recorded:
+            error = None
+            if item_type == "commit":
+                try:
+                    self.commit_session(item)
+                except api.exception.NothingToCommit:
+                    pass
+            elif item_type == "parameter_value":
+                key = (
+                    item["entity_class_name"],
+                    tuple(item["entity_byname"]),
+                    item["parameter_definition_name"],
+                    item["alternative_name"],
+                )
+                _, error = self._buffer_item("parameter_value", key, item, None)
+            else:
+                # duplicates within the stage were reported in the worker, what
+                # is left were added by an earlier stage
+                _, error = getattr(self, f"add_{item_type}_item")(**item)
+            if error:
+                raise RuntimeError(error)
+
+    def commit_session(self, comment):
+        self.flush()
+        if self.defer_commits:
+            self._deferred_comment = comment
+            return
+        if self._commit_size is not None and not self._uncommitted:
+            # everything was committed with the last chunk
+            return
+        self._uncommitted = 0
+        return self._commit(comment)
+
+    def checkpoint(self, comment):
+        """Commits everything added since the last checkpoint.
+
+        The last comment a stage committed with is used if there is one.
+        """
+        self.flush()
+        comment = self._deferred_comment or comment
+        self._deferred_comment = None
+        if not self._uncommitted:
+            return
+        self._uncommitted = 0
+        self._commit(comment)
+
+    def raise_errors(self):
+        self.flush()
+        if self.errors:
+            raise RuntimeError(
+                f"{len(self.errors)} items could not be added:\n"
+                + "\n".join(self.errors)
+            )
+
+
+class StageRecorder(BulkWriter):
+    """Records the additions of a stage run in a worker process.
+
+    Nothing is written, the recorded items are handed back to the process owning
+    the target database and applied there with ``BulkWriter.replay``. Duplicates
+    within the stage are reported like in BulkWriter, the target itself can not
+    be read.
+    """
+
+    def __init__(self, batch_size: int = 100000):
+        super().__init__(None, batch_size)
+        self.recorded = []
+
+    def __getattr__(self, name):
+        raise AttributeError(f"stage workers can not read the target database ({name})")
+
+    def _buffer_item(self, item_type, key, item, existing, exist_ok=False):
+        if exist_ok and key not in self._buffered_keys[item_type]:
+            # an earlier stage may have added it to the target, replay checks
+            item = dict(item, exist_ok=True)
+        return super()._buffer_item(item_type, key, item, None, exist_ok)
+
+    def flush(self):
+        if not self._buffer_size:
+            return
+        buffer = self._take_buffer()
+        for item_type in self.item_types:
+            self.recorded += [(item_type, item) for item in buffer[item_type]]
+
+    def commit_session(self, comment):
+        self.flush()
+        self.recorded.append(("commit", comment))
+
+
+class SourceSnapshot:
+    """Read-only in-memory index of the entities and parameter values of a source database.
+
+    Answers get_entity_item(s) and get_parameter_value_item(s) queries with
+    dictionary lookups. Other calls are forwarded to the wrapped mapping.
+    """
+
+    def __init__(self, db_map: api.DatabaseMapping):
+        self._db_map = db_map
+        self._entities_by_class = {}
+        self._entities_by_byname = {}
+        self._entity_by_key = {}
+        for entity in db_map.get_entity_items():
+            class_name = entity["entity_class_name"]
+            byname = tuple(entity["entity_byname"])
+            self._entities_by_class.setdefault(class_name, []).append(entity)
+            self._entities_by_byname.setdefault(byname, []).append(entity)
+            self._entity_by_key[class_name, byname] = entity
+        self._values_by_class = {}
+        self._values_by_parameter = {}
+        self._value_by_key = {}
+        for value in db_map.get_parameter_value_items():
+            class_name = value["entity_class_name"]
+            parameter = value["parameter_definition_name"]
+            self._values_by_class.setdefault(class_name, []).append(value)
+            self._values_by_parameter.setdefault(parameter, []).append(value)
+            key = (
+                class_name,
+                parameter,
+                tuple(value["entity_byname"]),
+                value["alternative_name"],
+            )
+            self._value_by_key[key] = value
+
+    def __getattr__(self, name):
+        return getattr(self._db_map, name)
+
+    @staticmethod
+    def _filter(items, filters):
+        filters = {
+            field: tuple(value) if field == "entity_byname" else value
+            for field, value in filters.items()
+        }
+        return [
+            item
+            for item in items
+            if all(
+                (tuple(item[field]) if field == "entity_byname" else item[field])
+                == value
+                for field, value in filters.items()
+            )
+        ]
+
+    def get_entity_items(self, **filters):
+        if "entity_byname" in filters:
+            items = self._entities_by_byname.get(
+                tuple(filters.pop("entity_byname")), []
+            )
+        elif "entity_class_name" in filters:
+            items = self._entities_by_class.get(filters.pop("entity_class_name"), [])
+        else:
+            items = [
+                entity
+                for entities in self._entities_by_class.values()
+                for entity in entities
+            ]
+        return self._filter(items, filters) if filters else list(items)
+
+    def get_entity_item(self, **filters):
+        if set(filters) == {"entity_class_name", "entity_byname"}:
+            key = (filters["entity_class_name"], tuple(filters["entity_byname"]))
+            return self._entity_by_key.get(key, {})
+        items = self.get_entity_items(**filters)
+        return items[0] if items else {}
+
+    def get_parameter_value_items(self, **filters):
+        if "parameter_definition_name" in filters:
+            items = self._values_by_parameter.get(
+                filters.pop("parameter_definition_name"), []
+            )
+        elif "entity_class_name" in filters:
+            items = self._values_by_class.get(filters.pop("entity_class_name"), [])
+        else:
+            items = [
+                value for values in self._values_by_class.values() for value in values
+            ]
+        return self._filter(items, filters) if filters else list(items)
+
+    def get_parameter_value_item(self, **filters):
+        if set(filters) == {
+            "entity_class_name",
+            "parameter_definition_name",
+            "entity_byname",
+            "alternative_name",
+        }:
+            key = (
+                filters["entity_class_name"],
+                filters["parameter_definition_name"],
+                tuple(filters["entity_byname"]),
+                filters["alternative_name"],
+            )
+            return self._value_by_key.get(key, {})
+        items = self.get_parameter_value_items(**filters)
+        return items[0] if items else {}
+
+
+def resident_memory():
+    """Returns the resident memory of this process in megabytes."""
+    try:
+        with open("/proc/self/statm") as statm:
+            pages_ = int(statm.read().split()[1])
+        return pages_ * os.sysconf("SC_PAGE_SIZE") / 1024 / 1024
+    except (OSError, ValueError):
+        # peak instead of current where /proc is missing
+        import resource
+
+        usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return usage / 1024 / (1024 if sys.platform == "darwin" else 1)
+
+
+def pages(items):
+    """Yields the items in lists of at most options.page_size in low-memory mode.
+
+    Items of a PagedSource are read from the database one page at a time,
+    anything else is yielded whole as a single page.
+    """
+    if options.low_memory and isinstance(items, ValuePages):
+        yield from items.pages(options.page_size)
+    else:
+        yield items
+
+
+class PagedValue(dict):
+    """A parameter value row of a PagedSource, parsed on first use."""
+
+    def __missing__(self, key):
+        if key != "parsed_value":
+            raise KeyError(key)
+        self[key] = api.from_database(self["value"], self["type"])
+        return self[key]
+
+
+class ValuePages:
+    """Parameter values matching a query of a PagedSource.
+
+    Nothing is kept: every iteration runs the query again and reads the rows in
+    pages, len and truth value are answered by the database.
+    """
+
+    def __init__(self, source, filters):
+        self._source = source
+        self._filters = filters
+
+    def _query(self):
+        return self._source._value_query(self._filters)
+
+    def pages(self, page_size):
+        page = []
+        for value in self._source._values(
+            self._query().yield_per(page_size), self._filters
+        ):
+            page.append(value)
+            if len(page) >= page_size:
+                yield page
+                page = []
+        if page:
+            yield page
+
+    def __iter__(self):
+        for page in self.pages(options.page_size):
+            yield from page
+
+    def __len__(self):
+        if self._source._python_filters(self._filters):
+            return len(list(self))
+        return self._query().count()
+
+    def __bool__(self):
+        return any(True for _ in self)
+
+    def __getitem__(self, index):
+        return list(self)[index]
+
+
+class PagedSource(SourceSnapshot):
+    """Source reader of the low-memory mode.
+
+    Entities are indexed in memory like in SourceSnapshot but parameter values
+    are queried from the database on every call and parsed only when used, so
+    that at most a page of them is held at a time.
+    """
+
+    value_columns = {
+        "entity_class_name": "entity_class_name",
+        "parameter_definition_name": "parameter_name",
+        "alternative_name": "alternative_name",
+    }
+
+    def __init__(self, db_map: api.DatabaseMapping):
+        self._db_map = db_map
+        self._entities_by_class = {}
+        self._entities_by_byname = {}
+        self._entity_by_key = {}
+        self._byname_by_id = {}
+        for entity in db_map.get_entity_items():
+            class_name = entity["entity_class_name"]
+            byname = tuple(entity["entity_byname"])
+            self._entities_by_class.setdefault(class_name, []).append(entity)
+            self._entities_by_byname.setdefault(byname, []).append(entity)
+            self._entity_by_key[class_name, byname] = entity
+            # ids of the mapping resolve to the database ids the queries return
+            self._byname_by_id[getattr(entity["id"], "db_id", entity["id"])] = byname
+        # the values copied by copy_generic are not needed anymore
+        db_map.reset("parameter_value")
+        gc.collect()
+
+    def _python_filters(self, filters):
+        return {
+            field: value
+            for field, value in filters.items()
+            if field not in self.value_columns and field != "entity_byname"
+        }
+
+    def _value_query(self, filters):
+        subquery = self._db_map.entity_parameter_value_sq
+        query = self._db_map.query(subquery)
+        for field, value in filters.items():
+            if field in self.value_columns:
+                query = query.filter(
+                    getattr(subquery.c, self.value_columns[field]) == value
+                )
+            elif field == "entity_byname":
+                ids = [
+                    getattr(entity["id"], "db_id", entity["id"])
+                    for entity in self._entities_by_byname.get(tuple(value), [])
+                ]
+                query = query.filter(subquery.c.entity_id.in_(ids))
+        return query.order_by(subquery.c.id)
+
+    def _values(self, rows, filters):
+        python_filters = self._python_filters(filters)
+        for row in rows:
+            value = PagedValue(
+                id=row.id,
+                entity_class_name=row.entity_class_name,
+                entity_name=row.entity_name,
+                entity_byname=self._byname_by_id[row.entity_id],
+                parameter_definition_name=row.parameter_name,
+                alternative_name=row.alternative_name,
+                value=row.value,
+                type=row.type,
+            )
+            if not python_filters or self._filter([value], python_filters):
+                yield value
+
+    def get_parameter_value_items(self, **filters):
+        items = ValuePages(self, filters)
+        # values of a single entity are few, keep them like SourceSnapshot does
+        return list(items) if "entity_byname" in filters else items
+
+    def get_parameter_value_item(self, **filters):
+        return next(iter(ValuePages(self, filters)), {})
 
 
 def add_entity_group(
-    db_map: DatabaseMapping, class_name: str, group: str, member: str
+    db_map: api.DatabaseMapping, class_name: str, group: str, member: str
 ) -> None:
     _, error = db_map.add_entity_group_item(
         group_name=group, member_name=member, entity_class_name=class_name
@@ -73,24 +739,39 @@ def add_entity_group(
 
 
 def add_entity(
-    db_map: DatabaseMapping, class_name: str, name: tuple, ent_description=None
+    db_map: api.DatabaseMapping,
+    class_name: str,
+    name: tuple,
+    ent_description=None,
+    exist_ok=False,
 ) -> None:
+    # exist_ok is only passed on when set, plain mappings do not take it
     _, error = db_map.add_entity_item(
-        entity_byname=name, entity_class_name=class_name, description=ent_description
+        entity_byname=name,
+        entity_class_name=class_name,
+        description=ent_description,
+        **({"exist_ok": True} if exist_ok else {}),
     )
     if error is not None:
         raise RuntimeError(error)
 
 
 def add_parameter_value(
-    db_map: DatabaseMapping,
+    db_map: api.DatabaseMapping,
     class_name: str,
     parameter: str,
     alternative: str,
     elements: tuple,
     value: any,
 ) -> None:
-    db_value, value_type = api.to_database(value)
+    if isinstance(db_map, BulkWriter):
+        _, error = db_map.add_parameter_value(
+            class_name, parameter, alternative, elements, value
+        )
+        if error:
+            raise RuntimeError(error)
+        return
+    db_value, value_type = serialize(value)
     _, error = db_map.add_parameter_value_item(
         entity_class_name=class_name,
         entity_byname=elements,
@@ -103,20 +784,27 @@ def add_parameter_value(
         raise RuntimeError(error)
 
 
-def add_alternative(db_map: DatabaseMapping, name_alternative: str) -> None:
-    _, error = db_map.add_alternative_item(name=name_alternative)
+def add_alternative(
+    db_map: api.DatabaseMapping, name_alternative: str, exist_ok=False
+) -> None:
+    _, error = db_map.add_alternative_item(
+        name=name_alternative, **({"exist_ok": True} if exist_ok else {})
+    )
     if error is not None:
         raise RuntimeError(error)
 
 
-def add_scenario(db_map: DatabaseMapping, name_scenario: str) -> None:
+def add_scenario(db_map: api.DatabaseMapping, name_scenario: str) -> None:
     _, error = db_map.add_scenario_item(name=name_scenario)
     if error is not None:
         raise RuntimeError(error)
 
 
 def add_scenario_alternative(
-    db_map: DatabaseMapping, name_scenario: str, name_alternative: str, rank_int=None
+    db_map: api.DatabaseMapping,
+    name_scenario: str,
+    name_alternative: str,
+    rank_int=None,
 ) -> None:
     _, error = db_map.add_scenario_alternative_item(
         scenario_name=name_scenario, alternative_name=name_alternative, rank=rank_int
@@ -125,215 +813,2274 @@ def add_scenario_alternative(
         raise RuntimeError(error)
 
 
-def parameter_features(
-    param_elements,
-    source_db,
-    source_entity_class,
-    source_entity_names,
-    source_alternative,
-):
+@dataclass(frozen=True)
+class ParameterMapping:
+    """One source parameter of the map_of_periods_or_historical_to_ts settings.
+
+    target_order holds zero based positions in the source entity byname.
+    multiplier is None when it depends on the operand parameter of each entity.
+    """
+
+    source_class: str
+    target_class: str
+    source_param: str
+    target_param: str
+    target_order: tuple
+    multiplier: float = None
+    factor: float = 1.0
+    operation: str = None
+    operand_param: str = None
+
+
+@dataclass(frozen=True)
+class LifetimeMapping:
+    source_class: str
+    target_class: str
+    source_param: str
+    target_params: tuple
+
+
+def compile_parameter_mapping(source_class, target_class, source_param, elements):
+    entry = f"{source_class}.{target_class}.{source_param}"
+    if isinstance(elements, dict):
+        if set(elements) != {"target", "operation", "with"}:
+            raise ValueError(f"{entry} needs target, operation and with")
+        if elements["operation"] not in operations:
+            raise ValueError(f"{entry}: unknown operation {elements['operation']}")
+        target = elements["target"]
+    elif isinstance(elements, list):
+        target = elements
+    else:
+        raise ValueError(f"{entry} is neither a list nor a dict")
+    if len(target) != 3:
+        raise ValueError(f"{entry} target needs a name, a multiplier and an order")
+    target_param, factor, order = target
+    try:
+        factor = float(factor)
+        target_order = tuple(tuple(int(i) - 1 for i in names) for names in order)
+    except (TypeError, ValueError):
+        raise ValueError(f"{entry} has an invalid multiplier or order")
+    if not target_order or any(not names or min(names) < 0 for names in target_order):
+        raise ValueError(f"{entry} order needs dimension numbers starting from 1")
+    mapping = ParameterMapping(
+        source_class, target_class, source_param, target_param, target_order, factor
+    )
+    if isinstance(elements, list):
+        return mapping
+    op = operations[elements["operation"]]
+    try:
+        with_value = float(elements["with"])
+    except (TypeError, ValueError):
+        return dataclasses.replace(
+            mapping,
+            multiplier=None,
+            operation=elements["operation"],
+            operand_param=elements["with"],
+        )
+    # the multiplier of the target entry is also the left operand
+    return dataclasses.replace(mapping, multiplier=factor * op(factor, with_value))
+
+
+def compile_mapping_plan(settings):
+    """Validates the parameter mapping and resampling sections of settings.yaml.
+
+    The mapping sections are flattened into tuples of mappings.
+    """
+    plan = {"map_of_periods_or_historical_to_ts": [], "lifetime_to_duration": []}
+    section = settings.get("map_of_periods_or_historical_to_ts") or {}
+    for source_class, target_classes in section.items():
+        for target_class, source_params in target_classes.items():
+            for source_param, elements in source_params.items():
+                plan["map_of_periods_or_historical_to_ts"].append(
+                    compile_parameter_mapping(
+                        source_class, target_class, source_param, elements
+                    )
+                )
+    section = settings.get("lifetime_to_duration") or {}
+    for source_class, target_classes in section.items():
+        for target_class, source_params in target_classes.items():
+            for source_param, target_params in source_params.items():
+                if not isinstance(target_params, list) or not all(
+                    isinstance(name, str) for name in target_params
+                ):
+                    raise ValueError(
+                        f"{source_class}.{target_class}.{source_param} "
+                        "needs a list of target parameters"
+                    )
+                plan["lifetime_to_duration"].append(
+                    LifetimeMapping(
+                        source_class, target_class, source_param, tuple(target_params)
+                    )
+                )
+    plan = {name: tuple(mappings) for name, mappings in plan.items()}
+    aggregations = settings.get("resample_aggregation") or {}
+    for parameter, aggregation in aggregations.items():
+        if aggregation not in resample_aggregations:
+            raise ValueError(
+                f"resample_aggregation.{parameter}: unknown aggregation "
+                f"{aggregation}, use one of {', '.join(resample_aggregations)}"
+            )
+    plan["resample_aggregation"] = dict(aggregations)
+    profiles = []
+    section = settings.get("representative_periods") or {}
+    for target_class, parameters in section.items():
+        if not isinstance(parameters, list) or not all(
+            isinstance(name, str) for name in parameters
+        ):
+            raise ValueError(
+                f"representative_periods.{target_class} needs a list of parameters"
+            )
+        profiles += [(target_class, parameter) for parameter in parameters]
+    plan["representative_profiles"] = tuple(profiles)
+    return plan
+
+
+# compiled plans by settings.yaml content hash
+mapping_plans = {}
+
+
+def mapping_plan(config_dir):
+    with open(os.path.join(config_dir, config_files["settings"]), "rb") as file:
+        content = file.read()
+    key = content_hash(content)
+    if key not in mapping_plans:
+        mapping_plans[key] = compile_mapping_plan(yaml.safe_load(content))
+    return mapping_plans[key]
+
+
+def operand_values(mapping, source_db):
+    """Reads the operand parameter of a mapping for all entities at once.
+
+    Returns the parsed values by (entity byname, alternative name), maps with a
+    single value are taken as that value.
+    """
+    operands = {}
+    for value_ in source_db.get_parameter_value_items(
+        entity_class_name=mapping.source_class,
+        parameter_definition_name=mapping.operand_param,
+    ):
+        operand = value_["parsed_value"]
+        if isinstance(operand, api.Map):
+            if len(operand.values) == 1:
+                operand = operand.values[0]
+            elif any(isinstance(y, api.IndexedValue) for y in operand.values):
+                raise ValueError(
+                    f"{mapping.operand_param} of {value_['entity_byname']} "
+                    "is a nested map, only one dimensional maps can be operands"
+                )
+        key = (tuple(value_["entity_byname"]), value_["alternative_name"])
+        operands[key] = operand
+    return operands
+
+
+def map_keys(parsed_map):
+    if parsed_map.index_type is api.DateTime:
+        return map_timestamps(parsed_map)
+    return np.asarray(parsed_map.indexes, dtype=str)
+
+
+def apply_operand(mapping, operands, param_map):
+    """Applies the operation of a mapping with its operand to a source value.
+
+    Returns the (parameter value item, multiplier) to convert. Map operands are
+    applied element by element, to the map values of the same index or to a
+    single float value, which then becomes a map with the operand indexes.
+    """
+    entity_byname = param_map["entity_byname"]
+    operand = operands.get((tuple(entity_byname), param_map["alternative_name"]))
+    if operand is None:
+        raise ValueError(
+            f"{mapping.operand_param} does not exist for {mapping.source_class} {entity_byname}"
+        )
+    op = operations[mapping.operation]
+    if not isinstance(operand, api.Map):
+        return param_map, mapping.factor * op(mapping.factor, float(operand))
+    if param_map["type"] not in ("float", "map"):
+        raise ValueError(
+            f"{mapping.operand_param} of {mapping.source_class} {entity_byname} is a map, "
+            f"{mapping.source_param} of type {param_map['type']} can not be operated with it"
+        )
+    multipliers = mapping.factor * op(
+        mapping.factor, np.asarray(operand.values, dtype=float)
+    )
+    if param_map["type"] == "float":
+        like_map = operand
+        values = multipliers * param_map["parsed_value"]
+    else:
+        source_map = like_map = param_map["parsed_value"]
+        position = pd.Index(map_keys(operand)).get_indexer(map_keys(source_map))
+        if (position < 0).any():
+            raise ValueError(
+                f"{mapping.operand_param} of {mapping.source_class} {entity_byname} "
+                f"lacks indexes of {mapping.source_param}"
+            )
+        values = multipliers[position] * np.asarray(source_map.values, dtype=float)
+    scaled_map = api.Map(
+        list(like_map.indexes),
+        values.tolist(),
+        like_map.index_type,
+        like_map.index_name,
+    )
+    db_value, value_type = api.to_database(scaled_map)
+    scaled_item = {
+        "entity_byname": entity_byname,
+        "alternative_name": param_map["alternative_name"],
+        "type": value_type,
+        "value": db_value,
+        "parsed_value": scaled_map,
+    }
+    return scaled_item, 1.0
+
+
+@dataclass(frozen=True)
+class TimelineContext:
+    """Solve pattern and period data of the source database, read once per conversion run.
+
+    Period arrays are aligned with ``periods``; timestamps are datetime64[s].
+    """
+
+    model_name: str
+    periods: tuple
+    period_start_iso: tuple
+    period_start: np.ndarray
+    period_end: np.ndarray
+    years_represented: np.ndarray
+    leap_year: np.ndarray
+    block_start: np.ndarray
+    block_end: np.ndarray
+    duration: str
+    resolution: str
+    duration_td: np.timedelta64
+    resolution_td: np.timedelta64
+    steps: int
+    weather_year_starts: tuple
+    weather_year_alternatives: tuple
+    # resolution of the target, resample_factor source steps each
+    model_resolution: str
+    model_resolution_td: np.timedelta64
+    resample_factor: int
+
+    def closing_point_iso(self):
+        # end of the last period, closes the period time series
+        return np.datetime_as_string(self.period_end[-1], unit="s")
+
+    def fingerprint(self):
+        """Identifies the timeline as far as converted values depend on it."""
+        return json.dumps(
+            [
+                self.periods,
+                self.period_start_iso,
+                self.closing_point_iso(),
+                self.resolution,
+                self.steps,
+                self.weather_year_starts,
+                self.weather_year_alternatives,
+                self.model_resolution,
+            ]
+        )
+
+
+def solve_pattern_value(source_db, parameter):
+    return json.loads(
+        source_db.get_parameter_value_items(
+            entity_class_name="solve_pattern", parameter_definition_name=parameter
+        )[0]["value"]
+    )["data"]
+
+
+def timeline_context(source_db):
+
+    model_name = source_db.get_entity_items(entity_class_name="solve_pattern")[0][
+        "name"
+    ]
+    periods = solve_pattern_value(source_db, "period")
+    duration = solve_pattern_value(source_db, "duration")
+    resolution = solve_pattern_value(source_db, "time_resolution")
+    weather_year_starts = solve_pattern_value(source_db, "start_time")
+
+    period_start_iso = []
+    years_represented = []
+    for period in periods:
+        period_start_iso.append(
+            json.loads(
+                source_db.get_parameter_value_item(
+                    entity_class_name="period",
+                    entity_byname=(period,),
+                    alternative_name="Base",
+                    parameter_definition_name="start_time",
+                )["value"]
+            )["data"]
+        )
+        years_represented.append(
+            source_db.get_parameter_value_item(
+                entity_class_name="period",
+                entity_byname=(period,),
+                alternative_name="Base",
+                parameter_definition_name="years_represented",
+            )["parsed_value"]
+        )
+
+    starts = [pd.Timestamp(start) for start in period_start_iso]
+    period_start = np.array(
+        [start.to_datetime64() for start in starts], dtype="datetime64[s]"
+    )
+    period_end = np.array(
+        [
+            start.replace(year=int(start.year + yearr)).to_datetime64()
+            for start, yearr in zip(starts, years_represented)
+        ],
+        dtype="datetime64[s]",
+    )
+    duration_td = pd.to_timedelta(duration).to_timedelta64().astype("timedelta64[s]")
+    resolution_td = (
+        pd.to_timedelta(resolution).to_timedelta64().astype("timedelta64[s]")
+    )
+    model_resolution, model_resolution_td = resolution, resolution_td
+    if options.resolution is not None:
+        model_resolution = options.resolution
+        model_resolution_td = (
+            pd.to_timedelta(model_resolution).to_timedelta64().astype("timedelta64[s]")
+        )
+        if model_resolution_td < resolution_td or model_resolution_td % resolution_td:
+            raise RuntimeError(
+                f"time_resolution {resolution} can not be resampled to "
+                f"{model_resolution}, use a multiple of it"
+            )
+    leap_year = (period_start.astype("datetime64[Y]").astype(int) + 1970) % 4 == 0
+    block_start = np.where(
+        leap_year, period_start + np.timedelta64(366, "D"), period_start
+    )
+    block_end = block_start + duration_td
+    years_represented = np.array(years_represented, dtype=float)
+    for array in [
+        period_start,
+        period_end,
+        years_represented,
+        leap_year,
+        block_start,
+        block_end,
+    ]:
+        array.setflags(write=False)
+
+    return TimelineContext(
+        model_name=model_name,
+        periods=tuple(periods),
+        period_start_iso=tuple(period_start_iso),
+        period_start=period_start,
+        period_end=period_end,
+        years_represented=years_represented,
+        leap_year=leap_year,
+        block_start=block_start,
+        block_end=block_end,
+        duration=duration,
+        resolution=resolution,
+        duration_td=duration_td,
+        resolution_td=resolution_td,
+        steps=int(duration_td / resolution_td),
+        weather_year_starts=tuple(weather_year_starts),
+        weather_year_alternatives=tuple(
+            f"wy{str(pd.Timestamp(start).year)}" for start in weather_year_starts
+        ),
+        model_resolution=model_resolution,
+        model_resolution_td=model_resolution_td,
+        resample_factor=int(model_resolution_td / resolution_td),
+    )
+
+
+def period_map_values(parsed_maps, timeline, missing=0.0):
+    """Aligns period indexed maps with the timeline periods.
+
+    Returns a values matrix and a boolean matrix of the periods found in each map,
+    both of shape (number of maps, number of periods).
+    Periods missing from a map get the ``missing`` value.
+    """
+    shape = (len(parsed_maps), len(timeline.periods))
+    values = np.full(shape, missing, dtype=float)
+    found = np.zeros(shape, dtype=bool)
+    # period names are strings, maps with other index types cannot hold them
+    rows = [
+        row
+        for row, parsed_map in enumerate(parsed_maps)
+        if parsed_map.index_type is str and len(parsed_map.indexes)
+    ]
+    if not rows or not timeline.periods:
+        return values, found
+    keys = np.concatenate(
+        [np.asarray(parsed_maps[row].indexes, dtype=str) for row in rows]
+    )
+    map_values = np.concatenate(
+        [np.asarray(parsed_maps[row].values, dtype=object) for row in rows]
+    )
+    key_rows = np.repeat(rows, [len(parsed_maps[row].indexes) for row in rows])
+
+    periods = np.asarray(timeline.periods, dtype=str)
+    order = np.argsort(periods)
+    position = np.searchsorted(periods[order], keys).clip(max=len(periods) - 1)
+    match = periods[order][position] == keys
+    key_rows = key_rows[match]
+    key_columns = order[position[match]]
+    values[key_rows, key_columns] = map_values[match].astype(float)
+    found[key_rows, key_columns] = True
+    return values, found
+
+
+def time_series_index(stamps):
+    """Start and resolution of a time series over ISO time stamps.
+
+    Steps between stamps on the same day of the year are whole years, the
+    resolution is a list of the steps when they differ.
+    """
+    resolutions = []
+    for previous, stamp in zip(stamps, stamps[1:]):
+        if previous[4:] == stamp[4:]:
+            resolutions.append(f"{int(stamp[:4]) - int(previous[:4])}Y")
+            continue
+        step = np.datetime64(stamp, "s") - np.datetime64(previous, "s")
+        seconds = int(step / np.timedelta64(1, "s"))
+        if seconds % 3600:
+            resolutions.append(f"{seconds}s")
+        else:
+            resolutions.append(f"{seconds // 3600}h")
+    if len(set(resolutions)) == 1:
+        resolutions = resolutions[0]
+    return {"start": stamps[0], "resolution": resolutions}
+
+
+def compact_time_series(index, values):
+    return SerializedValue(
+        json.dumps({"index": index, "data": values}).encode(), "time_series"
+    )
+
+
+def period_time_series(values, timeline, found=None):
+    """Builds a period time series for each row of a period values matrix.
+
+    The last value is repeated at the end of the last period.
+    If ``found`` is given, only the periods found in each row are included.
+    With the compact option the series have a start and resolution instead of
+    time stamps.
+    """
+    if not len(values):
+        return []
+    # this should be removed once the fixed resolution is repaired
+    closing_point = timeline.closing_point_iso()
+    period_starts = np.asarray(timeline.period_start_iso, dtype=object)
+    # compact indexes by the periods included
+    compact_indexes = {}
+    time_series = []
+    for i, row in enumerate(values):
+        if found is not None:
+            row = row[found[i]]
+            columns = found[i]
+        else:
+            columns = np.ones(len(period_starts), dtype=bool)
+        row = row.tolist()
+        if options.compact:
+            key = columns.tobytes()
+            if key not in compact_indexes:
+                stamps = period_starts[columns].tolist() + [closing_point]
+                compact_indexes[key] = time_series_index(stamps)
+            time_series.append(
+                compact_time_series(compact_indexes[key], row + row[-1:])
+            )
+            continue
+        indexes = period_starts[columns].tolist()
+        time_series.append(
+            {
+                "type": "time_series",
+                "data": dict(zip(indexes + [closing_point], row + row[-1:])),
+            }
+        )
+    return time_series
+
+
+def map_timestamps(parsed_map):
+    """Parses the indexes of a map into a datetime64 array, NaT where not a time stamp."""
+    if parsed_map.index_type is api.DateTime:
+        return np.array(
+            [index.value for index in parsed_map.indexes], dtype="datetime64[s]"
+        )
+    return (
+        pd.to_datetime(np.asarray(parsed_map.indexes, dtype=str), errors="coerce")
+        .to_numpy()
+        .astype("datetime64[s]")
+    )
+
+
+def weather_year_slices(parsed_map, timeline, multiplier=1.0):
+    """Cuts a historical map into one slice per weather year of the solve pattern.
+
+    Returns a list of (weather year start, alternative name, values) tuples
+    where the values are views of the scaled map values, one window of
+    ``timeline.steps`` steps from each weather year start found in the map.
+    """
+    if not len(parsed_map.indexes) or not timeline.weather_year_starts:
+        return []
+    timestamps = map_timestamps(parsed_map)
+    starts = pd.to_datetime(list(timeline.weather_year_starts)).to_numpy()
+    starts = starts.astype("datetime64[s]")
+    order = np.argsort(timestamps, kind="stable")
+    offsets = np.searchsorted(timestamps, starts, sorter=order).clip(
+        max=len(timestamps) - 1
+    )
+    offsets = order[offsets]
+    found = timestamps[offsets] == starts
+    if not found.any():
+        return []
+    values = multiplier * np.asarray(parsed_map.values, dtype=float)
+    return [
+        (start, alternative_name, values[offset : offset + timeline.steps])
+        for start, alternative_name, offset, start_found in zip(
+            timeline.weather_year_starts,
+            timeline.weather_year_alternatives,
+            offsets.tolist(),
+            found,
+        )
+        if start_found
+    ]
+
+
+def map_value_pairs(raw, header=None, chunk_size=1 << 20):
+    """Yields the (index, value) pairs of a serialized map without parsing it whole.
+
+    The raw bytes are decoded one chunk at a time. Other top level fields such
+    as index_type are stored in ``header`` as they are read.
+    """
+    if header is None:
+        header = {}
+    decoder = json.JSONDecoder()
+    text_decoder = codecs.getincrementaldecoder("utf-8")()
+    raw = memoryview(raw)
+    state = {"buffer": "", "cursor": 0, "read": 0}
+
+    def fill():
+        if state["read"] >= len(raw):
+            return False
+        chunk = raw[state["read"] : state["read"] + chunk_size]
+        state["read"] += len(chunk)
+        buffer = state["buffer"][state["cursor"] :]
+        state["buffer"] = buffer + text_decoder.decode(
+            chunk, final=state["read"] >= len(raw)
+        )
+        state["cursor"] = 0
+        return True
+
+    def peek():
+        while True:
+            buffer = state["buffer"]
+            cursor = state["cursor"]
+            while cursor < len(buffer) and buffer[cursor] in " \t\n\r":
+                cursor += 1
+            state["cursor"] = cursor
+            if cursor < len(buffer):
+                return buffer[cursor]
+            if not fill():
+                raise ValueError("Unexpected end of map value")
+
+    def expect(characters):
+        character = peek()
+        if character not in characters:
+            raise ValueError(f"Expected one of {characters!r} in map value")
+        state["cursor"] += 1
+        return character
+
+    def decode():
+        peek()
+        while True:
+            try:
+                value, end = decoder.raw_decode(state["buffer"], state["cursor"])
+            except json.JSONDecodeError:
+                if not fill():
+                    raise
+                continue
+            # a number cut by the end of the buffer may continue in the next chunk
+            buffer = state["buffer"]
+            if (end == len(buffer) or buffer[end] not in " \t\n\r,:]}") and fill():
+                continue
+            state["cursor"] = end
+            return value
+
+    expect("{")
+    if peek() == "}":
+        return
+    while True:
+        key = decode()
+        expect(":")
+        if key != "data":
+            header[key] = decode()
+        elif expect("[{") == "[":
+            if peek() != "]":
+                while True:
+                    index, value = decode()
+                    yield index, value
+                    if expect(",]") == "]":
+                        break
+            else:
+                expect("]")
+        else:
+            if peek() != "}":
+                while True:
+                    index = decode()
+                    expect(":")
+                    yield index, decode()
+                    if expect(",}") == "}":
+                        break
+            else:
+                expect("}")
+        if expect(",}") == "}":
+            return
+
+
+def index_timestamp(index):
+    try:
+        return np.datetime64(index, "s")
+    except ValueError:
+        return pd.to_datetime(index, errors="coerce").to_datetime64()
+
+
+def stream_weather_year_slices(raw, timeline, multiplier=1.0):
+    """Cuts a serialized historical map into weather year slices pair by pair.
+
+    Gives the same slices as weather_year_slices, each one as soon as it is
+    complete, so only the open weather year windows are held in memory.
+    """
+    if not timeline.weather_year_starts:
+        return
+    starts = pd.to_datetime(list(timeline.weather_year_starts)).to_numpy()
+    pending = {}
+    for timestamp, start, alternative_name in zip(
+        starts.astype("datetime64[s]").tolist(),
+        timeline.weather_year_starts,
+        timeline.weather_year_alternatives,
+    ):
+        pending.setdefault(timestamp, []).append((start, alternative_name))
+    open_windows = []
+    for index, value in map_value_pairs(raw):
+        value = np.nan if value is None else float(value)
+        for window in open_windows:
+            window[2].append(value)
+        timestamp = index_timestamp(index).astype("datetime64[s]").tolist()
+        if timestamp in pending:
+            for start, alternative_name in pending.pop(timestamp):
+                open_windows.append((start, alternative_name, [value]))
+        if open_windows and len(open_windows[0][2]) == timeline.steps:
+            complete = [w for w in open_windows if len(w[2]) == timeline.steps]
+            open_windows = [w for w in open_windows if len(w[2]) < timeline.steps]
+            for start, alternative_name, values in complete:
+                yield start, alternative_name, multiplier * np.array(values)
+    # windows running past the end of the map are cut short
+    for start, alternative_name, values in open_windows:
+        yield start, alternative_name, multiplier * np.array(values)
+
+
+def stream_period_values(raw, timeline):
+    """Period values of a serialized map as one row of period_map_values.
+
+    Returns the values and found rows and the number of map indexes.
+    """
+    values = np.zeros(len(timeline.periods), dtype=float)
+    found = np.zeros(len(timeline.periods), dtype=bool)
+    columns = {period: column for column, period in enumerate(timeline.periods)}
+    header = {}
+    period_values = {}
+    indexes = 0
+    for index, value in map_value_pairs(raw, header):
+        indexes += 1
+        if index in columns:
+            period_values[index] = value
+    # period names are strings, maps with other index types cannot hold them
+    if header.get("index_type", "str") == "str":
+        for period, value in period_values.items():
+            values[columns[period]] = float(value)
+            found[columns[period]] = True
+    return values, found, indexes
+
+
+def weather_year_time_series(start, values, timeline):
+    return {
+        "type": "time_series",
+        "data": values.tolist(),
+        "index": {
+            "start": f"2018{start[4:]}",
+            "resolution": timeline.model_resolution,
+            "ignore_year": True,
+        },
+    }
+
+
+## Resampling
+
+# aggregations of the source steps merged into one model step
+resample_aggregations = ("mean", "sum", "min", "max")
+
+
+def resample_aggregation(parameter):
+    """Returns the aggregation settings.yaml gives for a target parameter."""
+    aggregations = mapping_plan(options.config_dir)["resample_aggregation"]
+    return aggregations.get(parameter, "mean")
+
+
+def resample_values(values, timeline, aggregation="mean"):
+    """Aggregates every timeline.resample_factor consecutive values.
+
+    A last incomplete step is aggregated from the values it has.
+    """
+    factor = timeline.resample_factor
+    if factor == 1 or not len(values):
+        return values
+    starts = np.arange(0, len(values), factor)
+    if aggregation == "min":
+        return np.minimum.reduceat(values, starts)
+    if aggregation == "max":
+        return np.maximum.reduceat(values, starts)
+    sums = np.add.reduceat(values, starts)
+    if aggregation == "sum":
+        return sums
+    return sums / np.diff(np.append(starts, len(values)))
+
+
+def resample_time_series(series, timeline, aggregation="mean"):
+    """Resamples a source time series with the source time_resolution.
+
+    Other series are returned as they are.
+    """
+    if timeline.resample_factor == 1 or len(series.indexes) < 2:
+        return series
+    stamps = np.asarray(series.indexes, dtype="datetime64[s]")
+    if not (np.diff(stamps) == timeline.resolution_td).all():
+        print(
+            f"time series with steps other than {timeline.resolution} "
+            "is not resampled"
+        )
+        return series
+    return api.TimeSeriesFixedResolution(
+        stamps[0],
+        timeline.model_resolution,
+        resample_values(np.asarray(series.values, dtype=float), timeline, aggregation),
+        series.ignore_year,
+        series.repeat,
+    )
+
+
+class ValueCache:
+    """On-disk cache of converted parameter values with least recently used eviction.
+
+    Entries are JSON files named after the hash of everything the conversion
+    depends on, so an entry never goes stale, it just stops being used. Entries
+    of several values are JSON lines files, written and read one value at a
+    time.
+    """
+
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(directory, exist_ok=True)
+        # the converter itself is part of every key
+        with open(__file__, "rb") as file:
+            self._converter_hash = hashlib.sha256(file.read()).hexdigest()
+        self._size = sum(size for _, _, size in self._entries())
+        if self._size > self.max_bytes:
+            self.evict()
+
+    def _entries(self):
+        for root, _, file_names in os.walk(self.directory):
+            for file_name in file_names:
+                if not file_name.endswith((".json", ".jsonl")):
+                    continue
+                path = os.path.join(root, file_name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                yield path, stat.st_mtime, stat.st_size
+
+    def _path(self, key, suffix=".json"):
+        return os.path.join(self.directory, key[:2], key + suffix)
+
+    def key(self, kind, param_map, multiplier, timeline):
+        digest = hashlib.sha256()
+        for part in (
+            self._converter_hash,
+            kind,
+            param_map["type"],
+            repr(float(multiplier)),
+            repr(options.compact),
+            timeline.fingerprint(),
+        ):
+            digest.update(part.encode())
+            digest.update(b"\0")
+        digest.update(param_map["value"])
+        return digest.hexdigest()
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path, "r") as file:
+                entry = json.load(file)
+            os.utime(path)
+        except (FileNotFoundError, ValueError):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return entry
+
+    def put(self, key, entry):
+        with self._replace(self._path(key)) as file:
+            json.dump(entry, file)
+
+    def open_lines(self, key):
+        """Returns the open file of an entry written with write_lines, None if missing."""
+        path = self._path(key, ".jsonl")
+        try:
+            file = open(path, "r")
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+        os.utime(path)
+        self.hits += 1
+        return file
+
+    @contextlib.contextmanager
+    def write_lines(self, key):
+        """Writes an entry line by line, it is only kept if the block completes."""
+        with self._replace(self._path(key, ".jsonl")) as file:
+            yield lambda entry: file.write(json.dumps(entry) + "\n")
+
+    @contextlib.contextmanager
+    def _replace(self, path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # other processes may read the same entry, replace it in one go
+        temporary_path = f"{path}.{os.getpid()}.tmp"
+        try:
+            with open(temporary_path, "w") as file:
+                yield file
+        except BaseException:
+            os.remove(temporary_path)
+            raise
+        self._size += os.path.getsize(temporary_path)
+        os.replace(temporary_path, path)
+        if self._size > self.max_bytes:
+            self.evict()
+
+    def evict(self):
+        entries = sorted(self._entries(), key=lambda entry: entry[1])
+        self._size = sum(size for _, _, size in entries)
+        for path, _, size in entries:
+            if self._size <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            self._size -= size
+
+
+def cached_period_time_series(param_maps, multipliers, timeline):
+    """Period time series of map values as built by period_time_series.
+
+    Returns a (periods found, number of map indexes, time series) tuple for each
+    map, the time series is None when no period was found.
+    """
+    results = [None] * len(param_maps)
+    keys = [None] * len(param_maps)
+    misses = []
+    for i, (param_map, multiplier) in enumerate(zip(param_maps, multipliers)):
+        if value_cache is not None:
+            keys[i] = value_cache.key("periods", param_map, multiplier, timeline)
+            entry = value_cache.get(keys[i])
+            if entry is not None:
+                value = entry["value"]
+                if value is not None:
+                    value = SerializedValue(value.encode(), entry["type"])
+                results[i] = (entry["periods_found"], entry["indexes"], value)
+                continue
+        misses.append(i)
+    if options.stream:
+        streamed = [
+            stream_period_values(param_maps[i]["value"], timeline) for i in misses
+        ]
+        shape = (len(misses), len(timeline.periods))
+        values = np.array([row[0] for row in streamed], dtype=float).reshape(shape)
+        found = np.array([row[1] for row in streamed], dtype=bool).reshape(shape)
+        index_counts = [row[2] for row in streamed]
+    else:
+        values, found = period_map_values(
+            [param_maps[i]["parsed_value"] for i in misses], timeline
+        )
+        index_counts = [len(param_maps[i]["parsed_value"].indexes) for i in misses]
+    values *= np.array([multipliers[i] for i in misses], dtype=float)[:, np.newaxis]
+    for i, time_series, periods_found, indexes in zip(
+        misses,
+        period_time_series(values, timeline),
+        found.sum(axis=1).tolist(),
+        index_counts,
+    ):
+        if not periods_found:
+            time_series = None
+        if value_cache is not None:
+            entry = {"periods_found": periods_found, "indexes": indexes, "value": None}
+            if time_series is not None:
+                db_value, value_type = serialize(time_series)
+                time_series = SerializedValue(db_value, value_type)
+                entry.update(value=db_value.decode(), type=value_type)
+            value_cache.put(keys[i], entry)
+        results[i] = (periods_found, indexes, time_series)
+    return results
+
+
+def cached_weather_year_series(param_map, timeline, multiplier=1.0, aggregation="mean"):
+    """Weather year time series of a historical map as (alternative name, value) pairs.
+
+    Cached series are read and written one weather year at a time, so that the
+    cache keeps the memory of --stream proportional to one weather year.
+    """
+    if value_cache is not None:
+        key = value_cache.key(
+            f"weather_years {aggregation}", param_map, multiplier, timeline
+        )
+        file = value_cache.open_lines(key)
+        if file is not None:
+            with file:
+                for line in file:
+                    alternative_name, db_value, value_type = json.loads(line)
+                    yield alternative_name, SerializedValue(
+                        db_value.encode(), value_type
+                    )
+            return
+        with value_cache.write_lines(key) as write:
+            for alternative_name, value in weather_year_series(
+                param_map, timeline, multiplier, aggregation
+            ):
+                write([alternative_name, value.value.decode(), value.type])
+                yield alternative_name, value
+        return
+    yield from weather_year_series(param_map, timeline, multiplier, aggregation)
+
+
+def weather_year_series(param_map, timeline, multiplier=1.0, aggregation="mean"):
+    if options.stream:
+        slices = stream_weather_year_slices(param_map["value"], timeline, multiplier)
+    else:
+        slices = weather_year_slices(param_map["parsed_value"], timeline, multiplier)
+    # serialized right away so that the slice can be dropped
+    for start, alternative_name, values in slices:
+        values = resample_values(values, timeline, aggregation)
+        yield alternative_name, SerializedValue(
+            *serialize(weather_year_time_series(start, values, timeline))
+        )
+
+
+def convert(source_url, target_url, config_dir=None, **kwargs):
+    """Converts the INES database at source_url into the SpineOpt database at target_url.
+
+    The yaml mappings and settings are read from config_dir, by default the
+    directory of this module. Other keyword arguments are fields of
+    ConversionOptions, e.g. jobs=4 or incremental=True.
+    """
+    if config_dir is None:
+        config_dir = ConversionOptions.config_dir
+    configure(ConversionOptions(source_url, target_url, config_dir, **kwargs))
+    source_path = sqlite_path(source_url)
+    if source_path is not None and not os.path.exists(source_path):
+        # opening it would leave an empty database file behind
+        raise FileNotFoundError(f"source database {source_path} does not exist")
+    target_path = sqlite_path(target_url)
+    if (
+        options.template is not None
+        and target_path is not None
+        and not os.path.exists(target_path)
+    ):
+        create_from_template(target_url, load_template(options.template)).close()
+    with api.DatabaseMapping(source_url) as source_db:
+        with api.DatabaseMapping(target_url) as target_db:
+            if not options.incremental:
+                # the target no longer holds what the incremental state describes
+                remove_incremental_state()
+                journal = open_journal(source_db, target_db)
+                convert_databases(source_db, target_db, journal)
+                return
+            if options.resume:
+                print("--resume has no effect on incremental conversions")
+            convert_incremental(source_db, target_db)
+
+
+def purge_target(target_db):
+    ## Empty the database
+    target_db.purge_items("parameter_value")
+    target_db.purge_items("entity")
+    target_db.purge_items("alternative")
+    target_db.purge_items("scenario")
+    target_db.refresh_session()
+    target_db.commit_session("Purged stuff")
+
+
+## Batch conversion
+
+# shared by the conversions of a batch worker, set by init_batch_worker
+batch_settings = {}
+
+
+def read_manifest(path):
+    """Reads source and target url pairs, one whitespace separated pair per line.
+
+    Empty lines and lines starting with # are skipped.
+    """
+    pairs = []
+    with open(path, "r") as file:
+        for number, line in enumerate(file, 1):
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            fields = line.split()
+            if len(fields) != 2:
+                raise ValueError(f"{path}:{number}: expected a source and a target url")
+            pairs.append(tuple(fields))
+    return pairs
+
+
+def init_batch_worker(config_dir, conversion_options):
+    """Loads everything the conversions of a batch share, once per worker."""
+    batch_settings["config_dir"] = config_dir
+    batch_settings["options"] = conversion_options
+    for module in (api, yaml, pd, np):
+        load_now(module)
+    importlib.import_module("ines_tools.ines_transform")
+    load_config(config_dir)
+    mapping_plan(config_dir)
+    if conversion_options.get("template") is not None:
+        load_template(conversion_options["template"])
+
+
+def convert_batch_item(source_url, target_url):
+    """Converts one pair of a batch, returns its report instead of raising.
+
+    The output of the conversion goes to <target>.log for sqlite targets.
+    """
+    output = io.StringIO()
+    error = None
+    start = time.perf_counter()
+    try:
+        with contextlib.redirect_stdout(output):
+            convert(
+                source_url,
+                target_url,
+                batch_settings["config_dir"],
+                **batch_settings["options"],
+            )
+    except Exception as exception:
+        error = f"{type(exception).__name__}: {exception}"
+    seconds = time.perf_counter() - start
+    target_path = sqlite_path(target_url)
+    if target_path is not None and os.path.isdir(
+        os.path.dirname(os.path.abspath(target_path))
+    ):
+        with open(target_path + ".log", "w") as file:
+            file.write(output.getvalue())
+    source_path = sqlite_path(source_url)
+    source_mb = None
+    if source_path is not None and os.path.exists(source_path):
+        source_mb = os.path.getsize(source_path) / 1024 / 1024
+    return {
+        "source": source_url,
+        "target": target_url,
+        "seconds": seconds,
+        "source_mb": source_mb,
+        "error": error,
+    }
+
+
+def convert_batch(manifest, config_dir=None, jobs=1, **kwargs):
+    """Converts every source and target pair of manifest, a file or a list of pairs.
+
+    The pairs are spread over jobs worker processes, each keeping the imports,
+    the mappings and the template loaded from one conversion to the next. Each
+    file is converted by a single process. Other keyword arguments are fields
+    of ConversionOptions. Returns the report of every pair, raises RuntimeError
+    after all pairs if any of them failed.
+    """
+    if config_dir is None:
+        config_dir = ConversionOptions.config_dir
+    pairs = read_manifest(manifest) if isinstance(manifest, str) else list(manifest)
+    targets = [target_url for _, target_url in pairs]
+    repeated = {target_url for target_url in targets if targets.count(target_url) > 1}
+    if repeated:
+        raise ValueError(f"targets converted more than once: {', '.join(repeated)}")
+    # fails on unknown options before anything is converted
+    ConversionOptions(config_dir=config_dir, **kwargs)
+    reports = []
+
+    def report(item_report):
+        reports.append(item_report)
+        if item_report["error"] is not None:
+            outcome = f"failed, {item_report['error']}"
+        elif item_report["source_mb"] is not None:
+            outcome = (
+                f"{item_report['source_mb']:.1f} MB,"
+                f" {item_report['source_mb'] / item_report['seconds']:.2f} MB/s"
+            )
+        else:
+            outcome = "done"
+        print(
+            f"[{len(reports)}/{len(pairs)}] {item_report['source']} ->"
+            f" {item_report['target']}: {item_report['seconds']:.1f} s, {outcome}"
+        )
+
+    start = time.perf_counter()
+    if jobs <= 1:
+        init_batch_worker(config_dir, kwargs)
+        for pair in pairs:
+            report(convert_batch_item(*pair))
+    else:
+        context = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(
+            jobs, context, initializer=init_batch_worker, initargs=(config_dir, kwargs)
+        ) as pool:
+            futures = [pool.submit(convert_batch_item, *pair) for pair in pairs]
+            for future in as_completed(futures):
+                report(future.result())
+    seconds = time.perf_counter() - start
+    print(
+        f"{len(pairs)} conversions in {seconds:.1f} s,"
+        f" {len(pairs) / seconds * 60:.1f} per minute"
+    )
+    failed = [item_report for item_report in reports if item_report["error"]]
+    if failed:
+        raise RuntimeError(
+            f"{len(failed)} of {len(pairs)} conversions failed:\n"
+            + "\n".join(
+                f"{item_report['source']}: {item_report['error']}"
+                for item_report in failed
+            )
+        )
+    return reports
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Converts an INES database into a SpineOpt database."
+    )
+    parser.add_argument(
+        "source_url", nargs="?", help="e.g. sqlite:///path/db_file.sqlite"
+    )
+    parser.add_argument(
+        "target_url", nargs="?", help="e.g. sqlite:///path/db_file.sqlite"
+    )
+    parser.add_argument(
+        "--batch", help="file of source and target url pairs, one pair per line"
+    )
+    parser.add_argument(
+        "--template", help="SpineOpt template json or database url for new targets"
+    )
+    parser.add_argument(
+        "--export",
+        metavar="PACKAGE",
+        help="write an import package instead of a target, needs --template",
+    )
+    parser.add_argument(
+        "--import-package",
+        metavar="PACKAGE",
+        help="load an exported package into the single url given",
+    )
+    parser.add_argument("--config-dir", help="directory of the yaml mappings")
+    parser.add_argument("--jobs", type=int, default=1)
+    parser.add_argument("--incremental", action="store_true")
+    parser.add_argument("--stream", action="store_true")
+    parser.add_argument("--dedupe", action="store_true")
+    parser.add_argument("--compact", action="store_true")
+    parser.add_argument("--profile", help="json report of each stage")
+    parser.add_argument("--cprofile", help="directory for cProfile dumps")
+    parser.add_argument("--cache", help="directory of the converted value cache")
+    parser.add_argument("--cache-size", type=float, default=1024.0, help="megabytes")
+    parser.add_argument(
+        "--resolution", help="resample the operational time series, e.g. 3h"
+    )
+    parser.add_argument(
+        "--representative-periods",
+        type=int,
+        metavar="K",
+        help="cluster the operational horizon into K representative periods",
+    )
+    parser.add_argument(
+        "--representative-length",
+        default="1D",
+        help="length of the representative periods, e.g. 1D or 7D",
+    )
+    parser.add_argument("--low-memory", action="store_true")
+    parser.add_argument("--page-size", type=int, default=10000)
+    parser.add_argument("--memory-limit", type=float, help="megabytes")
+    parser.add_argument(
+        "--resume", action="store_true", help="skip the stages committed before"
+    )
+    arguments = vars(parser.parse_args(argv))
+    manifest = arguments.pop("batch")
+    package = arguments.pop("export")
+    imported_package = arguments.pop("import_package")
+    if imported_package is not None:
+        if arguments["source_url"] is None or arguments["target_url"] is not None:
+            parser.error("--import-package takes the target url only")
+        import_package(imported_package, arguments["source_url"], arguments["template"])
+    elif package is not None:
+        if arguments["source_url"] is None or arguments["target_url"] is not None:
+            parser.error("--export takes the source url only")
+        if arguments["template"] is None:
+            parser.error("--export needs --template")
+        export_package(
+            arguments.pop("source_url"),
+            package,
+            **{
+                name: value for name, value in arguments.items() if name != "target_url"
+            },
+        )
+    elif manifest is not None:
+        if arguments.pop("source_url") or arguments.pop("target_url"):
+            parser.error("--batch takes the urls from the manifest")
+        # --jobs is the number of files converted at once
+        convert_batch(manifest, **arguments)
+    elif arguments["source_url"] is None or arguments["target_url"] is None:
+        parser.error("source_url and target_url are required without --batch")
+    else:
+        convert(**arguments)
+
+
+def convert_databases(source_db, target_db, journal=None, commit=True):
+    """Converts source_db into target_db, which has been purged or is resumed.
+
+    Every stage is committed and recorded in the journal once it completed,
+    stages the journal already records are skipped. Without commit the result
+    is left in the mapping of target_db, e.g. to be exported.
+    """
+    # fails on invalid mapping settings before anything is written
+    mapping_plan(options.config_dir)
+    if options.low_memory:
+        target_db = BulkWriter(
+            target_db,
+            options.page_size,
+            commit_size=10 * options.page_size,
+            memory_limit=options.memory_limit,
+        )
+    else:
+        target_db = BulkWriter(target_db)
+    if journal is not None or not commit:
+        target_db.defer_commits = True
+    profiler = None
+    profile_path = options.profile
+    if options.cprofile is not None and profile_path is None:
+        profile_path = os.path.join(options.cprofile, "profile.json")
+    if profile_path is not None:
+        profiler = StageProfiler(options.cprofile, target_db)
+    if journal is None or not journal.skip("copy_generic", target_db):
+        errors_before = len(target_db.errors)
+        if profiler is not None:
+            target_db = profiler.measure(
+                "copy_generic",
+                lambda: copy_generic(
+                    CallCounter(source_db, "source_db", profiler),
+                    CallCounter(target_db, "target_db", profiler),
+                ),
+            )
+            if type(target_db) is CallCounter:
+                target_db = target_db.wrapped
+        else:
+            target_db = copy_generic(source_db, target_db)
+        checkpoint("copy_generic", target_db, journal, errors_before, profiler)
+
+    # Manual functions
+    # the stages below read the source from memory, or page by page from the
+    # database in low-memory mode
+    source_reader = PagedSource if options.low_memory else SourceSnapshot
+    if profiler is not None:
+        source_db = profiler.measure(
+            "source_snapshot", lambda: source_reader(source_db)
+        )
+    else:
+        source_db = source_reader(source_db)
+    # solve pattern and periods shared by the stages below
+    timeline = timeline_context(source_db)
+
+    # spineopt specific stages, see stages below
+    run_stages(stages, source_db, target_db, timeline, options.jobs, profiler, journal)
+    if profiler is not None:
+        profiler.measure("flush", target_db.flush)
+        profiler.write_report(profile_path)
+        print(f"profile written to {profile_path}")
+    if value_cache is not None:
+        print(f"value cache: {value_cache.hits} hits, {value_cache.misses} misses")
+
+    # report everything that could not be added
+    target_db.raise_errors()
+
+    # not journaled, removes nothing when run again
+    target_db.defer_commits = not commit
+    if options.dedupe:
+        source_alternatives = {
+            item["name"] for item in source_db.get_alternative_items()
+        }
+        deduplicate_values(
+            target_db,
+            {
+                item["name"]
+                for item in target_db.get_alternative_items()
+                if item["name"] not in source_alternatives
+            },
+        )
+
+
+def copy_generic(source_db, target_db):
+    from ines_tools import ines_transform
+
+    ## Copy alternatives
+    for alternative in source_db.get_alternative_items():
+        target_db.add_alternative_item(name=alternative["name"])
+    for scenario in source_db.get_scenario_items():
+        target_db.add_scenario_item(name=scenario["name"])
+    for scenario_alternative in source_db.get_scenario_alternative_items():
+        target_db.add_scenario_alternative_item(
+            alternative_name=scenario_alternative["alternative_name"],
+            scenario_name=scenario_alternative["scenario_name"],
+            rank=scenario_alternative["rank"],
+        )
+
+    ## Copy entites
+    config = load_config(options.config_dir)
+    target_db = ines_transform.copy_entities(
+        source_db, target_db, config["entities_to_copy"]
+    )
+    ## Copy numeric parameters(source_db, target_db, copy_entities)
+    target_db = ines_transform.transform_parameters(
+        source_db, target_db, config["parameter_transforms"]
+    )
+    ## Copy methods(source_db, target_db, copy_entities)
+    target_db = ines_transform.process_methods(
+        source_db, target_db, config["parameter_methods"]
+    )
+    ## Copy entities to parameters
+    # target_db = ines_transform.copy_entities_to_parameters(source_db, target_db, entities_to_parameters)
+    return target_db
+
+
+def deduplicate_values(target_db, generated_alternatives=frozenset()):
+    """Removes values that repeat the Base value of the same entity and parameter.
+
+    A value is only removed when every scenario with its alternative resolves
+    to the same value without it: Base is in the scenario and no alternative
+    ranked between Base and it sets the parameter to something else. Values of
+    alternatives in no scenario are only removed for the alternatives the
+    conversion generated, e.g. the weather years. Byte identical values that
+    have to stay are reported.
+    """
+    scenario_ranks = {}
+    for item in target_db.get_scenario_alternative_items():
+        scenario_ranks.setdefault(item["scenario_name"], {})[
+            item["alternative_name"]
+        ] = item["rank"]
+    alternative_scenarios = {}
+    for ranks in scenario_ranks.values():
+        for alternative_name in ranks:
+            alternative_scenarios.setdefault(alternative_name, []).append(ranks)
+
+    def falls_back_to_base(alternative_name, overriding):
+        """Whether the scenarios with alternative_name resolve to Base without it."""
+        scenarios = alternative_scenarios.get(alternative_name)
+        if not scenarios:
+            return alternative_name in generated_alternatives
+        for ranks in scenarios:
+            if "Base" not in ranks:
+                return False
+            base_rank, rank = ranks["Base"], ranks[alternative_name]
+            # alternatives not in the scenario get the rank of Base
+            if any(
+                base_rank < ranks.get(other, base_rank) < rank for other in overriding
+            ):
+                return False
+        return True
+
+    values_by_parameter = {}
+    for item in target_db.get_parameter_value_items():
+        key = (
+            item["entity_class_name"],
+            tuple(item["entity_byname"]),
+            item["parameter_definition_name"],
+        )
+        values_by_parameter.setdefault(key, []).append(
+            (item["id"], item["alternative_name"], item["type"], item["value"])
+        )
+    removed_ids = []
+    removed_bytes = 0
+    copies = {}
+    for values in values_by_parameter.values():
+        base_values = [value[2:] for value in values if value[1] == "Base"]
+        # alternatives setting the parameter to something else than Base
+        overriding = [value[1] for value in values if [value[2:]] != base_values]
+        for id_, alternative_name, value_type, value in values:
+            if (
+                alternative_name != "Base"
+                and [(value_type, value)] == base_values
+                and falls_back_to_base(alternative_name, overriding)
+            ):
+                removed_ids.append(id_)
+                removed_bytes += len(value)
+            else:
+                copies.setdefault((value_type, value), []).append(id_)
+    if removed_ids:
+        _, errors = target_db.remove_items("parameter_value", *removed_ids)
+        errors = [error for error in errors if error]
+        if errors:
+            raise RuntimeError("\n".join(errors))
+        try:
+            target_db.commit_session("Removed values repeating Base")
+        except:
+            print("commit deduplication error")
+    repeated = [(value, ids) for (_, value), ids in copies.items() if len(ids) > 1]
+    print(
+        f"deduplication: removed {len(removed_ids)} values repeating Base,"
+        f" {removed_bytes / 1e3:.1f} kB saved; {len(repeated)} other values are"
+        f" stored {sum(len(ids) for _, ids in repeated)} times,"
+        f" {sum(len(value) * (len(ids) - 1) for value, ids in repeated) / 1e3:.1f} kB"
+        " in repeated copies"
+    )
+
+
+## Incremental conversion
+
+
+def content_hash(*parts):
+    digest = hashlib.blake2b(digest_size=8)
+    for part in parts:
+        digest.update(part if isinstance(part, bytes) else str(part).encode())
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+def source_content_hashes(source_db):
+    """Hashes every source item and configuration file the conversion reads."""
+    hashes = {}
+    file_names = [
+        os.path.join(options.config_dir, file_name)
+        for file_name in config_files.values()
+    ]
+    for file_name in file_names + [__file__]:
+        with open(file_name, "rb") as file:
+            hashes[json.dumps(["file", os.path.basename(file_name)])] = content_hash(
+                file.read()
+            )
+    # options changing the converted values
+    hashes[json.dumps(["options"])] = content_hash(
+        options.compact,
+        options.dedupe,
+        options.resolution,
+        options.representative_periods,
+        options.representative_length,
+    )
+    for item in source_db.get_alternative_items():
+        hashes[json.dumps(["alternative", item["name"]])] = content_hash(
+            item["description"]
+        )
+    for item in source_db.get_scenario_items():
+        hashes[json.dumps(["scenario", item["name"]])] = content_hash(
+            item["description"]
+        )
+    for item in source_db.get_scenario_alternative_items():
+        key = ["scenario_alternative", item["scenario_name"], item["alternative_name"]]
+        hashes[json.dumps(key)] = content_hash(item["rank"])
+    for item in source_db.get_entity_items():
+        key = ["entity", item["entity_class_name"], list(item["entity_byname"])]
+        hashes[json.dumps(key)] = content_hash(item["name"], item["description"])
+    for item in source_db.get_entity_group_items():
+        key = [
+            "entity_group",
+            item["entity_class_name"],
+            item["group_name"],
+            item["member_name"],
+        ]
+        hashes[json.dumps(key)] = content_hash()
+    for item in source_db.get_parameter_value_items():
+        key = [
+            "parameter_value",
+            item["entity_class_name"],
+            list(item["entity_byname"]),
+            item["parameter_definition_name"],
+            item["alternative_name"],
+        ]
+        hashes[json.dumps(key)] = content_hash(item["type"], item["value"])
+    return hashes
+
+
+def sqlite_path(url):
+    """Returns the file path of a sqlite url, None for other databases."""
+    if url.startswith("sqlite:///"):
+        return url[len("sqlite:///") :]
+    return None
+
+
+def incremental_state_path():
+    path = sqlite_path(options.target_url)
+    if path is not None:
+        return path + ".ines_state.json"
+    return None
+
+
+def read_incremental_state():
+    path = incremental_state_path()
+    if path is None or not os.path.exists(path):
+        return None
+    with open(path, "r") as file:
+        state = json.load(file)
+    if state.get("source") != options.source_url:
+        return None
+    return state
+
+
+def write_incremental_state(state):
+    path = incremental_state_path()
+    if path is None:
+        return
+    # never leave a half written state behind
+    with open(path + ".tmp", "w") as file:
+        json.dump(dict(state, source=options.source_url), file)
+    os.replace(path + ".tmp", path)
+
+
+def remove_incremental_state():
+    path = incremental_state_path()
+    if path is not None and os.path.exists(path):
+        os.remove(path)
+
+
+# fields identifying an item of each type written by the conversion
+item_key_fields = {
+    "alternative": ("name",),
+    "scenario": ("name",),
+    "scenario_alternative": ("scenario_name", "alternative_name"),
+    "entity": ("entity_class_name", "entity_byname"),
+    "entity_group": ("entity_class_name", "group_name", "member_name"),
+    "parameter_value": (
+        "entity_class_name",
+        "entity_byname",
+        "parameter_definition_name",
+        "alternative_name",
+    ),
+}
+
+
+def item_key(item_type, item):
+    """Returns the natural key of a written or recorded item as a json string."""
+    return json.dumps(
+        [item_type]
+        + [
+            list(item[field]) if field == "entity_byname" else item[field]
+            for field in item_key_fields[item_type]
+        ]
+    )
+
+
+def key_fields(key):
+    """Returns the item type and the identifying fields of an item_key."""
+    item_type, *values = json.loads(key)
+    fields = dict(zip(item_key_fields[item_type], values))
+    if "entity_byname" in fields:
+        fields["entity_byname"] = tuple(fields["entity_byname"])
+    return item_type, fields
+
+
+def item_hash(item):
+    return content_hash(
+        *(
+            part
+            for field in sorted(item)
+            for part in (
+                field,
+                tuple(item[field]) if field == "entity_byname" else item[field],
+            )
+        )
+    )
+
+
+def read_tag(item_type, filters):
+    """Returns the source items a read of item_type with filters depends on.
+
+    Tags are [item type, class, parameter], * stands for any.
+    """
+    return (
+        item_type,
+        filters.get("entity_class_name", "*"),
+        filters.get("parameter_definition_name", "*"),
+    )
+
+
+def source_tag(key):
+    """Returns the tag of a changed source item, a key of source_content_hashes."""
+    item_type = key[0]
+    if item_type == "parameter_value":
+        return (item_type, key[1], key[3])
+    if item_type in ("entity", "entity_group"):
+        return (item_type, key[1], "*")
+    return (item_type, "*", "*")
+
+
+def depends(reads, changed):
+    """Returns whether any of the read tags matches a changed source tag."""
+    return any(
+        all(part in ("*", changed_part) for part, changed_part in zip(read, tag))
+        for read in reads
+        for tag in changed
+    )
+
+
+class ReadTracker:
+    """Forwards to a source database while noting the tags of what is read.
+
+    Anything else than the get_*_item(s) calls is taken to depend on the whole
+    source.
+    """
+
+    def __init__(self, wrapped):
+        self.wrapped = wrapped
+        self.reads = set()
+
+    def __getattr__(self, name):
+        attribute = getattr(self.wrapped, name)
+        if name in ("get_item", "get_items"):
+
+            def tracked_call(item_type, *args, **filters):
+                self.reads.add(read_tag(item_type, filters))
+                return attribute(item_type, *args, **filters)
+
+            return tracked_call
+        match = re.fullmatch(r"get_(\w+?)_items?", name)
+        if match is None:
+            self.reads.add(("*", "*", "*"))
+            return attribute
 
-    if isinstance(param_elements, list):
-        target_param = param_elements[0]
-        multiplier = float(param_elements[1])
-        target_order = param_elements[2]
-    elif isinstance(param_elements, dict):
-        target_param = param_elements["target"][0]
-        conver_factor = float(param_elements["target"][1])
-        target_order = param_elements["target"][2]
-        op = operations[param_elements["operation"]]
-        try:
-            with_value = float(param_elements["with"])
-        except:
-            print("operating with ", param_elements["with"])
-            value_ = source_db.get_parameter_value_item(
-                entity_class_name=source_entity_class,
-                parameter_definition_name=param_elements["with"],
-                entity_byname=source_entity_names,
-                alternative_name=source_alternative,
-            )
-            if value_:
-                with_value = value_["parsed_value"]
-            else:
-                raise ValueError(
-                    f"{param_elements['with']} does not exist for {source_entity_class} {source_entity_names}"
-                )
-        multiplier = conver_factor * op(float(param_elements["target"][1]), with_value)
-
-    return target_param, target_order, multiplier
-
-
-def main():
-    with DatabaseMapping(url_db_in) as source_db:
-        with DatabaseMapping(url_db_out) as target_db:
-            ## Empty the database
-            target_db.purge_items("parameter_value")
-            target_db.purge_items("entity")
-            target_db.purge_items("alternative")
-            target_db.purge_items("scenario")
-            target_db.refresh_session()
-            target_db.commit_session("Purged stuff")
-
-            ## Copy alternatives
-            for alternative in source_db.get_alternative_items():
-                target_db.add_alternative_item(name=alternative["name"])
-            for scenario in source_db.get_scenario_items():
-                target_db.add_scenario_item(name=scenario["name"])
-            for scenario_alternative in source_db.get_scenario_alternative_items():
-                target_db.add_scenario_alternative_item(
-                    alternative_name=scenario_alternative["alternative_name"],
-                    scenario_name=scenario_alternative["scenario_name"],
-                    rank=scenario_alternative["rank"],
-                )
+        def tracked_call(*args, **filters):
+            self.reads.add(read_tag(match.group(1), filters))
+            return attribute(*args, **filters)
 
-            ## Copy entites
-            target_db = ines_transform.copy_entities(
-                source_db, target_db, entities_to_copy
-            )
-            ## Copy numeric parameters(source_db, target_db, copy_entities)
-            target_db = ines_transform.transform_parameters(
-                source_db, target_db, parameter_transforms
-            )
-            ## Copy methods(source_db, target_db, copy_entities)
-            target_db = ines_transform.process_methods(
-                source_db, target_db, parameter_methods
-            )
-            ## Copy entities to parameters
-            # target_db = ines_transform.copy_entities_to_parameters(source_db, target_db, entities_to_parameters)
+        return tracked_call
 
-            # Manual functions
-            # timeline configuration for spineopt model
-            timeline_setup(source_db, target_db)
 
-            ## historical and future time series
-            map_of_periods_or_historical_to_ts(
-                source_db, target_db, settings["map_of_periods_or_historical_to_ts"]
+class DeltaRecorder(StageRecorder):
+    """Records the additions of a conversion step rerun by --incremental.
+
+    The target is read as a full conversion leaves it for the step: items that
+    only the step itself or the steps after it added are hidden. Writing to the
+    target other than through the BulkWriter additions is not supported.
+    """
+
+    def __init__(self, target_db, hidden):
+        self._target_db = target_db
+        self._hidden = hidden
+        super().__init__()
+
+    def __getattr__(self, name):
+        match = re.fullmatch(r"get_(\w+?)_item(s?)", name)
+        if match is None:
+            raise AttributeError(
+                f"incremental conversions can not record {name} on the target"
             )
+        attribute = getattr(self._target_db, name)
+        item_type, many = match.groups()
+        if item_type not in item_key_fields:
+            return attribute
+
+        def visible_call(*args, **filters):
+            if many:
+                return [
+                    item
+                    for item in attribute(*args, **filters)
+                    if item_key(item_type, item) not in self._hidden
+                ]
+            item = attribute(*args, **filters)
+            if item and item_key(item_type, item) in self._hidden:
+                return {}
+            return item
+
+        return visible_call
+
+
+def apply_delta(target_db, index, previous, recorded, owners, errors):
+    """Writes the difference between the last and the new outputs of a step.
+
+    previous maps the item keys the step wrote last time to their hashes,
+    owners the item keys to the positions of the steps writing them. Items
+    another step still writes stay. Additions of items an earlier step wrote
+    are errors unless they were made with exist_ok, like in a full conversion.
+    Returns the new output hashes and the entity classes that changed.
+    """
+    items = {}
+    for item_type, item in recorded:
+        if item_type == "commit":
+            continue
+        key = item_key(item_type, item)
+        exist_ok = item.pop("exist_ok", False)
+        if not exist_ok and any(owner < index for owner in owners.get(key, ())):
+            errors.append(f"there's already a {item_type} with {key}")
+            continue
+        items[key] = (item_type, item)
+    outputs = {key: item_hash(item) for key, (_, item) in items.items()}
+
+    additions = {item_type: [] for item_type in BulkWriter.item_types}
+    updates = {item_type: [] for item_type in BulkWriter.item_types}
+    removals = {item_type: [] for item_type in BulkWriter.item_types}
+    changed_classes = set()
+    for key, (item_type, item) in items.items():
+        if previous.get(key) == outputs[key]:
+            continue
+        existing = target_db.get_item(item_type, **key_fields(key)[1])
+        if not existing:
+            additions[item_type].append(item)
+        elif any(
+            existing[field] != value
+            for field, value in item.items()
+            if field not in item_key_fields[item_type]
+        ):
+            updates[item_type].append(dict(item, id=existing["id"]))
+        else:
+            continue
+        changed_classes.add(item.get("entity_class_name"))
+    for key in previous.keys() - items.keys():
+        if owners.get(key, set()) - {index}:
+            continue
+        item_type, fields = key_fields(key)
+        existing = target_db.get_item(item_type, **fields)
+        if existing:
+            removals[item_type].append(existing["id"])
+            changed_classes.add(fields.get("entity_class_name"))
+
+    # elements before the entities made of them
+    additions["entity"].sort(key=lambda item: len(item["entity_byname"]))
+    for item_type in BulkWriter.item_types:
+        if additions[item_type]:
+            errors += target_db.add_items(
+                item_type, *additions[item_type], strict=False
+            )[1]
+        if updates[item_type]:
+            errors += target_db.update_items(
+                item_type, *updates[item_type], strict=False
+            )[1]
+    # dependent items go first
+    for item_type in reversed(BulkWriter.item_types):
+        if removals[item_type]:
+            target_db.remove_items(item_type, *removals[item_type], strict=False)
+    changed_classes.discard(None)
+    return outputs, changed_classes
+
+
+def convert_incremental(source_db, target_db):
+    """Reruns the conversion steps whose source changed and writes the delta.
+
+    Each step, copy_generic and the stages, is recorded in the state with the
+    tags of the source items it read and the hashes of the items it wrote. A
+    step reruns when a source item it read changed or an earlier step changed
+    a target class it reads. Only the items whose hash changed are written and
+    the items no step writes anymore are removed, all in one commit. Changes
+    to the configuration, the converter or the options, and commits into the
+    target after the last run, convert everything.
+    """
+    if options.dedupe:
+        print("--dedupe compares every converted value, converting everything")
+        remove_incremental_state()
+        journal = open_journal(source_db, target_db)
+        convert_databases(source_db, target_db, journal)
+        return
+    # fails on invalid mapping settings before anything is written
+    mapping_plan(options.config_dir)
+    source_hashes = source_content_hashes(source_db)
+    state = read_incremental_state()
+    if state is not None and state.get("target_commit") != last_commit_id(target_db):
+        print(
+            "target changed after the last incremental conversion,"
+            " converting everything"
+        )
+        state = None
+    if state is not None and state["hashes"] == source_hashes:
+        print("Source and configuration unchanged, nothing to convert")
+        return
+    steps = [("copy_generic", None)] + [(stage.name, stage) for stage in stages]
+    changed = None
+    if state is not None:
+        changed_keys = [
+            json.loads(key)
+            for key in source_hashes.keys() | state["hashes"].keys()
+            if source_hashes.get(key) != state["hashes"].get(key)
+        ]
+        print(f"{len(changed_keys)} source items changed since the last conversion")
+        if set(state["steps"]) != {name for name, _ in steps} or any(
+            key[0] in ("file", "options") for key in changed_keys
+        ):
+            print("configuration or converter changed, converting everything")
+        else:
+            changed = {source_tag(key) for key in changed_keys}
+    if changed is None:
+        purge_target(target_db)
+        state = {"timeline_reads": [], "steps": {}}
+
+    snapshot = SourceSnapshot(source_db)
+    timeline_tracker = ReadTracker(snapshot)
+    timeline = timeline_context(timeline_tracker)
+    rerun_all = changed is None or depends(state["timeline_reads"], changed)
+    owners = {}
+    for index, (name, _) in enumerate(steps):
+        for key in state["steps"].get(name, {"outputs": {}})["outputs"]:
+            owners.setdefault(key, set()).add(index)
+    changed_classes = set()
+    new_steps = {}
+    errors = []
+    for index, (name, stage) in enumerate(steps):
+        previous = state["steps"].get(name, {"reads": [], "outputs": {}})
+        if not (
+            rerun_all
+            or depends(previous["reads"], changed)
+            or (stage is not None and changed_classes & set(stage.reads))
+        ):
+            new_steps[name] = previous
+            continue
+        print(f"{name} reruns")
+        hidden = {key for key, indexes in owners.items() if min(indexes) >= index}
+        recorder = DeltaRecorder(target_db, hidden)
+        if stage is None:
+            tracker = ReadTracker(source_db)
+            copy_generic(tracker, recorder)
+        else:
+            tracker = ReadTracker(snapshot)
+            run_stage(stage, tracker, recorder, timeline)
+        recorder.flush()
+        errors += recorder.errors
+        outputs, classes = apply_delta(
+            target_db, index, previous["outputs"], recorder.recorded, owners, errors
+        )
+        changed_classes |= classes
+        for key in previous["outputs"]:
+            owners[key].discard(index)
+            if not owners[key]:
+                del owners[key]
+        for key in outputs:
+            owners.setdefault(key, set()).add(index)
+        new_steps[name] = {"reads": sorted(tracker.reads), "outputs": outputs}
+    errors = [error for error in errors if error]
+    if errors:
+        raise RuntimeError(
+            f"{len(errors)} items could not be written:\n" + "\n".join(errors)
+        )
+    try:
+        target_db.commit_session("Applied incremental conversion")
+    except api.exception.NothingToCommit:
+        print("the changed source items convert to the same target items")
+    write_incremental_state(
+        {
+            "hashes": source_hashes,
+            "timeline_reads": sorted(timeline_tracker.reads),
+            "steps": new_steps,
+            "target_commit": last_commit_id(target_db),
+        }
+    )
 
-            ## flow profiles addition
-            flow_profile_method(source_db, target_db)
 
-            ## investments not allowed
-            limiting_investments_notallowed(source_db, target_db)
+def last_commit_id(db_map):
+    commits = db_map.commit_sq
+    return db_map.query(commits.c.id).order_by(commits.c.id.desc()).limit(1).scalar()
 
-            # Process emisssions balance equations
-            process_emissions(source_db, target_db)
 
-            # Fix boundary condition for storages
-            storage_state_fix_method(source_db, target_db)
-            storage_state_binding_method(source_db, target_db)
+def source_fingerprint(source_db):
+    """Identifies the source and configuration the stages are converted from.
 
-            # Set to group constraints
-            set_to_entities_and_parameters(source_db, target_db)
+    Every change to a spine database is a commit, the last commit of the source
+    stands for its content.
+    """
+    commits = source_db.commit_sq
+    last_commit = source_db.query(commits).order_by(commits.c.id.desc()).first() or ()
+    parts = [
+        options.source_url,
+        *last_commit,
+        options.compact,
+        options.dedupe,
+        options.resolution,
+        options.representative_periods,
+        options.representative_length,
+    ]
+    file_names = [
+        os.path.join(options.config_dir, file_name)
+        for file_name in config_files.values()
+    ]
+    for file_name in file_names + [__file__]:
+        with open(file_name, "rb") as file:
+            parts.append(content_hash(file.read()))
+    return content_hash(*parts)
+
+
+class StageJournal:
+    """Checkpoint journal of the stages committed into a sqlite target.
+
+    Kept next to the target as <target>.ines_journal.json. A stage is recorded
+    with the errors it collected once its additions are committed, --resume
+    skips it as long as the source fingerprint and the last commit of the
+    target are the ones recorded.
+    """
+
+    def __init__(self, path, fingerprint):
+        self.path = path
+        self.fingerprint = fingerprint
+        # stage name: errors reported by the stage
+        self.completed = {}
+        self.target_commit = None
+        self.partial = None
+
+    def load(self, target_db):
+        """Reads the journal, returns whether its stages can be skipped."""
+        if not os.path.exists(self.path):
+            print("no checkpoint journal, converting everything")
+            return False
+        with open(self.path, "r") as file:
+            state = json.load(file)
+        if state["fingerprint"] != self.fingerprint:
+            print("source or configuration changed, converting everything")
+            return False
+        if state["partial"] is not None:
+            print(
+                f"{state['partial']} committed part of its items before failing,"
+                " converting everything"
+            )
+            return False
+        if state["target_commit"] != last_commit_id(target_db):
+            print("target changed after the last checkpoint, converting everything")
+            return False
+        self.completed = state["completed"]
+        self.target_commit = state["target_commit"]
+        return True
+
+    def reset(self, target_db):
+        self.completed = {}
+        self.partial = None
+        self.target_commit = last_commit_id(target_db)
+        self.write()
+
+    def skip(self, name, target_db):
+        """Returns whether stage name was completed, restores its errors if so."""
+        if name not in self.completed:
+            return False
+        print(f"{name} skipped, committed before")
+        target_db.errors += self.completed[name]
+        return True
+
+    def mark_partial(self, name):
+        self.partial = name
+        self.write()
+
+    def record(self, name, errors, target_db):
+        self.completed[name] = errors
+        self.partial = None
+        self.target_commit = last_commit_id(target_db)
+        self.write()
+
+    def write(self):
+        state = {
+            "source": options.source_url,
+            "fingerprint": self.fingerprint,
+            "target_commit": self.target_commit,
+            "partial": self.partial,
+            "completed": self.completed,
+        }
+        # never leave a half written journal behind
+        with open(self.path + ".tmp", "w") as file:
+            json.dump(state, file)
+        os.replace(self.path + ".tmp", self.path)
+
+
+def open_journal(source_db, target_db):
+    """Returns the checkpoint journal of the target, purges the target unless resumed.
+
+    Targets other than sqlite files have no journal and are always purged.
+    """
+    path = sqlite_path(options.target_url)
+    if path is None:
+        if options.resume:
+            print("--resume needs a sqlite target, converting everything")
+        purge_target(target_db)
+        return None
+    journal = StageJournal(path + ".ines_journal.json", source_fingerprint(source_db))
+    if options.resume and journal.load(target_db):
+        print(f"resuming after {len(journal.completed)} committed stages")
+        return journal
+    purge_target(target_db)
+    journal.reset(target_db)
+    return journal
+
+
+def checkpoint(name, target_db, journal, errors_before, profiler=None):
+    """Commits a completed stage and records it in the journal."""
+    if journal is None:
+        return
+    if profiler is None:
+        target_db.checkpoint(f"Completed {name}")
+    else:
+        profiler.measure_commits(
+            name, lambda: target_db.checkpoint(f"Completed {name}")
+        )
+    journal.record(name, target_db.errors[errors_before:], target_db)
+
+
+def template_data(db_map):
+    """Exports the classes and definitions of db_map without any items."""
+    return api.export_data(
+        db_map,
+        entity_ids=(),
+        entity_group_ids=(),
+        parameter_value_ids=(),
+        alternative_ids=(),
+        scenario_ids=(),
+        scenario_alternative_ids=(),
+        entity_alternative_ids=(),
+        entity_metadata_ids=(),
+        parameter_value_metadata_ids=(),
+    )
 
-            # Default parameters
-            default_parameters(target_db, settings["default_parameters"])
-            candidates_to_number_of(target_db)
 
-            # existing capacity
-            existing_capacity(source_db, target_db)
+@functools.lru_cache(maxsize=None)
+def load_template(template):
+    """Reads a SpineOpt template json file or database url, once per template."""
+    if template.endswith(".json"):
+        with open(template, "r") as file:
+            return json.load(file)
+    with api.DatabaseMapping(template) as template_db:
+        return template_data(template_db)
+
+
+def create_from_template(url, template):
+    """Returns a new database at url with the classes and definitions of template."""
+    db_map = api.DatabaseMapping(url, create=True)
+    _, errors = api.import_data(db_map, **template)
+    if errors:
+        db_map.close()
+        raise RuntimeError("Could not import the template:\n" + "\n".join(errors))
+    db_map.commit_session("Imported SpineOpt template")
+    return db_map
+
+
+def delta_items(item_type, db_map):
+    """Maps the natural key of each item to the fields compared and written."""
+    items = {}
+    for item in db_map.get_items(item_type):
+        if item_type in ("alternative", "scenario"):
+            key = item["name"]
+            fields = {"name": item["name"], "description": item["description"]}
+        elif item_type == "scenario_alternative":
+            key = (item["scenario_name"], item["alternative_name"])
+            fields = {
+                "scenario_name": item["scenario_name"],
+                "alternative_name": item["alternative_name"],
+                "rank": item["rank"],
+            }
+        elif item_type == "entity":
+            key = (item["entity_class_name"], tuple(item["entity_byname"]))
+            fields = {
+                "entity_class_name": item["entity_class_name"],
+                "name": item["name"],
+                "entity_byname": tuple(item["entity_byname"]),
+                "description": item["description"],
+            }
+        elif item_type == "entity_group":
+            key = (item["entity_class_name"], item["group_name"], item["member_name"])
+            fields = {
+                "entity_class_name": item["entity_class_name"],
+                "group_name": item["group_name"],
+                "member_name": item["member_name"],
+            }
+        else:
+            key = (
+                item["entity_class_name"],
+                tuple(item["entity_byname"]),
+                item["parameter_definition_name"],
+                item["alternative_name"],
+            )
+            fields = {
+                "entity_class_name": item["entity_class_name"],
+                "entity_byname": tuple(item["entity_byname"]),
+                "parameter_definition_name": item["parameter_definition_name"],
+                "alternative_name": item["alternative_name"],
+                "value": item["value"],
+                "type": item["type"],
+            }
+        items[key] = (item["id"], fields)
+    return items
+
+
+## Import packages
+
+package_format = "ines-spineopt-package"
+
+
+def write_package(db_map, path):
+    """Writes the items of db_map into an import package at path.
+
+    The package is a zip file with a json file of columns per item type.
+    Parameter values are stored serialized, one after another, in
+    parameter_value.bin with their sizes in the value_size column.
+    Returns the number of items written per type.
+    """
+    counts = {}
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as package:
+        for item_type in BulkWriter.item_types:
+            rows = [fields for _, fields in delta_items(item_type, db_map).values()]
+            if item_type == "entity":
+                # elements before the entities made of them
+                rows.sort(key=lambda fields: len(fields["entity_byname"]))
+            columns = {}
+            if rows:
+                columns = {field: [row[field] for row in rows] for field in rows[0]}
+            if item_type == "parameter_value":
+                values = columns.pop("value", [])
+                columns["value_size"] = [len(value) for value in values]
+                package.writestr("parameter_value.bin", b"".join(values))
+            package.writestr(f"{item_type}.json", json.dumps(columns))
+            counts[item_type] = len(rows)
+        package.writestr(
+            "package.json",
+            json.dumps({"format": package_format, "version": 1, "counts": counts}),
+        )
+    return counts
+
+
+def read_package(path):
+    """Returns the items of an import package by type, in the order to add them."""
+    items = {}
+    with zipfile.ZipFile(path, "r") as package:
+        metadata = json.loads(package.read("package.json"))
+        if metadata.get("format") != package_format or metadata["version"] != 1:
+            raise RuntimeError(f"{path} is not an ines-spineopt import package")
+        for item_type in BulkWriter.item_types:
+            columns = json.loads(package.read(f"{item_type}.json"))
+            if item_type == "parameter_value" and columns:
+                blob = package.read("parameter_value.bin")
+                offsets = np.cumsum([0] + columns.pop("value_size"))
+                columns["value"] = [
+                    blob[start:end] for start, end in zip(offsets[:-1], offsets[1:])
+                ]
+            if "entity_byname" in columns:
+                columns["entity_byname"] = [
+                    tuple(byname) for byname in columns["entity_byname"]
+                ]
+            items[item_type] = [
+                dict(zip(columns, row)) for row in zip(*columns.values())
+            ]
+    return items
+
+
+def import_package(path, target_url, template=None):
+    """Replaces the content of target_url with an import package.
+
+    Each item type is added with a single add_items call and everything is
+    committed once. A missing sqlite target is created from template, a
+    SpineOpt template json file or database url.
+    """
+    items = read_package(path)
+    target_path = sqlite_path(target_url)
+    if (
+        template is not None
+        and target_path is not None
+        and not os.path.exists(target_path)
+    ):
+        create_from_template(target_url, load_template(template)).close()
+    with api.DatabaseMapping(target_url) as target_db:
+        purge_target(target_db)
+        errors = []
+        for item_type in BulkWriter.item_types:
+            if items[item_type]:
+                _, type_errors = target_db.add_items(
+                    item_type, *items[item_type], strict=False
+                )
+                errors += type_errors
+        errors = [error for error in errors if error]
+        if errors:
+            raise RuntimeError(
+                f"{len(errors)} items could not be imported:\n" + "\n".join(errors)
+            )
+        target_db.commit_session(f"Imported {os.path.basename(path)}")
+    print(
+        f"imported {sum(len(type_items) for type_items in items.values())} items"
+        f" from {path}"
+    )
 
-            # lifetime to duration
-            lifetime_to_duration(source_db, target_db, settings["lifetime_to_duration"])
 
-            # unit flow transformation
-            unit_flow_variants(source_db, target_db, settings)
+def export_package(source_url, path, template, config_dir=None, **kwargs):
+    """Converts the INES database at source_url into an import package at path.
+
+    Nothing is written to a database: the conversion runs against an in-memory
+    database with the classes and definitions of template, a SpineOpt template
+    json file or database url, and its items are written to the package
+    uncommitted. Other keyword arguments are those of convert.
+    """
+    if config_dir is None:
+        config_dir = ConversionOptions.config_dir
+    configure(ConversionOptions(source_url, None, config_dir, **kwargs))
+    if options.incremental or options.resume:
+        raise RuntimeError("exported packages are always converted in full")
+    with api.DatabaseMapping(source_url) as source_db:
+        scratch_db = create_from_template("sqlite://", load_template(template))
+        try:
+            purge_target(scratch_db)
+            convert_databases(source_db, scratch_db, commit=False)
+            counts = write_package(scratch_db, path)
+        finally:
+            scratch_db.close()
+    print(
+        f"exported {sum(counts.values())} items to {path}:"
+        + ",".join(f" {count} {item_type}" for item_type, count in counts.items())
+    )
 
 
-def process_emissions(source_db, target_db):
+def process_emissions(source_db, target_db, timeline):
 
-    for param_map in source_db.get_parameter_value_items(
+    co2_maps = source_db.get_parameter_value_items(
         entity_class_name="set", parameter_definition_name="co2_max_cumulative"
+    )
+    for param_map in co2_maps:
+        add_entity(target_db, "node", ("atmosphere",))
+        add_parameter_value(
+            target_db,
+            "node",
+            "has_state",
+            param_map["alternative_name"],
+            ("atmosphere",),
+            True,
+        )  # Base
+
+    co2_maps = [param_map for param_map in co2_maps if param_map["type"] == "map"]
+    values, found = period_map_values(
+        [param_map["parsed_value"] for param_map in co2_maps], timeline
+    )
+    has_periods = found.any(axis=1)
+    co2_maps = [param_map for i, param_map in enumerate(co2_maps) if has_periods[i]]
+    values = values[has_periods]
+    max_values = values.max(axis=1)
+    # a period map of zeros gets a zero availability rather than NaN
+    availabilities = np.divide(
+        values,
+        max_values[:, np.newaxis],
+        out=np.zeros_like(values),
+        where=max_values[:, np.newaxis] != 0,
+    )
+    for param_map, ts_to_export, max_value in zip(
+        co2_maps,
+        period_time_series(availabilities, timeline),
+        max_values.tolist(),
     ):
-        if param_map:
-            add_entity(target_db, "node", ("atmosphere",))
-            add_parameter_value(
-                target_db,
-                "node",
-                "has_state",
-                param_map["alternative_name"],
-                ("atmosphere",),
-                True,
-            )  # Base
-            if param_map["type"] == "map":
-                # getting periods info
-                starttime = {}
-                year_repr = {}
-                for period in json.loads(
-                    source_db.get_parameter_value_items(
-                        entity_class_name="solve_pattern",
-                        parameter_definition_name="period",
-                    )[0]["value"]
-                )["data"]:
-                    starttime[period] = json.loads(
-                        source_db.get_parameter_value_item(
-                            entity_class_name="period",
-                            entity_byname=(period,),
-                            alternative_name="Base",
-                            parameter_definition_name="start_time",
-                        )["value"]
-                    )["data"]
-                    year_repr[period] = source_db.get_parameter_value_item(
-                        entity_class_name="period",
-                        entity_byname=(period,),
-                        alternative_name="Base",
-                        parameter_definition_name="years_represented",
-                    )["parsed_value"]
-
-                map_table = convert_map_to_table(param_map["parsed_value"])
-                index_names = nested_index_names(param_map["parsed_value"])
-                data = pd.DataFrame(
-                    map_table, columns=index_names + ["value"]
-                ).set_index(index_names[0])
-                data.index = data.index.astype("string")
-
-                if any(i in data.index for i in starttime):
-                    indexes_ = []
-                    values_ = []
-                    for period_, ts_index_ in starttime.items():
-                        values_.append(
-                            (
-                                float(data.at[period_, "value"])
-                                if period_ in data.index
-                                else 0.0
-                            )
-                        )
-
-                        # this should be removed once the fixed resolution is repaired
-                        indexes_.append(ts_index_)
-                    values_.append(values_[-1])
-                    indexes_.append(
-                        (
-                            pd.Timestamp(ts_index_).replace(
-                                year=int(
-                                    pd.Timestamp(ts_index_).year + year_repr[period_]
-                                )
-                            )
-                        ).isoformat()
-                    )
-
-                    ts_to_export = {
-                        "type": "time_series",
-                        "data": dict(
-                            zip(indexes_, [i / max(values_) for i in values_])
-                        ),
-                    }
-                    add_parameter_value(
-                        target_db,
-                        "node",
-                        "node_availability_factor",
-                        param_map["alternative_name"],
-                        param_map["entity_byname"],
-                        ts_to_export,
-                    )
-                    add_parameter_value(
-                        target_db,
-                        "node",
-                        "node_state_cap",
-                        param_map["alternative_name"],
-                        param_map["entity_byname"],
-                        max(values_),
-                    )
+        add_parameter_value(
+            target_db,
+            "node",
+            "node_availability_factor",
+            param_map["alternative_name"],
+            param_map["entity_byname"],
+            ts_to_export,
+        )
+        add_parameter_value(
+            target_db,
+            "node",
+            "node_state_cap",
+            param_map["alternative_name"],
+            param_map["entity_byname"],
+            max_value,
+        )
 
     # unit flow coming from fossil nodes
     co2_params = source_db.get_parameter_value_items(
@@ -347,16 +3094,20 @@ def process_emissions(source_db, target_db):
         if co2_param["entity_name"] != "CO2"
     }
 
+    # input and output nodes of each unit
+    unit_inputs = {}
+    for entity in target_db.get_entity_items(entity_class_name="unit__from_node"):
+        unit_name, node_name = entity["entity_byname"]
+        unit_inputs.setdefault(unit_name, set()).add(node_name)
+    unit_outputs = {}
+    for entity in target_db.get_entity_items(entity_class_name="unit__to_node"):
+        unit_name, node_name = entity["entity_byname"]
+        unit_outputs.setdefault(unit_name, []).append(node_name)
+
     for unit_entity in target_db.get_entity_items(entity_class_name="unit"):
-        unit__from_nodes = [
-            from_node
-            for from_node in co2_value
-            if target_db.get_entity_item(
-                entity_class_name="unit__from_node",
-                entity_byname=(unit_entity["name"], from_node),
-            )
-        ]
         unit_name = unit_entity["name"]
+        inputs = unit_inputs.get(unit_name, ())
+        unit__from_nodes = [from_node for from_node in co2_value if from_node in inputs]
         if len(unit__from_nodes) > 1:
             add_entity(target_db, "unit__to_node", (unit_name, "atmosphere"))
             add_entity(target_db, "user_constraint", (unit_name + "_emissions",))
@@ -403,13 +3154,12 @@ def process_emissions(source_db, target_db):
                 co2_value[unit__from_nodes[0]],
             )
 
-    for entity_items in [
-        element
-        for element in target_db.get_entity_items(entity_class_name="unit__to_node")
-        if "CO2" in element["entity_byname"][1]
+    for unit_name, node_out in [
+        (unit_name, node_out)
+        for unit_name, outputs in unit_outputs.items()
+        for node_out in outputs
+        if "CO2" in node_out
     ]:
-        entity_byname = entity_items["entity_byname"]
-        unit_name, node_out = entity_byname
         add_entity(target_db, "unit__from_node", (unit_name, "atmosphere"))
         add_entity(target_db, "unit__node__node", (unit_name, node_out, "atmosphere"))
         add_parameter_value(
@@ -427,196 +3177,84 @@ def process_emissions(source_db, target_db):
         print("commit process capacities error")
 
 
-def map_of_periods_or_historical_to_ts(source_db, target_db, settings):
-
-    starttime = {}
-    year_repr = {}
-    for period in json.loads(
-        source_db.get_parameter_value_items(
-            entity_class_name="solve_pattern", parameter_definition_name="period"
-        )[0]["value"]
-    )["data"]:
-        starttime[period] = json.loads(
-            source_db.get_parameter_value_item(
-                entity_class_name="period",
-                entity_byname=(period,),
-                alternative_name="Base",
-                parameter_definition_name="start_time",
-            )["value"]
-        )["data"]
-        year_repr[period] = source_db.get_parameter_value_item(
-            entity_class_name="period",
-            entity_byname=(period,),
-            alternative_name="Base",
-            parameter_definition_name="years_represented",
-        )["parsed_value"]
+def map_of_periods_or_historical_to_ts(source_db, target_db, mappings, timeline):
 
-    duration = json.loads(
-        source_db.get_parameter_value_items(
-            entity_class_name="solve_pattern", parameter_definition_name="duration"
-        )[0]["value"]
-    )["data"]
-    starttime_sp = json.loads(
-        source_db.get_parameter_value_items(
-            entity_class_name="solve_pattern", parameter_definition_name="start_time"
-        )[0]["value"]
-    )["data"]
-    resolution = json.loads(
-        source_db.get_parameter_value_items(
-            entity_class_name="solve_pattern",
-            parameter_definition_name="time_resolution",
-        )[0]["value"]
-    )["data"]
+    for mapping in mappings:
+        source_entity_class = mapping.source_class
+        target_entity_class = mapping.target_class
+        print(source_entity_class, target_entity_class, mapping.source_param)
+        target_param = mapping.target_param
 
-    for source_entity_class in settings:
-        for target_entity_class in settings[source_entity_class]:
-            for source_param in settings[source_entity_class][target_entity_class]:
-                print(source_entity_class, target_entity_class, source_param)
-                param_elements = settings[source_entity_class][target_entity_class][
-                    source_param
-                ]
+        operands = None
+        if mapping.operand_param is not None:
+            operands = operand_values(mapping, source_db)
+        for page in pages(
+            source_db.get_parameter_value_items(
+                entity_class_name=source_entity_class,
+                parameter_definition_name=mapping.source_param,
+            )
+        ):
+            period_maps = []
+            for param_map in page:
+
+                multiplier = mapping.multiplier
+                if operands is not None:
+                    param_map, multiplier = apply_operand(mapping, operands, param_map)
+                entity_byname = param_map["entity_byname"]
+                target_names = tuple(
+                    "__".join([entity_byname[i] for i in names])
+                    for names in mapping.target_order
+                )
 
-                for param_map in source_db.get_parameter_value_items(
-                    entity_class_name=source_entity_class,
-                    parameter_definition_name=source_param,
-                ):
+                if param_map["type"] == "map":
+                    period_maps.append(
+                        (param_map, target_param, target_names, multiplier)
+                    )
 
-                    target_param, target_order, multiplier = parameter_features(
-                        param_elements,
-                        source_db,
-                        source_entity_class,
-                        param_map["entity_byname"],
+                elif param_map["type"] == "float":
+                    add_parameter_value(
+                        target_db,
+                        target_entity_class,
+                        target_param,
                         param_map["alternative_name"],
+                        target_names,
+                        multiplier * param_map["parsed_value"],
                     )
 
-                    if param_map["type"] == "map":
-
-                        map_table = convert_map_to_table(param_map["parsed_value"])
-                        index_names = nested_index_names(param_map["parsed_value"])
-                        data = pd.DataFrame(
-                            map_table, columns=index_names + ["value"]
-                        ).set_index(index_names[0])
-                        data.index = data.index.astype("string")
-
-                        if any(i in data.index for i in starttime):
-                            indexes_ = []
-                            values_ = []
-                            for period_, ts_index_ in starttime.items():
-                                values_.append(
-                                    multiplier
-                                    * (
-                                        float(data.at[period_, "value"])
-                                        if period_ in data.index
-                                        else 0.0
-                                    )
-                                )
-
-                                # this should be removed once the fixed resolution is repaired
-                                indexes_.append(ts_index_)
-                            values_.append(values_[-1])
-                            indexes_.append(
-                                (
-                                    pd.Timestamp(ts_index_).replace(
-                                        year=int(
-                                            pd.Timestamp(ts_index_).year
-                                            + year_repr[period_]
-                                        )
-                                    )
-                                ).isoformat()
-                            )
-
-                            ts_to_export = {
-                                "type": "time_series",
-                                "data": dict(zip(indexes_, values_)),
-                            }
-                            target_names = tuple(
-                                [
-                                    "__".join(
-                                        [
-                                            param_map["entity_byname"][int(i) - 1]
-                                            for i in k
-                                        ]
-                                    )
-                                    for k in target_order
-                                ]
-                            )
-                            add_parameter_value(
-                                target_db,
-                                target_entity_class,
-                                target_param,
-                                param_map["alternative_name"],
-                                target_names,
-                                ts_to_export,
-                            )
-
-                        if any(i in data.index for i in starttime_sp):
-                            for index, element in enumerate(starttime_sp):
-                                try:
-                                    alternative_name = (
-                                        f"wy{str(pd.Timestamp(element).year)}"
-                                    )
-                                    add_alternative(target_db, alternative_name)
-                                except:
-                                    pass
-                                steps = pd.to_timedelta(duration) / pd.to_timedelta(
-                                    resolution
-                                )
-                                df_data = (
-                                    multiplier
-                                    * data.iloc[
-                                        data.index.tolist()
-                                        .index(element) : data.index.tolist()
-                                        .index(element)
-                                        + int(steps),
-                                        data.columns.tolist().index("value"),
-                                    ]
-                                ).tolist()
-                                ts_export = {
-                                    "type": "time_series",
-                                    "data": df_data,
-                                    "index": {
-                                        "start": f"2018{element[4:]}",
-                                        "resolution": resolution,
-                                        "ignore_year": True,
-                                    },
-                                }
-                                target_names = tuple(
-                                    [
-                                        "__".join(
-                                            [
-                                                param_map["entity_byname"][int(i) - 1]
-                                                for i in k
-                                            ]
-                                        )
-                                        for k in target_order
-                                    ]
-                                )
-                                add_parameter_value(
-                                    target_db,
-                                    target_entity_class,
-                                    target_param,
-                                    alternative_name,
-                                    target_names,
-                                    ts_export,
-                                )
+            period_series = cached_period_time_series(
+                [period_map[0] for period_map in period_maps],
+                [period_map[3] for period_map in period_maps],
+                timeline,
+            )
+            for (
+                (param_map, target_param, target_names, multiplier),
+                (periods_found, indexes, ts_to_export),
+            ) in zip(period_maps, period_series):
+                if periods_found:
+                    add_parameter_value(
+                        target_db,
+                        target_entity_class,
+                        target_param,
+                        param_map["alternative_name"],
+                        target_names,
+                        ts_to_export,
+                    )
+                # a map of periods only cannot hold historical data
+                if periods_found == indexes:
+                    continue
 
-                    elif param_map["type"] == "float":
-                        target_names = tuple(
-                            [
-                                "__".join(
-                                    [param_map["entity_byname"][int(i) - 1] for i in k]
-                                )
-                                for k in target_order
-                            ]
-                        )
-                        add_parameter_value(
-                            target_db,
-                            target_entity_class,
-                            target_param,
-                            param_map["alternative_name"],
-                            target_names,
-                            multiplier * param_map["parsed_value"],
-                        )
+                for alternative_name, ts_to_export in cached_weather_year_series(
+                    param_map, timeline, multiplier, resample_aggregation(target_param)
+                ):
+                    add_alternative(target_db, alternative_name, exist_ok=True)
+                    add_parameter_value(
+                        target_db,
+                        target_entity_class,
+                        target_param,
+                        alternative_name,
+                        target_names,
+                        ts_to_export,
+                    )
 
     try:
         target_db.commit_session("Added map of periods, historical data to timeseries")
@@ -624,12 +3262,20 @@ def map_of_periods_or_historical_to_ts(source_db, target_db, settings):
         print("commit map of periods, historical data to timeseries error")
 
 
-def timeline_setup(source_db, target_db):
+def operations_block_starts(timeline):
+    """Returns the starts of the operations blocks of a multiyear timeline."""
+    # leap year blocks after the first one start one step early
+    return timeline.block_start - np.where(
+        timeline.leap_year & (np.arange(len(timeline.periods)) > 0),
+        timeline.model_resolution_td,
+        np.timedelta64(0, "s"),
+    )
+
+
+def timeline_setup(target_db, timeline):
 
     # model_data
-    model_name = source_db.get_entity_items(entity_class_name="solve_pattern")[0][
-        "name"
-    ]
+    model_name = timeline.model_name
     # Process scenario realizations
     sto_structure = "deterministic"
     sto_scenario = "realization"
@@ -649,127 +3295,81 @@ def timeline_setup(source_db, target_db):
         (sto_structure, sto_scenario),
     )
 
-    periods = json.loads(
-        source_db.get_parameter_value_items(
-            entity_class_name="solve_pattern", parameter_definition_name="period"
-        )[0]["value"]
-    )["data"]
-    resolution = json.loads(
-        source_db.get_parameter_value_items(
-            entity_class_name="solve_pattern",
-            parameter_definition_name="time_resolution",
-        )[0]["value"]
-    )["data"]
-
-    # historical data
-    duration = json.loads(
-        source_db.get_parameter_value_items(
-            entity_class_name="solve_pattern", parameter_definition_name="duration"
-        )[0]["value"]
-    )["data"]
-    py_yearrs = []
+    periods = timeline.periods
+    resolution = timeline.model_resolution
+    py_yearrs = timeline.years_represented.tolist()
     # if not multiyear
     if len(periods) == 1:
         print("it is not a multiyear investment problem")
         # model horizon
-        for period in periods:
-            py_start = json.loads(
-                source_db.get_parameter_value_item(
-                    entity_class_name="period",
-                    parameter_definition_name="start_time",
-                    alternative_name="Base",
-                    entity_byname=(period,),
-                )["value"]
-            )["data"]
-            py_yearr = source_db.get_parameter_value_item(
-                entity_class_name="period",
-                parameter_definition_name="years_represented",
-                alternative_name="Base",
-                entity_byname=(period,),
-            )["parsed_value"]
-            py_yearrs.append(py_yearr)
-            print("Leap Year: ", bool(pd.Timestamp(py_start).year % 4 == 0), period)
-            extra_duration = (
-                pd.Timedelta("1D")
-                if pd.Timestamp(py_start).year % 4 == 0
-                else pd.Timedelta("0h")
-            )
-            py_end = (
-                pd.Timestamp(py_start) + pd.Timedelta(duration) + extra_duration
-            ).isoformat()
-            add_parameter_value(
-                target_db,
-                "model",
-                "model_start",
-                "Base",
-                (model_name,),
-                {"type": "date_time", "data": py_start},
-            )
-            add_parameter_value(
-                target_db,
-                "model",
-                "model_end",
-                "Base",
-                (model_name,),
-                {"type": "date_time", "data": py_end},
-            )
-
-            # operational_resolution
-            temporal_block_name = "operations"
-            add_entity(target_db, "temporal_block", (temporal_block_name,))
-            add_entity(
-                target_db,
-                "model__default_temporal_block",
-                (model_name, temporal_block_name),
-            )
-            add_parameter_value(
-                target_db,
-                "temporal_block",
-                "resolution",
-                "Base",
-                (temporal_block_name,),
-                {"type": "duration", "data": resolution},
-            )
-            add_parameter_value(
-                target_db,
-                "temporal_block",
-                "weight",
-                "Base",
-                (temporal_block_name,),
-                py_yearr,
-            )
-            add_parameter_value(
-                target_db,
-                "temporal_block",
-                "has_free_start",
-                "Base",
-                (temporal_block_name,),
-                True,
-            )
+        period = periods[0]
+        py_start = timeline.period_start_iso[0]
+        py_yearr = py_yearrs[0]
+        print("Leap Year: ", bool(timeline.leap_year[0]), period)
+        py_end = np.datetime_as_string(
+            timeline.period_start[0]
+            + timeline.duration_td
+            + (np.timedelta64(1, "D") if timeline.leap_year[0] else 0),
+            unit="s",
+        )
+        add_parameter_value(
+            target_db,
+            "model",
+            "model_start",
+            "Base",
+            (model_name,),
+            {"type": "date_time", "data": py_start},
+        )
+        add_parameter_value(
+            target_db,
+            "model",
+            "model_end",
+            "Base",
+            (model_name,),
+            {"type": "date_time", "data": py_end},
+        )
 
-    else:
-        print("Multiyear investment planning")
-        py_starts = []
-        py_ends = []
-        py_yearrs = []
-        # model horizon
-        for period in periods:
-            # add_alternative(target_db,period)
-            py_start = json.loads(
-                source_db.get_parameter_value_item(
-                    entity_class_name="period",
-                    parameter_definition_name="start_time",
-                    alternative_name="Base",
-                    entity_byname=(period,),
-                )["value"]
-            )["data"]
-            py_yearr = source_db.get_parameter_value_item(
-                entity_class_name="period",
-                parameter_definition_name="years_represented",
-                alternative_name="Base",
-                entity_byname=(period,),
-            )["parsed_value"]
-            py_yearrs.append(py_yearr)
+        # operational_resolution
+        temporal_block_name = "operations"
+        add_entity(target_db, "temporal_block", (temporal_block_name,))
+        add_entity(
+            target_db,
+            "model__default_temporal_block",
+            (model_name, temporal_block_name),
+        )
+        add_parameter_value(
+            target_db,
+            "temporal_block",
+            "resolution",
+            "Base",
+            (temporal_block_name,),
+            {"type": "duration", "data": resolution},
+        )
+        add_parameter_value(
+            target_db,
+            "temporal_block",
+            "weight",
+            "Base",
+            (temporal_block_name,),
+            py_yearr,
+        )
+        add_parameter_value(
+            target_db,
+            "temporal_block",
+            "has_free_start",
+            "Base",
+            (temporal_block_name,),
+            True,
+        )
+
+    else:
+        print("Multiyear investment planning")
+        block_starts = np.datetime_as_string(
+            operations_block_starts(timeline), unit="s"
+        )
+        block_ends = np.datetime_as_string(timeline.block_end, unit="s")
+        # model horizon
+        for i, period in enumerate(periods):
             # operational_resolution
             temporal_block_name = f"operations_{period}"
             add_entity(target_db, "temporal_block", (temporal_block_name,))
@@ -786,27 +3386,8 @@ def timeline_setup(source_db, target_db):
                 (temporal_block_name,),
                 {"type": "duration", "data": resolution},
             )
-            if bool(pd.Timestamp(py_start).year % 4 == 0):
-                print("Leap Year: ", bool(pd.Timestamp(py_start).year % 4 == 0), period)
-                block_start = (
-                    pd.Timestamp(py_start)
-                    + pd.Timedelta(days=366)
-                    - (
-                        pd.Timedelta(resolution)
-                        if periods.index(period) > 0
-                        else pd.Timedelta("0h")
-                    )
-                ).isoformat()
-                block_end = (
-                    pd.Timestamp(py_start)
-                    + pd.Timedelta(days=366)
-                    + pd.Timedelta(duration)
-                ).isoformat()
-            else:
-                block_start = (pd.Timestamp(py_start)).isoformat()
-                block_end = (
-                    pd.Timestamp(py_start) + pd.Timedelta(duration)
-                ).isoformat()
+            if timeline.leap_year[i]:
+                print("Leap Year: ", True, period)
 
             add_parameter_value(
                 target_db,
@@ -814,7 +3395,7 @@ def timeline_setup(source_db, target_db):
                 "block_start",
                 "Base",
                 (temporal_block_name,),
-                {"type": "date_time", "data": block_start},
+                {"type": "date_time", "data": block_starts[i]},
             )
             add_parameter_value(
                 target_db,
@@ -822,7 +3403,7 @@ def timeline_setup(source_db, target_db):
                 "block_end",
                 "Base",
                 (temporal_block_name,),
-                {"type": "date_time", "data": block_end},
+                {"type": "date_time", "data": block_ends[i]},
             )
             add_parameter_value(
                 target_db,
@@ -830,7 +3411,7 @@ def timeline_setup(source_db, target_db):
                 "weight",
                 "Base",
                 (temporal_block_name,),
-                py_yearr,
+                py_yearrs[i],
             )
             add_parameter_value(
                 target_db,
@@ -841,18 +3422,20 @@ def timeline_setup(source_db, target_db):
                 True,
             )
 
-            py_starts.append(pd.Timestamp(py_start))
-            py_ends.append(
-                pd.Timestamp(str(int(py_start[:4]) + int(py_yearr)) + "-01-01T00:00:00")
-            )
-
+        # periods end at the start of the year after the represented years
+        py_ends = timeline.period_start.astype("datetime64[Y]") + (
+            timeline.years_represented.astype(int)
+        )
         add_parameter_value(
             target_db,
             "model",
             "model_start",
             "Base",
             (model_name,),
-            {"type": "date_time", "data": min(py_starts).isoformat()},
+            {
+                "type": "date_time",
+                "data": np.datetime_as_string(timeline.period_start.min(), unit="s"),
+            },
         )
         add_parameter_value(
             target_db,
@@ -860,7 +3443,12 @@ def timeline_setup(source_db, target_db):
             "model_end",
             "Base",
             (model_name,),
-            {"type": "date_time", "data": max(py_ends).isoformat()},
+            {
+                "type": "date_time",
+                "data": np.datetime_as_string(
+                    py_ends.max().astype("datetime64[s]"), unit="s"
+                ),
+            },
         )
         # add_parameter_value(target_db,"model","discount_year",period,(model_name,),{"type":"date_time","data":py_start})
 
@@ -891,34 +3479,20 @@ def timeline_setup(source_db, target_db):
         print("commit timeline error")
 
 
-def storage_state_fix_method(source_db, target_db):
+def storage_state_fix_method(source_db, target_db, timeline):
 
-    periods = json.loads(
-        source_db.get_parameter_value_items(
-            entity_class_name="solve_pattern", parameter_definition_name="period"
-        )[0]["value"]
-    )["data"]
-    resolution = json.loads(
-        source_db.get_parameter_value_items(
-            entity_class_name="solve_pattern",
-            parameter_definition_name="time_resolution",
-        )[0]["value"]
-    )["data"]
-    block_starts = {}
-    for period in periods:
-        py_start = json.loads(
-            source_db.get_parameter_value_item(
-                entity_class_name="period",
-                parameter_definition_name="start_time",
-                alternative_name="Base",
-                entity_byname=(period,),
-            )["value"]
-        )["data"]
-        block_starts[period] = (
-            (pd.Timestamp(py_start) + pd.Timedelta(days=366)).isoformat()
-            if bool(pd.Timestamp(py_start).year % 4 == 0)
-            else py_start
+    block_starts = dict(
+        zip(timeline.periods, np.datetime_as_string(timeline.block_start, unit="s"))
+    )
+    # the fixed state is set one step before each block starts
+    fix_points = dict(
+        zip(
+            timeline.periods,
+            np.datetime_as_string(
+                timeline.block_start - timeline.model_resolution_td, unit="s"
+            ),
         )
+    )
     for storage_method in source_db.get_parameter_value_items(
         parameter_definition_name="storage_state_fix_method"
     ):
@@ -985,12 +3559,7 @@ def storage_state_fix_method(source_db, target_db):
                                 indexes_ = []
                                 vals_ = []
                                 for period, block_start in block_starts.items():
-                                    indexes_.append(
-                                        (
-                                            pd.Timestamp(block_start)
-                                            - pd.Timedelta(resolution)
-                                        ).isoformat()
-                                    )
+                                    indexes_.append(fix_points[period])
                                     indexes_.append(block_start)
                                     vals_.append(
                                         (
@@ -1001,10 +3570,15 @@ def storage_state_fix_method(source_db, target_db):
                                         * target_value_
                                     )
                                     vals_.append(None)
-                                target_ts_ = {
-                                    "type": "time_series",
-                                    "data": dict(zip(indexes_, vals_)),
-                                }
+                                if options.compact:
+                                    target_ts_ = compact_time_series(
+                                        time_series_index(indexes_), vals_
+                                    )
+                                else:
+                                    target_ts_ = {
+                                        "type": "time_series",
+                                        "data": dict(zip(indexes_, vals_)),
+                                    }
                                 add_parameter_value(
                                     target_db,
                                     "node",
@@ -1057,7 +3631,7 @@ def storage_state_binding_method(source_db, target_db):
         print("commit storage state binding method error")
 
 
-def limiting_investments_notallowed(source_db, target_db):
+def limiting_investments_notallowed(source_db, target_db, timeline):
 
     retirement_method = {
         "unit": "retirement_method",
@@ -1085,30 +3659,8 @@ def limiting_investments_notallowed(source_db, target_db):
         "link": "fix_connections_invested_available",
         "node": "fix_storages_invested_available",
     }
-    starttime = {}
-    year_repr = {}
-
-    for period in json.loads(
-        source_db.get_parameter_value_items(
-            entity_class_name="solve_pattern", parameter_definition_name="period"
-        )[0]["value"]
-    )["data"]:
-        starttime[period] = json.loads(
-            source_db.get_parameter_value_item(
-                entity_class_name="period",
-                entity_byname=(period,),
-                alternative_name="Base",
-                parameter_definition_name="start_time",
-            )["value"]
-        )["data"]
-        year_repr[period] = source_db.get_parameter_value_item(
-            entity_class_name="period",
-            entity_byname=(period,),
-            alternative_name="Base",
-            parameter_definition_name="years_represented",
-        )["parsed_value"]
-
     for source_param in ["investment_method", "storage_investment_method"]:
+        existing_values = []
         for param_map in [
             i
             for i in source_db.get_parameter_value_items(
@@ -1123,121 +3675,80 @@ def limiting_investments_notallowed(source_db, target_db):
                 alternative_name=param_map["alternative_name"],
             )
             if existing_:
-                if existing_["type"] == "map":
-
-                    map_table = convert_map_to_table(existing_["parsed_value"])
-                    index_names = nested_index_names(existing_["parsed_value"])
-                    data = pd.DataFrame(
-                        map_table, columns=index_names + ["value"]
-                    ).set_index(index_names[0])
-                    data.index = data.index.astype("string")
-
-                    if any(i in data.index for i in starttime):
-                        indexes_ = []
-                        values_ = []
-                        for period_, ts_index_ in starttime.items():
-                            if period_ in data.index:
-                                values_.append(float(data.at[period_, "value"]))
-                                # this should be removed once the fixed resolution is repaired
-                                indexes_.append(ts_index_)
-
-                        values_.append(values_[-1])
-                        indexes_.append(
-                            (
-                                pd.Timestamp(ts_index_).replace(
-                                    year=int(
-                                        pd.Timestamp(ts_index_).year
-                                        + year_repr[period_]
-                                    )
-                                )
-                            ).isoformat()
-                        )
-
-                        if len(data) > 1:
-                            value_ = {
-                                "type": "time_series",
-                                "data": dict(zip(indexes_, values_)),
-                            }
-                        else:
-                            value_ = values_[0]
-
-                        add_parameter_value(
-                            target_db,
-                            target_class[param_map["entity_class_name"]],
-                            target_param[param_map["entity_class_name"]],
-                            existing_["alternative_name"],
-                            existing_["entity_byname"],
-                            value_,
-                        )
-                        add_parameter_value(
-                            target_db,
-                            target_class[param_map["entity_class_name"]],
-                            fix_param[param_map["entity_class_name"]],
-                            existing_["alternative_name"],
-                            existing_["entity_byname"],
-                            0.0,
-                        )
+                existing_values.append((param_map, existing_))
+            else:
+                print(
+                    f"There is no existing capacity in {param_map['entity_class_name']} {param_map['entity_byname']}"
+                )
 
-                        retirement_method_value = source_db.get_parameter_value_item(
-                            entity_class_name=param_map["entity_class_name"],
-                            parameter_definition_name=retirement_method[
-                                param_map["entity_class_name"]
-                            ],
-                            entity_byname=param_map["entity_byname"],
-                            alternative_name="Base",
-                        )
-                        if retirement_method_value:
-                            if retirement_method_value["parsed_value"] == "not_retired":
-                                add_parameter_value(
-                                    target_db,
-                                    target_class[param_map["entity_class_name"]],
-                                    fix_av_param[param_map["entity_class_name"]],
-                                    existing_["alternative_name"],
-                                    existing_["entity_byname"],
-                                    value_,
-                                )
+        # maps of periods converted together, only the periods defined are kept
+        map_positions = [
+            position
+            for position, (_, existing_) in enumerate(existing_values)
+            if existing_["type"] == "map"
+        ]
+        existing_maps = [existing_values[position][1] for position in map_positions]
+        values, found = period_map_values(
+            [existing_["parsed_value"] for existing_ in existing_maps], timeline
+        )
+        map_values = {}
+        for position, existing_, row, row_found, ts_value in zip(
+            map_positions,
+            existing_maps,
+            values,
+            found,
+            period_time_series(values, timeline, found),
+        ):
+            if row_found.any():
+                if len(existing_["parsed_value"].indexes) > 1:
+                    map_values[position] = ts_value
+                else:
+                    map_values[position] = row[row_found][0].item()
+
+        for position, (param_map, existing_) in enumerate(existing_values):
+            if existing_["type"] == "map":
+                if position not in map_values:
+                    continue
+                value_ = map_values[position]
+            elif existing_["type"] == "float":
+                value_ = existing_["parsed_value"]
+            else:
+                continue
 
-                elif existing_["type"] == "float":
-                    value_ = existing_["parsed_value"]
+            add_parameter_value(
+                target_db,
+                target_class[param_map["entity_class_name"]],
+                target_param[param_map["entity_class_name"]],
+                existing_["alternative_name"],
+                existing_["entity_byname"],
+                value_,
+            )
+            add_parameter_value(
+                target_db,
+                target_class[param_map["entity_class_name"]],
+                fix_param[param_map["entity_class_name"]],
+                existing_["alternative_name"],
+                existing_["entity_byname"],
+                0.0,
+            )
+            retirement_method_value = source_db.get_parameter_value_item(
+                entity_class_name=param_map["entity_class_name"],
+                parameter_definition_name=retirement_method[
+                    param_map["entity_class_name"]
+                ],
+                entity_byname=param_map["entity_byname"],
+                alternative_name="Base",
+            )
+            if retirement_method_value:
+                if retirement_method_value["parsed_value"] == "not_retired":
                     add_parameter_value(
                         target_db,
                         target_class[param_map["entity_class_name"]],
-                        target_param[param_map["entity_class_name"]],
+                        fix_av_param[param_map["entity_class_name"]],
                         existing_["alternative_name"],
                         existing_["entity_byname"],
                         value_,
                     )
-                    add_parameter_value(
-                        target_db,
-                        target_class[param_map["entity_class_name"]],
-                        fix_param[param_map["entity_class_name"]],
-                        existing_["alternative_name"],
-                        existing_["entity_byname"],
-                        0.0,
-                    )
-                    retirement_method_value = source_db.get_parameter_value_item(
-                        entity_class_name=param_map["entity_class_name"],
-                        parameter_definition_name=retirement_method[
-                            param_map["entity_class_name"]
-                        ],
-                        entity_byname=param_map["entity_byname"],
-                        alternative_name="Base",
-                    )
-                    if retirement_method_value:
-                        if retirement_method_value["parsed_value"] == "not_retired":
-                            add_parameter_value(
-                                target_db,
-                                target_class[param_map["entity_class_name"]],
-                                fix_av_param[param_map["entity_class_name"]],
-                                existing_["alternative_name"],
-                                existing_["entity_byname"],
-                                value_,
-                            )
-
-            else:
-                print(
-                    f"There is no existing capacity in {param_map['entity_class_name']} {param_map['entity_byname']}"
-                )
 
     try:
         target_db.commit_session("Added candadite assets")
@@ -1245,122 +3756,87 @@ def limiting_investments_notallowed(source_db, target_db):
         print("commit candadite assets error")
 
 
-def set_to_entities_and_parameters(source_db, target_db):
+def set_to_entities_and_parameters(source_db, target_db, timeline):
 
-    model_duration = json.loads(
-        source_db.get_parameter_value_items(
-            entity_class_name="solve_pattern", parameter_definition_name="duration"
-        )[0]["value"]
-    )["data"]
-    resolution = json.loads(
-        source_db.get_parameter_value_items(
-            entity_class_name="solve_pattern",
-            parameter_definition_name="time_resolution",
-        )[0]["value"]
-    )["data"]
+    relations = ["set__unit_flow", "set__node", "set__unit", "set__link"]
+    # members of each set by relation, collected in a single pass
+    set_members = {}
+    for relation in relations:
+        for element in source_db.get_entity_items(entity_class_name=relation):
+            set_members.setdefault(
+                element["entity_byname"][0], {relation: [] for relation in relations}
+            )[relation].append(element["entity_byname"])
+    no_members = {relation: [] for relation in relations}
 
-    for source_parameter in ["max_cumulative", "flow_max_cumulative"]:
-        for source_dict_parameter in source_db.get_parameter_value_items(
-            entity_class_name="set", parameter_definition_name=source_parameter
-        ):
-            source_relationships = {
-                relation: []
-                for relation in [
-                    "set__unit_flow",
-                    "set__node",
-                    "set__unit",
-                    "set__link",
-                ]
-            }
-            for relation in source_relationships:
-                for element in source_db.get_entity_items(entity_class_name=relation):
-                    if (
-                        element["entity_byname"][0]
-                        == source_dict_parameter["entity_byname"][0]
-                    ):
-                        source_relationships[relation].append(element["entity_byname"])
-            if source_parameter == "max_cumulative":
-                try:
+    # investment groups and their members, once per set
+    group_relations = {
+        "set__unit": "unit__investment_group",
+        "set__node": "node__investment_group",
+        "set__link": "connection__investment_group",
+    }
+    max_cumulative_values = source_db.get_parameter_value_items(
+        entity_class_name="set", parameter_definition_name="max_cumulative"
+    )
+    for set_name in dict.fromkeys(
+        value["entity_byname"][0] for value in max_cumulative_values
+    ):
+        add_entity(target_db, "investment_group", (set_name,), exist_ok=True)
+        for relation, target_entity_class in group_relations.items():
+            for names_relation in set_members.get(set_name, no_members)[relation]:
+                add_entity(
+                    target_db,
+                    target_entity_class,
+                    (names_relation[1], names_relation[0]),
+                )
+    for source_dict_parameter in max_cumulative_values:
+        add_parameter_value(
+            target_db,
+            "investment_group",
+            "maximum_entities_invested_available",
+            source_dict_parameter["alternative_name"],
+            source_dict_parameter["entity_byname"],
+            source_dict_parameter["parsed_value"],
+        )
+
+    for source_dict_parameter in source_db.get_parameter_value_items(
+        entity_class_name="set", parameter_definition_name="flow_max_cumulative"
+    ):
+        source_relationships = set_members.get(
+            source_dict_parameter["entity_byname"][0], no_members
+        )
+        if len(source_relationships) == 1:
+            for entity_relation, names_relation in source_relationships.items():
+                if entity_relation == "set__unit_flow":
+                    source_flow = source_db.get_entity_items(
+                        entity_byname=names_relation[1:]
+                    )[0]["entity_class_name"]
+                    target_entity_class = (
+                        "unit__from_node"
+                        if source_flow == "node__to_unit"
+                        else "unit__to_node"
+                    )
+                    target_entity_names = (
+                        (names_relation[2], names_relation[1])
+                        if source_flow == "node__to_unit"
+                        else (names_relation[1], names_relation[2])
+                    )
                     add_entity(
                         target_db,
-                        "investment_group",
-                        source_dict_parameter["entity_byname"],
+                        target_entity_class,
+                        target_entity_names,
+                        exist_ok=True,
                     )
-                    print(
-                        "Entity already created",
-                        "investment_group",
-                        source_dict_parameter["entity_byname"],
+                    param_value = timeline.steps * source_dict_parameter["parsed_value"]
+                    add_parameter_value(
+                        target_db,
+                        target_entity_class,
+                        "max_total_cumulated_unit_flow_to_node",
+                        source_dict_parameter["alternative_name"],
+                        target_entity_names,
+                        param_value,
                     )
-                except:
-                    pass
-                add_parameter_value(
-                    target_db,
-                    "investment_group",
-                    "maximum_entities_invested_available",
-                    source_dict_parameter["alternative_name"],
-                    source_dict_parameter["entity_byname"],
-                    source_dict_parameter["parsed_value"],
-                )
-                for entity_relation, list_relation in source_relationships.items():
-                    if entity_relation == "set__unit":
-                        for names_relation in list_relation:
-                            entity_byname = (names_relation[1], names_relation[0])
-                            add_entity(
-                                target_db, "unit__investment_group", entity_byname
-                            )
-                    if entity_relation == "set__node":
-                        for names_relation in list_relation:
-                            entity_byname = (names_relation[1], names_relation[0])
-                            add_entity(
-                                target_db, "node__investment_group", entity_byname
-                            )
-                    if entity_relation == "set__link":
-                        for names_relation in list_relation:
-                            entity_byname = (names_relation[1], names_relation[0])
-                            add_entity(
-                                target_db, "connection__investment_group", entity_byname
-                            )
-
-            elif source_parameter == "flow_max_cumulative":
-                if len(source_relationships) == 1:
-                    for entity_relation, names_relation in source_relationships.items():
-                        if entity_relation == "set__unit_flow":
-                            source_flow = source_db.get_entity_items(
-                                entity_byname=names_relation[1:]
-                            )[0]["entity_class_name"]
-                            target_entity_class = (
-                                "unit__from_node"
-                                if source_flow == "node__to_unit"
-                                else "unit__to_node"
-                            )
-                            target_entity_names = (
-                                (names_relation[2], names_relation[1])
-                                if source_flow == "node__to_unit"
-                                else (names_relation[1], names_relation[2])
-                            )
-                            try:
-                                add_entity(
-                                    target_db, target_entity_class, target_entity_names
-                                )
-                            except:
-                                pass
-                            model_duration_hours = pd.Timedelta(
-                                model_duration
-                            ) / pd.Timedelta(resolution)
-                            param_value = (
-                                model_duration_hours
-                                * source_dict_parameter["parsed_value"]
-                            )
-                            add_parameter_value(
-                                target_db,
-                                target_entity_class,
-                                "max_total_cumulated_unit_flow_to_node",
-                                source_dict_parameter["alternative_name"],
-                                target_entity_names,
-                                param_value,
-                            )
-                else:
-                    pass
+        else:
+            pass
     try:
         target_db.commit_session("Added set constraints")
     except:
@@ -1454,33 +3930,29 @@ def existing_capacity(source_db, target_db):
         print("commit existing capacity error")
 
 
-def lifetime_to_duration(source_db, target_db, settings):
+def lifetime_to_duration(source_db, target_db, mappings):
 
-    for source_class in settings:
-        for target_class in settings[source_class]:
-            for source_param in settings[source_class][target_class]:
-                for param_map in source_db.get_parameter_value_items(
-                    entity_class_name=source_class,
-                    parameter_definition_name=source_param,
-                ):
-                    if param_map["type"] == "float":
-                        param_value = {
-                            "type": "duration",
-                            "data": str(int(param_map["parsed_value"])) + "Y",
-                        }
-
-                    for target_param in settings[source_class][target_class][
-                        source_param
-                    ]:
-                        print(target_param, param_map["entity_byname"])
-                        add_parameter_value(
-                            target_db,
-                            target_class,
-                            target_param,
-                            param_map["alternative_name"],
-                            param_map["entity_byname"],
-                            param_value,
-                        )
+    for mapping in mappings:
+        for param_map in source_db.get_parameter_value_items(
+            entity_class_name=mapping.source_class,
+            parameter_definition_name=mapping.source_param,
+        ):
+            if param_map["type"] == "float":
+                param_value = {
+                    "type": "duration",
+                    "data": str(int(param_map["parsed_value"])) + "Y",
+                }
+
+            for target_param in mapping.target_params:
+                print(target_param, param_map["entity_byname"])
+                add_parameter_value(
+                    target_db,
+                    mapping.target_class,
+                    target_param,
+                    param_map["alternative_name"],
+                    param_map["entity_byname"],
+                    param_value,
+                )
 
     try:
         target_db.commit_session("Added lifetime conversion")
@@ -1488,172 +3960,95 @@ def lifetime_to_duration(source_db, target_db, settings):
         print("commit lifetime conversion error")
 
 
-def unit_flow_variants(source_db, target_db, settings):
+def unit_flow_variants(source_db, target_db, settings, timeline):
 
     parameters_mapping = {
         "equality_ratio": "fix_ratio",
         "less_than_ratio": "max_ratio_",
         "greater_than_ration": "min_ratio_",
     }
-    for param_map in source_db.get_parameter_value_items(
-        entity_class_name="unit_flow__unit_flow"
+    for page in pages(
+        source_db.get_parameter_value_items(entity_class_name="unit_flow__unit_flow")
     ):
+        unit_flow_maps = []
+        for param_map in page:
 
-        unit_flow_1 = (param_map["entity_byname"][0], param_map["entity_byname"][1])
-        unit_flow_2 = (param_map["entity_byname"][2], param_map["entity_byname"][3])
-
-        entity_1 = source_db.get_entity_items(entity_byname=unit_flow_1)[0][
-            "entity_class_name"
-        ]
-        entity_2 = source_db.get_entity_items(entity_byname=unit_flow_2)[0][
-            "entity_class_name"
-        ]
-
-        flow_direction_1 = "in" if entity_1 == "node__to_unit" else "out"
-        flow_direction_2 = "in" if entity_2 == "node__to_unit" else "out"
+            unit_flow_1 = (param_map["entity_byname"][0], param_map["entity_byname"][1])
+            unit_flow_2 = (param_map["entity_byname"][2], param_map["entity_byname"][3])
 
-        unit_name = unit_flow_1[1] if entity_1 == "node__to_unit" else unit_flow_1[0]
-        node_1 = unit_flow_1[0] if entity_1 == "node__to_unit" else unit_flow_1[1]
-        node_2 = unit_flow_2[0] if entity_2 == "node__to_unit" else unit_flow_2[1]
+            entity_1 = source_db.get_entity_items(entity_byname=unit_flow_1)[0][
+                "entity_class_name"
+            ]
+            entity_2 = source_db.get_entity_items(entity_byname=unit_flow_2)[0][
+                "entity_class_name"
+            ]
 
-        target_parameter = (
-            parameters_mapping[param_map["parameter_definition_name"]]
-            + f"_{flow_direction_1}_{flow_direction_2}_unit_flow"
-        )
+            flow_direction_1 = "in" if entity_1 == "node__to_unit" else "out"
+            flow_direction_2 = "in" if entity_2 == "node__to_unit" else "out"
 
-        add_entity(target_db, "unit__node__node", (unit_name, node_1, node_2))
+            unit_name = (
+                unit_flow_1[1] if entity_1 == "node__to_unit" else unit_flow_1[0]
+            )
+            node_1 = unit_flow_1[0] if entity_1 == "node__to_unit" else unit_flow_1[1]
+            node_2 = unit_flow_2[0] if entity_2 == "node__to_unit" else unit_flow_2[1]
 
-        if param_map["type"] == "float":
-            add_parameter_value(
-                target_db,
-                "unit__node__node",
-                target_parameter,
-                param_map["alternative_name"],
-                (unit_name, node_1, node_2),
-                param_map["parsed_value"],
+            target_parameter = (
+                parameters_mapping[param_map["parameter_definition_name"]]
+                + f"_{flow_direction_1}_{flow_direction_2}_unit_flow"
             )
 
-        elif param_map["type"] == "map":
-
-            starttime = {}
-            year_repr = {}
-            for period in json.loads(
-                source_db.get_parameter_value_items(
-                    entity_class_name="solve_pattern",
-                    parameter_definition_name="period",
-                )[0]["value"]
-            )["data"]:
-                starttime[period] = json.loads(
-                    source_db.get_parameter_value_item(
-                        entity_class_name="period",
-                        entity_byname=(period,),
-                        alternative_name="Base",
-                        parameter_definition_name="start_time",
-                    )["value"]
-                )["data"]
-                year_repr[period] = source_db.get_parameter_value_item(
-                    entity_class_name="period",
-                    entity_byname=(period,),
-                    alternative_name="Base",
-                    parameter_definition_name="years_represented",
-                )["parsed_value"]
-
-            duration = json.loads(
-                source_db.get_parameter_value_items(
-                    entity_class_name="solve_pattern",
-                    parameter_definition_name="duration",
-                )[0]["value"]
-            )["data"]
-            starttime_sp = json.loads(
-                source_db.get_parameter_value_items(
-                    entity_class_name="solve_pattern",
-                    parameter_definition_name="start_time",
-                )[0]["value"]
-            )["data"]
-            resolution = json.loads(
-                source_db.get_parameter_value_items(
-                    entity_class_name="solve_pattern",
-                    parameter_definition_name="time_resolution",
-                )[0]["value"]
-            )["data"]
+            add_entity(target_db, "unit__node__node", (unit_name, node_1, node_2))
 
-            index_names = nested_index_names(param_map["parsed_value"])
-            map_table = convert_map_to_table(param_map["parsed_value"])
-            index_names = nested_index_names(param_map["parsed_value"])
-            data = pd.DataFrame(map_table, columns=index_names + ["value"]).set_index(
-                index_names[0]
-            )
-            data.index = data.index.astype("string")
-
-            if any(i in data.index for i in starttime):
-                indexes_ = []
-                values_ = []
-                for period_, ts_index_ in starttime.items():
-                    values_.append(
-                        (
-                            float(data.at[period_, "value"])
-                            if period_ in data.index
-                            else 0.0
-                        )
-                    )
+            if param_map["type"] == "float":
+                add_parameter_value(
+                    target_db,
+                    "unit__node__node",
+                    target_parameter,
+                    param_map["alternative_name"],
+                    (unit_name, node_1, node_2),
+                    param_map["parsed_value"],
+                )
 
-                    # this should be removed once the fixed resolution is repaired
-                    indexes_.append(ts_index_)
-                values_.append(values_[-1])
-                indexes_.append(
-                    (
-                        pd.Timestamp(ts_index_).replace(
-                            year=int(pd.Timestamp(ts_index_).year + year_repr[period_])
-                        )
-                    ).isoformat()
+            elif param_map["type"] == "map":
+                unit_flow_maps.append(
+                    (param_map, target_parameter, (unit_name, node_1, node_2))
                 )
-                ts_export = {
-                    "type": "time_series",
-                    "data": dict(zip(indexes_, values_)),
-                }
+
+        period_series = cached_period_time_series(
+            [unit_flow_map[0] for unit_flow_map in unit_flow_maps],
+            [1.0] * len(unit_flow_maps),
+            timeline,
+        )
+        for (param_map, target_parameter, target_names), (
+            periods_found,
+            indexes,
+            ts_export,
+        ) in zip(unit_flow_maps, period_series):
+            if periods_found:
                 add_parameter_value(
                     target_db,
                     "unit__node__node",
                     target_parameter,
                     param_map["alternative_name"],
-                    (unit_name, node_1, node_2),
+                    target_names,
                     ts_export,
                 )
+            # a map of periods only cannot hold historical data
+            if periods_found == indexes:
+                continue
 
-            if any(i in data.index for i in starttime_sp):
-                for index, element in enumerate(starttime_sp):
-                    try:
-                        alternative_name = f"wy{str(pd.Timestamp(element).year)}"
-                        add_alternative(target_db, alternative_name)
-                    except:
-                        pass
-                    steps = pd.to_timedelta(duration) / pd.to_timedelta(resolution)
-                    df_data = (
-                        data.iloc[
-                            data.index.tolist()
-                            .index(element) : data.index.tolist()
-                            .index(element)
-                            + int(steps),
-                            data.columns.tolist().index("value"),
-                        ]
-                    ).tolist()
-                    ts_export = {
-                        "type": "time_series",
-                        "data": df_data,
-                        "index": {
-                            "start": f"2018{element[4:]}",
-                            "resolution": resolution,
-                            "ignore_year": True,
-                        },
-                    }
-                    add_parameter_value(
-                        target_db,
-                        "unit__node__node",
-                        target_parameter,
-                        alternative_name,
-                        (unit_name, node_1, node_2),
-                        ts_export,
-                    )
+            for alternative_name, ts_export in cached_weather_year_series(
+                param_map, timeline, 1.0, resample_aggregation(target_parameter)
+            ):
+                add_alternative(target_db, alternative_name, exist_ok=True)
+                add_parameter_value(
+                    target_db,
+                    "unit__node__node",
+                    target_parameter,
+                    alternative_name,
+                    target_names,
+                    ts_export,
+                )
 
     try:
         target_db.commit_session("Added unit flows")
@@ -1661,24 +4056,7 @@ def unit_flow_variants(source_db, target_db, settings):
         print("commit unit flows error")
 
 
-def flow_profile_method(source_db, target_db):
-
-    duration = json.loads(
-        source_db.get_parameter_value_items(
-            entity_class_name="solve_pattern", parameter_definition_name="duration"
-        )[0]["value"]
-    )["data"]
-    starttime = json.loads(
-        source_db.get_parameter_value_items(
-            entity_class_name="solve_pattern", parameter_definition_name="start_time"
-        )[0]["value"]
-    )["data"]
-    resolution = json.loads(
-        source_db.get_parameter_value_items(
-            entity_class_name="solve_pattern",
-            parameter_definition_name="time_resolution",
-        )[0]["value"]
-    )["data"]
+def flow_profile_method(source_db, target_db, timeline):
 
     for param_map in source_db.get_parameter_value_items(
         entity_class_name="node",
@@ -1715,49 +4093,19 @@ def flow_profile_method(source_db, target_db):
 
         if definition_condition:
             if param_map["type"] == "map":
-                index_names = nested_index_names(param_map["parsed_value"])
-                map_table = convert_map_to_table(param_map["parsed_value"])
-                index_names = nested_index_names(param_map["parsed_value"])
-                data = pd.DataFrame(
-                    map_table, columns=index_names + ["value"]
-                ).set_index(index_names[0])
-                data.index = data.index.astype("string")
-
-                if any(i in data.index for i in starttime):
-                    for index, element in enumerate(starttime):
-                        try:
-                            alternative_name = f"wy{str(pd.Timestamp(element).year)}"
-                            add_alternative(target_db, alternative_name)
-                        except:
-                            pass
-                        steps = pd.to_timedelta(duration) / pd.to_timedelta(resolution)
-                        df_data = (
-                            -1.0
-                            * data.iloc[
-                                data.index.tolist()
-                                .index(element) : data.index.tolist()
-                                .index(element)
-                                + int(steps),
-                                data.columns.tolist().index("value"),
-                            ]
-                        ).tolist()
-                        ts_export = {
-                            "type": "time_series",
-                            "data": df_data,
-                            "index": {
-                                "start": f"2018{element[4:]}",
-                                "resolution": resolution,
-                                "ignore_year": True,
-                            },
-                        }
-                        add_parameter_value(
-                            target_db,
-                            "node",
-                            "demand",
-                            alternative_name,
-                            (target_name,),
-                            ts_export,
-                        )
+                # demand is the inverse of the flow profile
+                for alternative_name, demand in cached_weather_year_series(
+                    param_map, timeline, -1.0, resample_aggregation("demand")
+                ):
+                    add_alternative(target_db, alternative_name, exist_ok=True)
+                    add_parameter_value(
+                        target_db,
+                        "node",
+                        "demand",
+                        alternative_name,
+                        (target_name,),
+                        demand,
+                    )
 
             elif param_map["type"] == "time_series":
                 # the values still need to be multiplied with -1 ... or not, as flextool assumes negative demand values ... This needs to be aligned.
@@ -1770,7 +4118,11 @@ def flow_profile_method(source_db, target_db):
                     "demand",
                     param_map["alternative_name"],
                     (target_name,),
-                    param_map["parsed_value"],
+                    resample_time_series(
+                        param_map["parsed_value"],
+                        timeline,
+                        resample_aggregation("demand"),
+                    ),
                 )
 
             elif param_map["type"] == "float":
@@ -1789,5 +4141,599 @@ def flow_profile_method(source_db, target_db):
         print("commit flow profile error")
 
 
+def kmeans(features, k, iterations=100, seed=0):
+    """Clusters the rows of features into at most k clusters.
+
+    Seeded with k-means++ from a fixed seed so that conversions are
+    reproducible. Returns the cluster of each row and the medoid row of each
+    cluster, clusters left empty are dropped.
+    """
+    rng = np.random.default_rng(seed)
+    count = len(features)
+    squares = (features**2).sum(axis=1)
+    centers = [features[rng.integers(count)]]
+    nearest = ((features - centers[0]) ** 2).sum(axis=1)
+    for _ in range(1, k):
+        # in double precision for the probabilities to sum to one
+        weights = nearest.astype(float)
+        total = weights.sum()
+        chosen = rng.choice(count, p=weights / total if total > 0 else None)
+        centers.append(features[chosen])
+        nearest = np.minimum(nearest, ((features - features[chosen]) ** 2).sum(axis=1))
+    centers = np.array(centers)
+    labels = None
+    for _ in range(iterations):
+        distances = squares[:, None] - 2 * features @ centers.T + (centers**2).sum(1)
+        new_labels = distances.argmin(axis=1)
+        if labels is not None and (new_labels == labels).all():
+            break
+        labels = new_labels
+        sizes = np.bincount(labels, minlength=k)
+        sums = np.zeros_like(centers)
+        np.add.at(sums, labels, features)
+        centers = np.where(
+            sizes[:, None] > 0, sums / np.maximum(sizes, 1)[:, None], centers
+        )
+    distances = squares[:, None] - 2 * features @ centers.T + (centers**2).sum(1)
+    labels = distances.argmin(axis=1)
+    members = labels[:, None] == np.arange(k)
+    medoids = np.where(members, distances, np.inf).argmin(axis=0)
+    kept = members.any(axis=0)
+    # renumber the kept clusters in the order of their medoids
+    order = np.argsort(medoids[kept])
+    renumbered = np.full(k, -1)
+    renumbered[np.flatnonzero(kept)[order]] = np.arange(len(order))
+    return renumbered[labels], medoids[kept][order]
+
+
+def representative_periods(target_db, profiles, timeline):
+    """Clusters the operational horizon into representative periods.
+
+    The periods of options.representative_length are clustered on the time
+    series of the profiles listed in settings.yaml, of every entity and
+    alternative at once. Each operations block gets a representative block per
+    cluster, starting at the cluster's medoid period and weighted by the number
+    of periods it stands for, and a representative_periods_mapping from each
+    period to its representative block.
+    """
+    if options.representative_periods is None:
+        return
+    length_td = (
+        pd.to_timedelta(options.representative_length)
+        .to_timedelta64()
+        .astype("timedelta64[s]")
+    )
+    if length_td < timeline.model_resolution_td or (
+        length_td % timeline.model_resolution_td
+    ):
+        raise RuntimeError(
+            f"representative periods of {options.representative_length} are not "
+            f"a multiple of the resolution {timeline.model_resolution}"
+        )
+    length = int(length_td / timeline.model_resolution_td)
+    model_steps = -(-timeline.steps // timeline.resample_factor)
+    period_count = model_steps // length
+    if period_count <= options.representative_periods:
+        print(
+            f"{period_count} periods of {options.representative_length} in the "
+            "horizon, no representative periods needed"
+        )
+        return
+
+    rows = []
+    for target_class, parameter in profiles:
+        for item in target_db.get_parameter_value_items(
+            entity_class_name=target_class, parameter_definition_name=parameter
+        ):
+            if item["type"] != "time_series":
+                continue
+            values = np.asarray(item["parsed_value"].values, dtype=np.float32)
+            if len(values) >= period_count * length:
+                rows.append(values[: period_count * length])
+    if not rows:
+        print("no profiles to cluster into representative periods")
+        return
+    # each profile scaled to its largest value so that units do not matter
+    profile_matrix = np.array(rows)
+    scale = np.abs(profile_matrix).max(axis=1, keepdims=True)
+    profile_matrix /= np.where(scale > 0, scale, 1.0)
+    # one row per period, the profiles of the period side by side
+    features = (
+        profile_matrix.reshape(len(rows), period_count, length)
+        .transpose(1, 0, 2)
+        .reshape(period_count, -1)
+    )
+    labels, medoids = kmeans(features, options.representative_periods)
+    sizes = np.bincount(labels, minlength=len(medoids))
+    print(
+        f"{len(medoids)} representative periods of {options.representative_length}"
+        f" for {period_count} periods, clustered on {len(rows)} profiles"
+    )
+
+    if len(timeline.periods) == 1:
+        blocks = [("operations", timeline.period_start[0])]
+    else:
+        blocks = [
+            (f"operations_{period}", start)
+            for period, start in zip(
+                timeline.periods, operations_block_starts(timeline)
+            )
+        ]
+    for (block, start), weight in zip(blocks, timeline.years_represented.tolist()):
+        names = [
+            f"representative_{block}_{number}" for number in range(1, len(medoids) + 1)
+        ]
+        for name, medoid, size in zip(names, medoids.tolist(), sizes.tolist()):
+            block_start = start + medoid * length_td
+            add_entity(target_db, "temporal_block", (name,))
+            add_entity(
+                target_db, "model__default_temporal_block", (timeline.model_name, name)
+            )
+            for parameter, value in (
+                ("resolution", {"type": "duration", "data": timeline.model_resolution}),
+                (
+                    "block_start",
+                    {
+                        "type": "date_time",
+                        "data": np.datetime_as_string(block_start, unit="s"),
+                    },
+                ),
+                (
+                    "block_end",
+                    {
+                        "type": "date_time",
+                        "data": np.datetime_as_string(
+                            block_start + length_td, unit="s"
+                        ),
+                    },
+                ),
+                ("weight", size * weight),
+            ):
+                add_parameter_value(
+                    target_db, "temporal_block", parameter, "Base", (name,), value
+                )
+        period_starts = np.datetime_as_string(
+            start + np.arange(period_count) * length_td, unit="s"
+        )
+        add_parameter_value(
+            target_db,
+            "temporal_block",
+            "representative_periods_mapping",
+            "Base",
+            (block,),
+            {
+                "type": "map",
+                "index_type": "date_time",
+                "data": [
+                    [period_start, names[label]]
+                    for period_start, label in zip(period_starts, labels.tolist())
+                ],
+            },
+        )
+
+    try:
+        target_db.commit_session("Added representative periods")
+    except:
+        print("commit representative periods error")
+
+
+@dataclass(frozen=True)
+class Stage:
+    """A conversion step run after the generic ines_transform copies.
+
+    ``reads`` and ``writes`` name the target entity classes the stage looks up
+    and adds to. Stages reading nothing from the target can be run in worker
+    processes, the others run in order on the target database itself.
+    """
+
+    name: str
+    function: object
+    arguments: tuple
+    reads: tuple = ()
+    writes: tuple = ()
+
+
+stages = (
+    Stage(
+        "timeline_setup",
+        timeline_setup,
+        ("target_db", "timeline"),
+        writes=(
+            "model",
+            "temporal_block",
+            "stochastic_structure",
+            "stochastic_scenario",
+            "stochastic_structure__stochastic_scenario",
+            "model__default_temporal_block",
+            "model__default_investment_temporal_block",
+            "model__default_stochastic_structure",
+            "model__default_investment_stochastic_structure",
+        ),
+    ),
+    Stage(
+        "map_of_periods_or_historical_to_ts",
+        map_of_periods_or_historical_to_ts,
+        (
+            "source_db",
+            "target_db",
+            "plan.map_of_periods_or_historical_to_ts",
+            "timeline",
+        ),
+        writes=(
+            "node",
+            "unit",
+            "connection",
+            "unit__from_node",
+            "unit__to_node",
+            "connection__from_node",
+            "connection__to_node",
+            "connection__node__node",
+        ),
+    ),
+    Stage(
+        "flow_profile_method",
+        flow_profile_method,
+        ("source_db", "target_db", "timeline"),
+        writes=("node", "unit__to_node"),
+    ),
+    Stage(
+        "limiting_investments_notallowed",
+        limiting_investments_notallowed,
+        ("source_db", "target_db", "timeline"),
+        writes=("node", "unit", "connection"),
+    ),
+    Stage(
+        "process_emissions",
+        process_emissions,
+        ("source_db", "target_db", "timeline"),
+        reads=("unit", "unit__from_node", "unit__to_node"),
+        writes=(
+            "node",
+            "unit__from_node",
+            "unit__to_node",
+            "unit__node__node",
+            "user_constraint",
+            "unit__from_node__user_constraint",
+            "unit__to_node__user_constraint",
+        ),
+    ),
+    Stage(
+        "storage_state_fix_method",
+        storage_state_fix_method,
+        ("source_db", "target_db", "timeline"),
+        writes=("node",),
+    ),
+    Stage(
+        "storage_state_binding_method",
+        storage_state_binding_method,
+        ("source_db", "target_db"),
+        reads=("model__default_temporal_block",),
+        writes=("node__temporal_block",),
+    ),
+    Stage(
+        "set_to_entities_and_parameters",
+        set_to_entities_and_parameters,
+        ("source_db", "target_db", "timeline"),
+        writes=(
+            "investment_group",
+            "unit__investment_group",
+            "node__investment_group",
+            "connection__investment_group",
+            "unit__from_node",
+            "unit__to_node",
+        ),
+    ),
+    Stage(
+        "default_parameters",
+        default_parameters,
+        ("target_db", "settings.default_parameters"),
+        reads=("model", "unit", "connection", "node"),
+        writes=("model", "unit", "connection", "node"),
+    ),
+    Stage(
+        "candidates_to_number_of",
+        candidates_to_number_of,
+        ("target_db",),
+        reads=("unit", "connection", "node"),
+        writes=("unit", "connection", "node"),
+    ),
+    Stage(
+        "existing_capacity",
+        existing_capacity,
+        ("source_db", "target_db"),
+        writes=("unit", "connection", "node"),
+    ),
+    Stage(
+        "lifetime_to_duration",
+        lifetime_to_duration,
+        ("source_db", "target_db", "plan.lifetime_to_duration"),
+        writes=("unit", "connection", "node"),
+    ),
+    Stage(
+        "unit_flow_variants",
+        unit_flow_variants,
+        ("source_db", "target_db", "settings", "timeline"),
+        writes=("unit__node__node",),
+    ),
+    Stage(
+        "representative_periods",
+        representative_periods,
+        ("target_db", "plan.representative_profiles", "timeline"),
+        reads=("node", "unit", "connection"),
+        writes=("temporal_block", "model__default_temporal_block"),
+    ),
+)
+
+
+def stage_dependencies(stages):
+    """Maps each stage to the earlier stages writing classes it reads."""
+    dependencies = {}
+    for position, stage in enumerate(stages):
+        dependencies[stage.name] = [
+            earlier.name
+            for earlier in stages[:position]
+            if set(earlier.writes) & set(stage.reads)
+        ]
+    return dependencies
+
+
+def run_stage(stage, source_db, target_db, timeline, profiler=None):
+    if profiler is not None:
+        source_db = CallCounter(source_db, "source_db", profiler)
+        target_db = CallCounter(target_db, "target_db", profiler)
+    arguments = {"source_db": source_db, "target_db": target_db, "timeline": timeline}
+    config = load_config(options.config_dir)
+    values = []
+    for argument in stage.arguments:
+        if argument == "settings":
+            values.append(config["settings"])
+        elif argument.startswith("settings."):
+            values.append(config["settings"][argument[len("settings.") :]])
+        elif argument.startswith("plan."):
+            plan = mapping_plan(options.config_dir)
+            values.append(plan[argument[len("plan.") :]])
+        else:
+            values.append(arguments[argument])
+    if profiler is None:
+        stage.function(*values)
+    else:
+        profiler.measure(stage.name, lambda: stage.function(*values))
+
+
+## Profiling
+
+# helpers reporting the call site of the stage calling them
+item_helpers = (
+    "add_entity",
+    "add_entity_group",
+    "add_parameter_value",
+    "add_alternative",
+    "add_scenario",
+    "add_scenario_alternative",
+)
+
+
+class StageProfiler:
+    """Collects time, memory and database calls of each stage for --profile.
+
+    Commits are those writer, a BulkWriter, writes to the database during the
+    stage and its checkpoint. Commits the writer defers only flush the
+    buffered items and are counted as flushes.
+    """
+
+    def __init__(self, cprofile_directory=None, writer=None):
+        self.cprofile_directory = cprofile_directory
+        self.writer = writer
+        self.stages = []
+        self._current = None
+        if cprofile_directory is not None:
+            os.makedirs(cprofile_directory, exist_ok=True)
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def measure(self, name, function):
+        record = {
+            "name": name,
+            "wall_time": 0.0,
+            "cpu_time": 0.0,
+            "memory_peak_mb": 0.0,
+            "calls": {},
+            "written": {},
+            "commits": 0,
+            "commit_time": 0.0,
+            "flushes": 0,
+            "flush_time": 0.0,
+        }
+        self._current = record
+        commits_before = self._writer_commits()
+        tracemalloc.reset_peak()
+        profile = cProfile.Profile() if self.cprofile_directory is not None else None
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
+        if profile is not None:
+            profile.enable()
+        try:
+            return function()
+        finally:
+            if profile is not None:
+                profile.disable()
+                profile.dump_stats(
+                    os.path.join(self.cprofile_directory, f"{name}.prof")
+                )
+            record["wall_time"] = time.perf_counter() - wall_start
+            record["cpu_time"] = time.process_time() - cpu_start
+            record["memory_peak_mb"] = tracemalloc.get_traced_memory()[1] / 2**20
+            self._add_commits(record, commits_before)
+            self.stages.append(record)
+            self._current = None
+
+    def measure_commits(self, name, function):
+        """Adds the commits of function, e.g. the checkpoint after stage name, to it."""
+        commits_before = self._writer_commits()
+        try:
+            return function()
+        finally:
+            for record in reversed(self.stages):
+                if record["name"] == name:
+                    self._add_commits(record, commits_before)
+                    break
+
+    def _writer_commits(self):
+        if self.writer is None:
+            return 0, 0.0
+        return self.writer.commits, self.writer.commit_time
+
+    def _add_commits(self, record, commits_before):
+        commits, commit_time = self._writer_commits()
+        record["commits"] += commits - commits_before[0]
+        record["commit_time"] += commit_time - commits_before[1]
+
+    def count_call(self, label, method, site):
+        calls = self._current["calls"].setdefault(f"{label}.{method}", {})
+        calls[site] = calls.get(site, 0) + 1
+
+    def count_written(self, class_name):
+        written = self._current["written"]
+        written[class_name] = written.get(class_name, 0) + 1
+
+    def count_flush(self, duration):
+        self._current["flushes"] += 1
+        self._current["flush_time"] += duration
+
+    def write_report(self, path):
+        report = {
+            "source": options.source_url,
+            "target": options.target_url,
+            "wall_time": sum(stage["wall_time"] for stage in self.stages),
+            "stages": self.stages,
+        }
+        with open(path, "w") as file:
+            json.dump(report, file, indent=1)
+
+
+class CallCounter:
+    """Forwards to a database while counting the calls for a StageProfiler."""
+
+    def __init__(self, wrapped, label, profiler):
+        self.wrapped = wrapped
+        self.label = label
+        self.profiler = profiler
+
+    @property
+    def __class__(self):
+        # keeps isinstance checks on the wrapped database working
+        return self.wrapped.__class__
+
+    def __getattr__(self, name):
+        attribute = getattr(self.wrapped, name)
+        if not callable(attribute):
+            return attribute
+
+        def counted_call(*args, **kwargs):
+            frame = sys._getframe(1)
+            while frame.f_code.co_name in item_helpers and frame.f_back is not None:
+                frame = frame.f_back
+            self.profiler.count_call(
+                self.label, name, f"{frame.f_code.co_name}:{frame.f_lineno}"
+            )
+            start = time.perf_counter()
+            result = attribute(*args, **kwargs)
+            if name == "commit_session":
+                # commits reaching the database are counted by the writer
+                if getattr(self.wrapped, "defer_commits", False):
+                    self.profiler.count_flush(time.perf_counter() - start)
+            elif name.startswith("add_") and isinstance(result, tuple):
+                if len(result) == 2 and not result[1]:
+                    if name == "add_parameter_value":
+                        class_name = args[0] if args else kwargs["class_name"]
+                    else:
+                        class_name = kwargs.get(
+                            "entity_class_name", name[len("add_") : -len("_item")]
+                        )
+                    self.profiler.count_written(class_name)
+            return result
+
+        return counted_call
+
+
+## state of a stage worker process
+worker_source_db = None
+worker_timeline = None
+
+
+def init_stage_worker(worker_options):
+    global worker_source_db, worker_timeline
+    configure(worker_options)
+    # kept open for the life of the worker
+    worker_source_db = SourceSnapshot(api.DatabaseMapping(options.source_url))
+    worker_timeline = timeline_context(worker_source_db)
+
+
+def record_stage(name):
+    stage = next(stage for stage in stages if stage.name == name)
+    recorder = StageRecorder()
+    run_stage(stage, worker_source_db, recorder, worker_timeline)
+    recorder.flush()
+    for item_type, item in recorder.recorded:
+        class_name = item.get("entity_class_name") if item_type != "commit" else None
+        if class_name is not None and class_name not in stage.writes:
+            raise RuntimeError(
+                f"Stage {stage.name} adds to {class_name} which it does not declare"
+            )
+    return recorder.recorded
+
+
+def run_stages(
+    stages, source_db, target_db, timeline, jobs=1, profiler=None, journal=None
+):
+    """Runs the stages with the same result as running them one after another.
+
+    With more than one job, the stages reading nothing from the target start
+    right away in a process pool and their recorded additions are applied
+    through target_db in stage order. Stages reading the target run when their
+    turn comes, after everything before them has been applied.
+    Profiled stages and stages in low-memory mode always run one after another
+    in this process. Stages completed according to the journal are skipped.
+    """
+    if journal is not None:
+        stages = tuple(
+            stage for stage in stages if not journal.skip(stage.name, target_db)
+        )
+    if jobs <= 1 or profiler is not None or options.low_memory:
+        for stage in stages:
+            errors_before = len(target_db.errors)
+            if journal is not None:
+                target_db.on_chunk_commit = functools.partial(
+                    journal.mark_partial, stage.name
+                )
+            run_stage(stage, source_db, target_db, timeline, profiler)
+            checkpoint(stage.name, target_db, journal, errors_before, profiler)
+            if options.low_memory:
+                target_db.release()
+        target_db.on_chunk_commit = None
+        return
+    dependencies = stage_dependencies(stages)
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(
+        jobs, context, initializer=init_stage_worker, initargs=(options,)
+    ) as pool:
+        recordings = {
+            stage.name: pool.submit(record_stage, stage.name)
+            for stage in stages
+            if not stage.reads
+        }
+        for stage in stages:
+            errors_before = len(target_db.errors)
+            if stage.name in recordings:
+                target_db.replay(recordings[stage.name].result())
+            else:
+                if dependencies[stage.name]:
+                    print(
+                        f"{stage.name} runs after {', '.join(dependencies[stage.name])}"
+                    )
+                run_stage(stage, source_db, target_db, timeline)
+            checkpoint(stage.name, target_db, journal, errors_before)
+
+
 if __name__ == "__main__":
     main()
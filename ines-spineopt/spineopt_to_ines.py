@@ -0,0 +1,714 @@
+from __future__ import annotations
+from dataclasses import dataclass
+import argparse
+from collections import Counter
+import json
+import re
+
+from ines_to_spineopt import (
+    BulkWriter,
+    ConversionOptions,
+    SerializedValue,
+    add_parameter_value,
+    compile_mapping_plan,
+    compile_parameter_mapping,
+    lazy_import,
+    load_config,
+    operations,
+    purge_target,
+)
+
+api = lazy_import("spinedb_api")
+pd = lazy_import("pandas")
+np = lazy_import("numpy")
+
+# alternatives the forward conversion adds for each weather year
+weather_year_alternative = re.compile(r"^wy(\d{4})$")
+# SpineOpt classes the solve pattern is read back from
+timeline_classes = {"model", "temporal_block", "model__default_temporal_block"}
+
+
+def inverse_order(target_order):
+    """Inverts a byname order of the yaml mappings.
+
+    Returns the target byname positions of each source dimension, or None when
+    the order drops or joins dimensions and cannot be inverted.
+    """
+    if any(len(names) != 1 for names in target_order):
+        return None
+    positions = [names[0] for names in target_order]
+    if sorted(positions) != list(range(len(positions))):
+        return None
+    order = [0] * len(positions)
+    for target_position, source_position in enumerate(positions):
+        order[source_position] = target_position
+    return tuple(order)
+
+
+def inverse_entity_mappings(entities_to_copy, dimension_counts):
+    """Maps SpineOpt entity classes to (INES class, byname order) pairs.
+
+    dimension_counts holds the number of dimensions of the INES classes.
+    """
+    inverse = {}
+    for source_class, targets in entities_to_copy.items():
+        if source_class not in dimension_counts:
+            continue
+        if isinstance(targets, str):
+            inverse.setdefault(targets, (source_class, (0,)))
+            continue
+        if isinstance(targets, dict):
+            targets = [targets]
+        for target in targets:
+            for target_class, order in target.items():
+                target_order = tuple(
+                    tuple(int(i) - 1 for i in names) for names in order
+                )
+                order = inverse_order(target_order)
+                if order is not None and len(order) == max(
+                    dimension_counts[source_class], 1
+                ):
+                    inverse.setdefault(target_class, (source_class, order))
+    return inverse
+
+
+@dataclass(frozen=True)
+class InverseMapping:
+    """Converts a SpineOpt parameter back into the INES parameter it came from."""
+
+    target_class: str
+    target_param: str
+    source_class: str
+    source_param: str
+    order: tuple
+    multiplier: float = None
+    factor: float = 1.0
+    operation: str = None
+    operand_param: str = None
+    # the value is a duration in years, e.g. lifetimes
+    duration: bool = False
+
+
+def inverse_parameter_mappings(config, dimension_counts, definitions):
+    """Inverts the parameter mappings of the forward conversion.
+
+    The first mapping into a SpineOpt parameter wins. Mappings that drop
+    dimensions of the INES entity or target parameters missing from the
+    INES definitions cannot be inverted and are skipped.
+    """
+    mappings = []
+    for source_class, target_classes in config["parameter_transforms"].items():
+        for target_class, source_params in target_classes.items():
+            for source_param, elements in source_params.items():
+                mappings.append(
+                    compile_parameter_mapping(
+                        source_class, target_class, source_param, elements
+                    )
+                )
+    plan = compile_mapping_plan(config["settings"])
+    mappings.extend(plan["map_of_periods_or_historical_to_ts"])
+    inverse = {}
+    for mapping in mappings:
+        order = inverse_order(mapping.target_order)
+        key = (mapping.target_class, mapping.target_param)
+        if (
+            order is None
+            or key in inverse
+            or (mapping.source_class, mapping.source_param) not in definitions
+            or len(order) != max(dimension_counts[mapping.source_class], 1)
+        ):
+            continue
+        inverse[key] = InverseMapping(
+            mapping.target_class,
+            mapping.target_param,
+            mapping.source_class,
+            mapping.source_param,
+            order,
+            mapping.multiplier,
+            mapping.factor,
+            mapping.operation,
+            mapping.operand_param,
+        )
+    for mapping in plan["lifetime_to_duration"]:
+        if (mapping.source_class, mapping.source_param) not in definitions:
+            continue
+        # the same lifetime is written into all of the target parameters
+        key = (mapping.target_class, mapping.target_params[0])
+        inverse.setdefault(
+            key,
+            InverseMapping(
+                mapping.target_class,
+                mapping.target_params[0],
+                mapping.source_class,
+                mapping.source_param,
+                (0,),
+                1.0,
+                duration=True,
+            ),
+        )
+    return inverse
+
+
+@dataclass(frozen=True)
+class SpineOptTimeline:
+    """Periods of the solve pattern as far as they can be read back from SpineOpt."""
+
+    model_name: str
+    periods: tuple
+    period_start_iso: tuple
+    years_represented: tuple
+    duration: str
+    resolution: str
+
+
+def raw_data(db_map, class_name, name, parameter):
+    value_ = db_map.get_parameter_value_item(
+        entity_class_name=class_name,
+        entity_byname=(name,),
+        parameter_definition_name=parameter,
+        alternative_name="Base",
+    )
+    if not value_:
+        raise RuntimeError(f"{class_name} {name} has no {parameter}")
+    if value_["type"] in ("float", "bool", "str"):
+        return value_["parsed_value"]
+    return json.loads(value_["value"])["data"]
+
+
+def is_leap(timestamp):
+    # the rule used by the forward conversion
+    return (timestamp.astype("datetime64[Y]").astype(int) + 1970) % 4 == 0
+
+
+def duration_string(timedelta):
+    seconds = int(timedelta / np.timedelta64(1, "s"))
+    if seconds % 3600 == 0:
+        return f"{seconds // 3600}h"
+    return f"{seconds}s"
+
+
+def spineopt_timeline(source_db, known_stamps=frozenset()):
+    """Reads the periods back from the model and its operational temporal blocks.
+
+    The block of a leap year period starts a year after the period, when this
+    leaves two possible period starts the one in known_stamps is taken.
+    """
+    model_name = source_db.get_entity_items(entity_class_name="model")[0]["name"]
+    blocks = [
+        entity["entity_byname"][1]
+        for entity in source_db.get_entity_items(
+            entity_class_name="model__default_temporal_block"
+        )
+        # representative period blocks stand in for parts of the operations blocks
+        if entity["entity_byname"][0] == model_name
+        and not entity["entity_byname"][1].startswith("representative_")
+    ]
+    model_start = np.datetime64(raw_data(source_db, "model", model_name, "model_start"))
+    model_end = np.datetime64(raw_data(source_db, "model", model_name, "model_end"))
+    resolution = raw_data(source_db, "temporal_block", blocks[0], "resolution")
+    if blocks == ["operations"]:
+        # a single period, its name is not kept by SpineOpt
+        years = float(raw_data(source_db, "temporal_block", "operations", "weight"))
+        start = model_start.astype("datetime64[s]")
+        duration = model_end - start - np.timedelta64(int(is_leap(start)), "D")
+        return SpineOptTimeline(
+            model_name,
+            (f"p{start.astype('datetime64[Y]')}",),
+            (np.datetime_as_string(start, unit="s"),),
+            (years,),
+            duration_string(duration),
+            resolution,
+        )
+    block_periods = []
+    for block in blocks:
+        if not block.startswith("operations_"):
+            continue
+        block_start = np.datetime64(
+            raw_data(source_db, "temporal_block", block, "block_start"), "s"
+        )
+        block_end = np.datetime64(
+            raw_data(source_db, "temporal_block", block, "block_end"), "s"
+        )
+        years = float(raw_data(source_db, "temporal_block", block, "weight"))
+        block_periods.append(
+            (block_start, block_end, years, block[len("operations_") :])
+        )
+    block_periods.sort()
+    periods = []
+    starts = []
+    previous_end = model_start.astype("datetime64[s]")
+    resolution_td = pd.to_timedelta(resolution).to_timedelta64().astype("m8[s]")
+    for i, (block_start, block_end, years, period) in enumerate(block_periods):
+        # blocks of leap year periods start a year (366 days) after the period,
+        # one step early after the first period
+        leap_start = block_start - np.timedelta64(366, "D")
+        if i > 0:
+            leap_start = leap_start + resolution_td
+        candidates = [
+            start
+            for start, leap in ((leap_start, True), (block_start, False))
+            if is_leap(start) == leap
+        ]
+        known = [
+            start
+            for start in candidates
+            if np.datetime_as_string(start, unit="s") in known_stamps
+        ]
+        if len(known) == 1:
+            start = known[0]
+        elif previous_end in candidates or not candidates:
+            start = previous_end
+        else:
+            start = candidates[-1]
+        periods.append(period)
+        starts.append(start)
+        previous_end = (start.astype("datetime64[Y]") + int(years)).astype(
+            "datetime64[s]"
+        )
+    return SpineOptTimeline(
+        model_name,
+        tuple(periods),
+        tuple(np.datetime_as_string(np.array(starts), unit="s").tolist()),
+        tuple(block_period[2] for block_period in block_periods),
+        duration_string(block_periods[0][1] - block_periods[0][0]),
+        resolution,
+    )
+
+
+def time_series_arrays(raw):
+    """Parses a serialized time series into time stamp and value arrays."""
+    value = json.loads(raw)
+    data = value["data"]
+    if isinstance(data, dict):
+        return np.array(list(data), dtype="datetime64[s]"), np.array(
+            list(data.values()), dtype=float
+        )
+    if data and isinstance(data[0], list):
+        stamps, values = zip(*data)
+        return np.array(stamps, dtype="datetime64[s]"), np.array(values, dtype=float)
+    index = value.get("index", {})
+    try:
+        start = np.datetime64(pd.Timestamp(index["start"]).to_datetime64(), "s")
+        step = pd.to_timedelta(index["resolution"]).to_timedelta64()
+    except (KeyError, TypeError, ValueError):
+        # monthly, yearly and varying resolutions
+        parsed = api.from_database(raw, "time_series")
+        return parsed.indexes.astype("datetime64[s]"), np.asarray(
+            parsed.values, dtype=float
+        )
+    stamps = start + np.arange(len(data)) * step.astype("timedelta64[s]")
+    return stamps, np.array(data, dtype=float)
+
+
+def parameter_value_frame(source_db, inverse):
+    """Reads the SpineOpt values with an inverse mapping into a frame."""
+    rows = [
+        (
+            item["entity_class_name"],
+            item["parameter_definition_name"],
+            tuple(item["entity_byname"]),
+            item["alternative_name"],
+            item["type"],
+            item["value"],
+        )
+        for item in source_db.get_items("parameter_value")
+        if (item["entity_class_name"], item["parameter_definition_name"]) in inverse
+    ]
+    frame = pd.DataFrame(
+        rows,
+        columns=[
+            "target_class",
+            "target_param",
+            "target_byname",
+            "alternative",
+            "type",
+            "value",
+        ],
+    )
+    mappings = pd.DataFrame(
+        [mapping.__dict__ for mapping in inverse.values()],
+        columns=list(InverseMapping.__dataclass_fields__),
+    )
+    frame = frame.merge(mappings, on=["target_class", "target_param"], how="left")
+    frame["byname"] = [
+        tuple(byname[i] for i in order)
+        for byname, order in zip(frame["target_byname"], frame["order"])
+    ]
+    frame["parsed"] = [
+        time_series_arrays(raw) if value_type == "time_series" else None
+        for raw, value_type in zip(frame["value"], frame["type"])
+    ]
+    return frame
+
+
+def report_skipped(source_db, entity_inverse, inverse):
+    """Prints the SpineOpt entity classes and parameters that are not converted back."""
+    skipped_entities = Counter(
+        entity["entity_class_name"]
+        for entity in source_db.get_items("entity")
+        if entity["entity_class_name"] not in entity_inverse
+        and entity["entity_class_name"] not in timeline_classes
+    )
+    for class_name, count in sorted(skipped_entities.items()):
+        print(f"no INES class for {class_name}, skipped {count} entities")
+    skipped_values = Counter(
+        (item["entity_class_name"], item["parameter_definition_name"])
+        for item in source_db.get_items("parameter_value")
+        if (item["entity_class_name"], item["parameter_definition_name"]) not in inverse
+        and item["entity_class_name"] not in timeline_classes
+    )
+    for (class_name, parameter), count in sorted(skipped_values.items()):
+        print(f"no INES parameter for {class_name} {parameter}, skipped {count} values")
+
+
+def period_stamps(frame, max_length=100):
+    """Time stamps of the short time series, where the period starts show up."""
+    stamps = set()
+    weather_years = frame["alternative"].str.match(weather_year_alternative.pattern)
+    for parsed in frame["parsed"][~weather_years]:
+        if parsed is not None and len(parsed[0]) <= max_length:
+            stamps.update(np.datetime_as_string(parsed[0], unit="s").tolist())
+    return stamps
+
+
+def operand_multipliers(frame, floats):
+    """Multipliers of the forward conversion, resolving operand parameters.
+
+    Operands are looked up among the converted float values by INES class,
+    parameter, entity and alternative, NaN where the operand is missing.
+    """
+    multipliers = frame["multiplier"].to_numpy(dtype=float, na_value=np.nan).copy()
+    rows = np.flatnonzero(frame["operand_param"].notna().to_numpy())
+    if not len(rows):
+        return multipliers
+    operands = floats.set_index(
+        ["source_class", "source_param", "byname", "source_alternative"]
+    )["converted"]
+    operands = operands[~operands.index.duplicated()]
+    keys = pd.MultiIndex.from_arrays(
+        [
+            frame["source_class"].iloc[rows],
+            frame["operand_param"].iloc[rows],
+            frame["byname"].iloc[rows],
+            frame["source_alternative"].iloc[rows],
+        ]
+    )
+    operand = operands.reindex(keys).to_numpy(dtype=float)
+    factor = frame["factor"].iloc[rows].to_numpy(dtype=float)
+    for operation in frame["operation"].iloc[rows].unique():
+        selected = (frame["operation"].iloc[rows] == operation).to_numpy()
+        multipliers[rows[selected]] = factor[selected] * operations[operation](
+            factor[selected], operand[selected]
+        )
+    missing = frame.iloc[rows[np.isnan(multipliers[rows])]]
+    for _, row in missing.iterrows():
+        print(
+            f"no {row['operand_param']} for {row['source_class']} {row['byname']}, "
+            f"skipped {row['source_param']}"
+        )
+    return multipliers
+
+
+def map_value(pairs, index_type, index_name=None):
+    value = {"index_type": index_type, "rank": 1, "data": pairs}
+    if index_name is not None:
+        value["index_name"] = index_name
+    return SerializedValue(json.dumps(value).encode(), "map")
+
+
+def convert_values(frame, timeline):
+    """Converts the SpineOpt values of the frame back into INES values.
+
+    Returns a list of (INES class, parameter, alternative, byname, value).
+    Stepped time series over the period starts become maps of periods, time
+    series of the weather year alternatives are regrouped into one historical
+    map in Base, together with the period values of Base when there are both.
+    """
+    pattern = weather_year_alternative.pattern
+    weather_years = frame["alternative"].str.extract(pattern, expand=False)
+    frame["source_alternative"] = frame["alternative"].where(
+        weather_years.isna(), "Base"
+    )
+    is_float = (frame["type"] == "float").to_numpy()
+    is_series = (frame["type"] == "time_series").to_numpy()
+    converted = np.full(len(frame), np.nan)
+    if is_float.any():
+        converted[is_float] = pd.to_numeric(
+            frame["value"][is_float].map(bytes.decode), errors="coerce"
+        ).to_numpy(dtype=float)
+    frame["converted"] = converted
+    is_weather_year = weather_years.notna().to_numpy()
+    # only series of the weather years are regrouped, other values would
+    # collide with the values of Base
+    for row in frame[is_weather_year & ~is_series].itertuples():
+        print(
+            f"cannot convert {row.type} {row.target_param} of {row.byname} "
+            f"in {row.alternative}, skipped"
+        )
+    is_float = is_float & ~is_weather_year
+    plain = is_float & frame["operand_param"].isna().to_numpy()
+    floats = frame[plain].copy()
+    floats["converted"] = floats["converted"] / floats["multiplier"].astype(float)
+    multipliers = operand_multipliers(frame, floats)
+    values = []
+    for row, multiplier in zip(frame[is_float].itertuples(), multipliers[is_float]):
+        if not np.isnan(multiplier):
+            values.append(
+                (
+                    row.source_class,
+                    row.source_param,
+                    row.source_alternative,
+                    row.byname,
+                    row.converted / multiplier,
+                )
+            )
+
+    # time series as one flat array of time stamps and values
+    series = frame[is_series]
+    series_multipliers = multipliers[is_series]
+    parsed = series["parsed"].tolist()
+    lengths = np.array([len(stamps) for stamps, _ in parsed], dtype=int)
+    stamps = np.concatenate([stamps for stamps, _ in parsed] + [np.array([], "M8[s]")])
+    series_values = np.concatenate([values_ for _, values_ in parsed] + [np.array([])])
+    series_values = series_values / np.repeat(series_multipliers, lengths)
+    offsets = np.concatenate([[0], np.cumsum(lengths)])
+    nonempty = lengths > 0
+    first = offsets[:-1][nonempty]
+    is_weather_year_series = is_weather_year[is_series]
+    # weather year series are written from the representative year, move them
+    # back to their own year
+    moved = np.flatnonzero(nonempty & is_weather_year_series)
+    if len(moved):
+        first_iso = np.datetime_as_string(stamps[offsets[:-1][moved]], unit="s")
+        years = weather_years[is_series].to_numpy()[moved]
+        own_start = np.array(
+            [f"{year}{start[4:]}" for year, start in zip(years, first_iso)],
+            dtype="datetime64[s]",
+        )
+        shift = np.zeros(len(lengths), dtype="timedelta64[s]")
+        shift[moved] = own_start - stamps[offsets[:-1][moved]]
+        stamps = stamps + np.repeat(shift, lengths)
+    stamp_strings = np.datetime_as_string(stamps, unit="s")
+    # stepped series end with a closing point after the last period start
+    period_position = pd.Index(timeline.period_start_iso).get_indexer(stamp_strings)
+    matched = period_position >= 0
+    matched[offsets[1:][nonempty] - 1] = True
+    is_period_series = np.zeros(len(lengths), dtype=bool)
+    if len(first):
+        is_period_series[nonempty] = np.logical_and.reduceat(matched, first)
+    is_period_series &= ~is_weather_year_series & (lengths > 1)
+    periods = np.asarray(timeline.periods, dtype=object)
+
+    maps = {}
+    for i, row in enumerate(series.itertuples()):
+        if np.isnan(series_multipliers[i]):
+            continue
+        key = (row.source_class, row.source_param, row.source_alternative, row.byname)
+        entry = maps.setdefault(key, ([], []))
+        part = slice(offsets[i], offsets[i + 1])
+        if is_period_series[i]:
+            part = slice(offsets[i], offsets[i + 1] - 1)
+            entry[0].extend(
+                zip(
+                    periods[period_position[part]].tolist(),
+                    series_values[part].tolist(),
+                )
+            )
+        else:
+            entry[1].extend(
+                zip(stamp_strings[part].tolist(), series_values[part].tolist())
+            )
+    for (source_class, source_param, alternative, byname), (
+        period_pairs,
+        historical_pairs,
+    ) in maps.items():
+        historical_pairs.sort()
+        if period_pairs:
+            value = map_value(period_pairs + historical_pairs, "str")
+        else:
+            value = map_value(historical_pairs, "date_time", "time")
+        values.append((source_class, source_param, alternative, byname, value))
+
+    # lifetimes and values without conversion
+    for row in frame[~is_float & ~is_series & ~is_weather_year].itertuples():
+        if row.duration:
+            parsed_value = api.from_database(row.value, row.type)
+            value = float(parsed_value.value.years)
+        elif row.multiplier == 1.0:
+            value = SerializedValue(row.value, row.type)
+        else:
+            print(f"cannot convert {row.type} {row.target_param} of {row.byname}")
+            continue
+        values.append(
+            (
+                row.source_class,
+                row.source_param,
+                row.source_alternative,
+                row.byname,
+                value,
+            )
+        )
+    return values
+
+
+def weather_year_starts(source_db, frame):
+    """Start times of the weather years from the alternatives and their series."""
+    starts = {}
+    for alternative in source_db.get_alternative_items():
+        match = weather_year_alternative.match(alternative["name"])
+        if match:
+            starts[alternative["name"]] = f"{match.group(1)}-01-01T00:00:00"
+    for row in frame[frame["type"] == "time_series"].itertuples():
+        if row.alternative in starts:
+            start = json.loads(row.value).get("index", {}).get("start")
+            if start is not None:
+                start = str(pd.Timestamp(start).isoformat())
+                starts[row.alternative] = f"{row.alternative[2:]}{start[4:]}"
+    return [starts[name] for name in sorted(starts)]
+
+
+def add_solve_pattern(target_db, timeline, starts):
+    target_db.add_entity_item(
+        entity_class_name="solve_pattern", name=timeline.model_name
+    )
+    solve_pattern = (timeline.model_name,)
+    add_parameter_value(
+        target_db,
+        "solve_pattern",
+        "period",
+        "Base",
+        solve_pattern,
+        api.Array(list(timeline.periods)),
+    )
+    add_parameter_value(
+        target_db,
+        "solve_pattern",
+        "duration",
+        "Base",
+        solve_pattern,
+        {"type": "duration", "data": timeline.duration},
+    )
+    add_parameter_value(
+        target_db,
+        "solve_pattern",
+        "time_resolution",
+        "Base",
+        solve_pattern,
+        {"type": "duration", "data": timeline.resolution},
+    )
+    if starts:
+        add_parameter_value(
+            target_db,
+            "solve_pattern",
+            "start_time",
+            "Base",
+            solve_pattern,
+            api.Array([api.DateTime(start) for start in starts]),
+        )
+    for period, start, years in zip(
+        timeline.periods, timeline.period_start_iso, timeline.years_represented
+    ):
+        target_db.add_entity_item(entity_class_name="period", name=period)
+        add_parameter_value(
+            target_db,
+            "period",
+            "start_time",
+            "Base",
+            (period,),
+            {"type": "date_time", "data": start},
+        )
+        add_parameter_value(
+            target_db, "period", "years_represented", "Base", (period,), years
+        )
+
+
+def copy_alternatives(source_db, target_db):
+    for alternative in source_db.get_alternative_items():
+        if not weather_year_alternative.match(alternative["name"]):
+            target_db.add_alternative_item(name=alternative["name"])
+    for scenario in source_db.get_scenario_items():
+        target_db.add_scenario_item(name=scenario["name"])
+    for scenario_alternative in source_db.get_scenario_alternative_items():
+        if weather_year_alternative.match(scenario_alternative["alternative_name"]):
+            continue
+        target_db.add_scenario_alternative_item(
+            alternative_name=scenario_alternative["alternative_name"],
+            scenario_name=scenario_alternative["scenario_name"],
+            rank=scenario_alternative["rank"],
+        )
+
+
+def copy_entities(source_db, target_db, inverse):
+    for target_class, (source_class, order) in inverse.items():
+        if source_class == "solve_pattern":
+            continue
+        for entity in source_db.get_entity_items(entity_class_name=target_class):
+            byname = entity["entity_byname"]
+            target_db.add_entity_item(
+                entity_class_name=source_class,
+                entity_byname=tuple(byname[i] for i in order),
+            )
+
+
+def convert_databases(source_db, target_db, config):
+    dimension_counts = {
+        entity_class["name"]: len(entity_class["dimension_name_list"])
+        for entity_class in target_db.get_entity_class_items()
+    }
+    definitions = {
+        (definition["entity_class_name"], definition["name"])
+        for definition in target_db.get_parameter_definition_items()
+    }
+    target_db = BulkWriter(target_db)
+    copy_alternatives(source_db, target_db)
+    entity_inverse = inverse_entity_mappings(
+        config["entities_to_copy"], dimension_counts
+    )
+    copy_entities(source_db, target_db, entity_inverse)
+    inverse = inverse_parameter_mappings(config, dimension_counts, definitions)
+    report_skipped(source_db, entity_inverse, inverse)
+    frame = parameter_value_frame(source_db, inverse)
+    timeline = spineopt_timeline(source_db, period_stamps(frame))
+    add_solve_pattern(target_db, timeline, weather_year_starts(source_db, frame))
+    for source_class, source_param, alternative, byname, value in convert_values(
+        frame, timeline
+    ):
+        add_parameter_value(
+            target_db, source_class, source_param, alternative, byname, value
+        )
+    try:
+        target_db.commit_session("Converted from SpineOpt")
+    except api.exception.NothingToCommit:
+        print("nothing to commit from SpineOpt")
+    target_db.raise_errors()
+
+
+def convert(source_url, target_url, config_dir=None):
+    """Converts the SpineOpt database at source_url into the INES database at target_url.
+
+    Inverts the entity and parameter mappings of ines_to_spineopt read from
+    config_dir. Entities and parameters the forward conversion builds with
+    methods or dedicated stages are not converted back.
+    """
+    if config_dir is None:
+        config_dir = ConversionOptions.config_dir
+    config = load_config(config_dir)
+    with api.DatabaseMapping(source_url) as source_db:
+        with api.DatabaseMapping(target_url) as target_db:
+            purge_target(target_db)
+            convert_databases(source_db, target_db, config)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Converts a SpineOpt database into an INES database."
+    )
+    parser.add_argument("source_url", help="e.g. sqlite:///path/db_file.sqlite")
+    parser.add_argument("target_url", help="e.g. sqlite:///path/db_file.sqlite")
+    parser.add_argument("--config-dir", help="directory of the yaml mappings")
+    arguments = vars(parser.parse_args(argv))
+    convert(**arguments)
+
+
+if __name__ == "__main__":
+    main()
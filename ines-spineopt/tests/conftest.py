@@ -0,0 +1,24 @@
+import os
+import sys
+
+import pytest
+from spinedb_api import DatabaseMapping
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def target_db():
+    """An in-memory target with a node class, a few nodes and alternatives."""
+    with DatabaseMapping("sqlite://", create=True) as db_map:
+        db_map.add_entity_class_item(name="node")
+        for parameter in ("demand", "has_state", "node_state_cap"):
+            db_map.add_parameter_definition_item(
+                entity_class_name="node", name=parameter
+            )
+        for node in ("north", "south"):
+            db_map.add_entity_item(entity_class_name="node", name=node)
+        for alternative in ("policy", "sensitivity", "wy2018"):
+            db_map.add_alternative_item(name=alternative)
+        db_map.commit_session("Test target")
+        yield db_map
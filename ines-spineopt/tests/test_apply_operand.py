@@ -0,0 +1,76 @@
+import pytest
+import spinedb_api as api
+
+import ines_to_spineopt as converter
+
+
+def mapping():
+    return converter.ParameterMapping(
+        source_class="unit",
+        target_class="unit",
+        source_param="capacity",
+        target_param="unit_capacity",
+        target_order=(0,),
+        factor=1.0,
+        operation="multiply",
+        operand_param="availability",
+    )
+
+
+def value_item(value):
+    db_value, value_type = api.to_database(value)
+    return {
+        "entity_byname": ("coal_plant",),
+        "alternative_name": "Base",
+        "type": value_type,
+        "value": db_value,
+        "parsed_value": value,
+    }
+
+
+def operands(operand):
+    return {(("coal_plant",), "Base"): operand}
+
+
+def test_float_operand_becomes_multiplier():
+    item = value_item(100.0)
+    scaled, multiplier = converter.apply_operand(mapping(), operands(0.5), item)
+    assert scaled is item
+    assert multiplier == 0.5
+
+
+def test_map_operand_scales_float_value():
+    operand = api.Map(["p2030", "p2040"], [0.5, 0.25])
+    scaled, multiplier = converter.apply_operand(
+        mapping(), operands(operand), value_item(100.0)
+    )
+    assert multiplier == 1.0
+    assert scaled["parsed_value"] == api.Map(["p2030", "p2040"], [50.0, 25.0])
+
+
+def test_map_operand_scales_map_value_by_index():
+    operand = api.Map(["p2030", "p2040"], [0.5, 0.25])
+    value = api.Map(["p2040", "p2030"], [100.0, 200.0])
+    scaled, _ = converter.apply_operand(mapping(), operands(operand), value_item(value))
+    assert scaled["parsed_value"] == api.Map(["p2040", "p2030"], [25.0, 100.0])
+
+
+def test_map_operand_lacking_indexes_raises():
+    operand = api.Map(["p2030"], [0.5])
+    value = api.Map(["p2030", "p2040"], [100.0, 200.0])
+    with pytest.raises(ValueError, match="lacks indexes"):
+        converter.apply_operand(mapping(), operands(operand), value_item(value))
+
+
+def test_map_operand_with_time_series_value_raises():
+    operand = api.Map(["p2030", "p2040"], [0.5, 0.25])
+    value = api.TimeSeriesVariableResolution(
+        ["2030-01-01T00:00:00", "2030-01-01T01:00:00"], [1.0, 2.0], False, False
+    )
+    with pytest.raises(ValueError, match="time_series"):
+        converter.apply_operand(mapping(), operands(operand), value_item(value))
+
+
+def test_missing_operand_raises():
+    with pytest.raises(ValueError, match="does not exist"):
+        converter.apply_operand(mapping(), {}, value_item(100.0))
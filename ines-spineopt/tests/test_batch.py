@@ -0,0 +1,39 @@
+import os
+
+import pytest
+
+import ines_to_spineopt as converter
+
+
+def test_read_manifest_skips_comments_and_empty_lines(tmp_path):
+    manifest = tmp_path / "manifest.txt"
+    manifest.write_text(
+        "# source target\n\nsqlite:///a.sqlite sqlite:///b.sqlite\n"
+        "  sqlite:///c.sqlite   sqlite:///d.sqlite  \n"
+    )
+    assert converter.read_manifest(str(manifest)) == [
+        ("sqlite:///a.sqlite", "sqlite:///b.sqlite"),
+        ("sqlite:///c.sqlite", "sqlite:///d.sqlite"),
+    ]
+
+
+def test_read_manifest_rejects_lines_without_a_pair(tmp_path):
+    manifest = tmp_path / "manifest.txt"
+    manifest.write_text("sqlite:///a.sqlite\n")
+    with pytest.raises(ValueError, match="manifest.txt:1"):
+        converter.read_manifest(str(manifest))
+
+
+def test_failing_pair_leaves_no_source_file(tmp_path, monkeypatch):
+    monkeypatch.setattr(
+        converter,
+        "batch_settings",
+        {"config_dir": converter.ConversionOptions.config_dir, "options": {}},
+    )
+    source = tmp_path / "nonexist.sqlite"
+    target = tmp_path / "target.sqlite"
+    report = converter.convert_batch_item(f"sqlite:///{source}", f"sqlite:///{target}")
+    assert report["error"].startswith("FileNotFoundError")
+    assert not os.path.exists(source)
+    assert not os.path.exists(target)
+    assert os.path.exists(f"{target}.log")
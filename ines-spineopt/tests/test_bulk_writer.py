@@ -0,0 +1,111 @@
+import tracemalloc
+
+import pytest
+
+import ines_to_spineopt as converter
+
+
+def recorded(stage):
+    recorder = converter.StageRecorder()
+    stage(recorder)
+    recorder.flush()
+    return recorder.recorded
+
+
+def test_replay_raises_on_an_entity_added_by_an_earlier_stage(target_db):
+    writer = converter.BulkWriter(target_db)
+    records = recorded(lambda db: converter.add_entity(db, "node", ("north",)))
+    with pytest.raises(RuntimeError, match="already"):
+        writer.replay(records)
+
+
+def test_replay_accepts_entities_added_with_exist_ok(target_db):
+    writer = converter.BulkWriter(target_db)
+    records = recorded(
+        lambda db: [
+            converter.add_entity(db, "node", (name,), exist_ok=True)
+            for name in ("north", "east", "east")
+        ]
+    )
+    writer.replay(records)
+    writer.raise_errors()
+    names = {
+        item["name"] for item in target_db.get_entity_items(entity_class_name="node")
+    }
+    assert names == {"north", "south", "east"}
+
+
+def test_replay_raises_on_a_duplicate_value(target_db):
+    writer = converter.BulkWriter(target_db)
+    converter.add_parameter_value(writer, "node", "demand", "Base", ("north",), 1.0)
+    records = recorded(
+        lambda db: converter.add_parameter_value(
+            db, "node", "demand", "Base", ("north",), 2.0
+        )
+    )
+    with pytest.raises(RuntimeError, match="already"):
+        writer.replay(records)
+
+
+def test_replay_commits_recorded_commits(target_db):
+    writer = converter.BulkWriter(target_db)
+
+    def stage(db):
+        converter.add_parameter_value(db, "node", "demand", "Base", ("north",), 1.0)
+        db.commit_session("Added demand")
+        # nothing left to commit
+        db.commit_session("Added nothing")
+
+    writer.replay(recorded(stage))
+    assert target_db.get_parameter_value_item(
+        entity_class_name="node",
+        entity_byname=("north",),
+        parameter_definition_name="demand",
+        alternative_name="Base",
+    )
+
+
+def test_checkpoint_with_only_failed_items_commits_nothing(target_db):
+    writer = converter.BulkWriter(target_db, commit_size=10)
+    converter.add_parameter_value(writer, "node", "demand", "Base", ("west",), 1.0)
+    writer.checkpoint("Completed stage")
+    with pytest.raises(RuntimeError, match="1 items could not be added"):
+        writer.raise_errors()
+
+
+def test_low_memory_chunks_commit_successful_items(target_db):
+    writer = converter.BulkWriter(target_db, batch_size=1, commit_size=1)
+    chunks = []
+    writer.on_chunk_commit = lambda: chunks.append(len(chunks))
+    converter.add_parameter_value(writer, "node", "demand", "Base", ("west",), 1.0)
+    converter.add_parameter_value(writer, "node", "demand", "Base", ("north",), 2.0)
+    writer.checkpoint("Completed stage")
+    assert chunks == [0]
+    assert target_db.query(target_db.parameter_value_sq).count() == 1
+
+
+@pytest.fixture
+def tracing():
+    # StageProfiler starts tracemalloc, which slows down every later test
+    yield
+    tracemalloc.stop()
+
+
+def test_profiler_counts_checkpoints_as_commits_of_the_stage(target_db, tracing):
+    writer = converter.BulkWriter(target_db)
+    writer.defer_commits = True
+    profiler = converter.StageProfiler(writer=writer)
+
+    def stage(db):
+        converter.add_parameter_value(db, "node", "demand", "Base", ("north",), 1.0)
+        db.commit_session("Added demand")
+
+    profiler.measure(
+        "demand", lambda: stage(converter.CallCounter(writer, "target_db", profiler))
+    )
+    profiler.measure_commits("demand", lambda: writer.checkpoint("Completed demand"))
+    (record,) = profiler.stages
+    assert record["flushes"] == 1
+    assert record["commits"] == 1
+    assert record["commit_time"] > 0.0
+    assert target_db.query(target_db.parameter_value_sq).count() == 1
@@ -0,0 +1,62 @@
+import ines_to_spineopt as converter
+
+
+def add_scenario(db_map, name, alternatives):
+    db_map.add_scenario_item(name=name)
+    for rank, alternative in enumerate(alternatives, 1):
+        db_map.add_scenario_alternative_item(
+            scenario_name=name, alternative_name=alternative, rank=rank
+        )
+
+
+def add_demands(db_map, demands):
+    for alternative, value in demands.items():
+        converter.add_parameter_value(
+            db_map, "node", "demand", alternative, ("north",), value
+        )
+
+
+def remaining(db_map):
+    return {
+        item["alternative_name"]: item["parsed_value"]
+        for item in db_map.get_parameter_value_items(
+            entity_class_name="node", parameter_definition_name="demand"
+        )
+    }
+
+
+def test_removes_values_scenarios_resolve_to_base(target_db):
+    add_scenario(target_db, "sensitivity_case", ["Base", "sensitivity"])
+    add_demands(target_db, {"Base": 1.0, "sensitivity": 1.0})
+    converter.deduplicate_values(target_db)
+    assert remaining(target_db) == {"Base": 1.0}
+
+
+def test_keeps_values_of_scenarios_without_base(target_db):
+    add_scenario(target_db, "policy_only", ["policy"])
+    add_demands(target_db, {"Base": 1.0, "policy": 1.0})
+    converter.deduplicate_values(target_db)
+    assert remaining(target_db) == {"Base": 1.0, "policy": 1.0}
+
+
+def test_keeps_values_resetting_an_override_ranked_in_between(target_db):
+    add_scenario(target_db, "layered", ["Base", "policy", "sensitivity"])
+    add_demands(target_db, {"Base": 1.0, "policy": 2.0, "sensitivity": 1.0})
+    converter.deduplicate_values(target_db)
+    assert remaining(target_db) == {"Base": 1.0, "policy": 2.0, "sensitivity": 1.0}
+
+
+def test_removes_values_below_base_and_behind_base_copies(target_db):
+    add_scenario(target_db, "below_base", ["sensitivity", "Base"])
+    add_scenario(target_db, "layered", ["Base", "policy", "wy2018"])
+    add_demands(
+        target_db, {"Base": 1.0, "policy": 1.0, "sensitivity": 1.0, "wy2018": 1.0}
+    )
+    converter.deduplicate_values(target_db)
+    assert remaining(target_db) == {"Base": 1.0}
+
+
+def test_only_generated_alternatives_outside_scenarios_are_removed(target_db):
+    add_demands(target_db, {"Base": 1.0, "policy": 1.0, "wy2018": 1.0})
+    converter.deduplicate_values(target_db, {"wy2018"})
+    assert remaining(target_db) == {"Base": 1.0, "policy": 1.0}
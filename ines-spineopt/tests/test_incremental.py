@@ -0,0 +1,222 @@
+import pytest
+
+import ines_to_spineopt as converter
+
+
+def recorded(stage):
+    recorder = converter.StageRecorder()
+    stage(recorder)
+    recorder.flush()
+    return recorder.recorded
+
+
+def demand(db, node, value, alternative="Base"):
+    converter.add_parameter_value(db, "node", "demand", alternative, (node,), value)
+
+
+def value_key(node, alternative="Base"):
+    return converter.item_key(
+        "parameter_value",
+        {
+            "entity_class_name": "node",
+            "entity_byname": (node,),
+            "parameter_definition_name": "demand",
+            "alternative_name": alternative,
+        },
+    )
+
+
+def demands(target_db):
+    return {
+        (item["entity_byname"], item["alternative_name"]): item["parsed_value"]
+        for item in target_db.get_parameter_value_items(
+            entity_class_name="node", parameter_definition_name="demand"
+        )
+    }
+
+
+def test_apply_delta_adds_updates_and_removes(target_db):
+    errors = []
+    outputs, classes = converter.apply_delta(
+        target_db,
+        0,
+        {},
+        recorded(lambda db: [demand(db, "north", 1.0), demand(db, "south", 2.0)]),
+        {},
+        errors,
+    )
+    assert demands(target_db) == {(("north",), "Base"): 1.0, (("south",), "Base"): 2.0}
+    assert classes == {"node"}
+    owners = {key: {0} for key in outputs}
+    outputs, classes = converter.apply_delta(
+        target_db,
+        0,
+        outputs,
+        recorded(
+            lambda db: [demand(db, "north", 3.0), demand(db, "north", 4.0, "policy")]
+        ),
+        owners,
+        errors,
+    )
+    assert not errors
+    assert demands(target_db) == {
+        (("north",), "Base"): 3.0,
+        (("north",), "policy"): 4.0,
+    }
+    assert set(outputs) == {value_key("north"), value_key("north", "policy")}
+
+
+def test_apply_delta_writes_nothing_for_unchanged_outputs(target_db):
+    errors = []
+    outputs, _ = converter.apply_delta(
+        target_db, 0, {}, recorded(lambda db: demand(db, "north", 1.0)), {}, errors
+    )
+    target_db.commit_session("First run")
+    owners = {key: {0} for key in outputs}
+    again, classes = converter.apply_delta(
+        target_db,
+        0,
+        outputs,
+        recorded(lambda db: demand(db, "north", 1.0)),
+        owners,
+        errors,
+    )
+    assert again == outputs
+    assert not classes
+    with pytest.raises(converter.api.exception.NothingToCommit):
+        target_db.commit_session("Second run")
+
+
+def test_apply_delta_keeps_items_another_step_writes(target_db):
+    errors = []
+    key = converter.item_key(
+        "entity", {"entity_class_name": "node", "entity_byname": ("east",)}
+    )
+    previous = {key: "old"}
+    converter.apply_delta(
+        target_db,
+        0,
+        {},
+        recorded(lambda db: converter.add_entity(db, "node", ("east",))),
+        {},
+        errors,
+    )
+    # a later step writes east too, the first step no longer does
+    converter.apply_delta(target_db, 0, previous, [], {key: {0, 3}}, errors)
+    assert target_db.get_entity_item(entity_class_name="node", entity_byname=("east",))
+    converter.apply_delta(target_db, 3, previous, [], {key: {3}}, errors)
+    assert not target_db.get_entity_item(
+        entity_class_name="node", entity_byname=("east",)
+    )
+    assert not errors
+
+
+def test_apply_delta_reports_items_an_earlier_step_wrote(target_db):
+    errors = []
+    key = converter.item_key("alternative", {"name": "wy2018"})
+    converter.apply_delta(
+        target_db,
+        2,
+        {},
+        recorded(lambda db: converter.add_alternative(db, "wy2018", exist_ok=True)),
+        {key: {1}},
+        errors,
+    )
+    assert not errors
+    converter.apply_delta(
+        target_db,
+        2,
+        {},
+        recorded(lambda db: converter.add_alternative(db, "wy2018")),
+        {key: {1}},
+        errors,
+    )
+    assert errors == [f"there's already a alternative with {key}"]
+
+
+def test_delta_recorder_hides_later_items(target_db):
+    demand(target_db, "north", 1.0)
+    demand(target_db, "south", 2.0)
+    recorder = converter.DeltaRecorder(target_db, {value_key("south")})
+    assert [item["entity_byname"] for item in recorder.get_parameter_value_items()] == [
+        ("north",)
+    ]
+    assert not recorder.get_parameter_value_item(
+        entity_class_name="node",
+        entity_byname=("south",),
+        parameter_definition_name="demand",
+        alternative_name="Base",
+    )
+
+
+def test_read_tracker_tags_match_changed_source_items(target_db):
+    tracker = converter.ReadTracker(target_db)
+    tracker.get_parameter_value_items(
+        entity_class_name="node", parameter_definition_name="demand"
+    )
+    tracker.get_entity_items(entity_class_name="unit")
+    changed_demand = converter.source_tag(
+        ["parameter_value", "node", ["north"], "demand", "Base"]
+    )
+    changed_state = converter.source_tag(
+        ["parameter_value", "node", ["north"], "has_state", "Base"]
+    )
+    changed_unit = converter.source_tag(["entity", "unit", ["u1"]])
+    assert converter.depends(tracker.reads, {changed_demand})
+    assert not converter.depends(tracker.reads, {changed_state})
+    assert converter.depends(tracker.reads, {changed_unit})
+    tracker.commit_sq
+    assert converter.depends(tracker.reads, {changed_state})
+
+
+@pytest.fixture
+def incremental_run(tmp_path, monkeypatch):
+    """Options of an incremental conversion between two empty sqlite databases."""
+    source_url = f"sqlite:///{tmp_path / 'source.sqlite'}"
+    target_url = f"sqlite:///{tmp_path / 'target.sqlite'}"
+    for url in (source_url, target_url):
+        converter.api.DatabaseMapping(url, create=True).close()
+    monkeypatch.setattr(
+        converter,
+        "options",
+        converter.ConversionOptions(source_url, target_url, incremental=True),
+    )
+
+    def purged(target_db):
+        raise RuntimeError("converting everything")
+
+    monkeypatch.setattr(converter, "purge_target", purged)
+    return source_url, target_url
+
+
+def write_state(source_db, target_db):
+    converter.write_incremental_state(
+        {
+            "hashes": converter.source_content_hashes(source_db),
+            "timeline_reads": [],
+            "steps": {},
+            "target_commit": converter.last_commit_id(target_db),
+        }
+    )
+
+
+def test_unchanged_source_and_target_convert_nothing(incremental_run, capsys):
+    source_url, target_url = incremental_run
+    with converter.api.DatabaseMapping(source_url) as source_db:
+        with converter.api.DatabaseMapping(target_url) as target_db:
+            write_state(source_db, target_db)
+            converter.convert_incremental(source_db, target_db)
+    assert "nothing to convert" in capsys.readouterr().out
+
+
+def test_target_changed_between_runs_converts_everything(incremental_run, capsys):
+    source_url, target_url = incremental_run
+    with converter.api.DatabaseMapping(source_url) as source_db:
+        with converter.api.DatabaseMapping(target_url) as target_db:
+            write_state(source_db, target_db)
+            # e.g. a full conversion from another source into the same target
+            target_db.add_alternative_item(name="other")
+            target_db.commit_session("Converted another source")
+            with pytest.raises(RuntimeError, match="converting everything"):
+                converter.convert_incremental(source_db, target_db)
+    assert "target changed" in capsys.readouterr().out
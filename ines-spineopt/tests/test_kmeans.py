@@ -0,0 +1,53 @@
+import numpy as np
+
+import ines_to_spineopt as converter
+
+
+def separated_features():
+    """Three groups of periods around 0, 10 and 20, interleaved in time."""
+    rng = np.random.default_rng(1)
+    centers = np.array([20.0, 0.0, 10.0] * 4)
+    return centers[:, None] + rng.normal(0, 0.1, (len(centers), 3))
+
+
+def test_kmeans_is_reproducible():
+    features = np.random.default_rng(2).normal(size=(40, 5))
+    first = converter.kmeans(features, 4)
+    second = converter.kmeans(features, 4)
+    np.testing.assert_array_equal(first[0], second[0])
+    np.testing.assert_array_equal(first[1], second[1])
+
+
+def test_kmeans_finds_separated_clusters():
+    features = separated_features()
+    labels, medoids = converter.kmeans(features, 3)
+    assert len(medoids) == 3
+    groups = np.round(features[:, 0] / 10).astype(int)
+    for group in range(3):
+        assert len(set(labels[groups == group])) == 1
+    assert len(set(labels)) == 3
+
+
+def test_kmeans_medoids_are_members_closest_to_their_cluster_mean():
+    features = separated_features()
+    labels, medoids = converter.kmeans(features, 3)
+    for cluster, medoid in enumerate(medoids):
+        members = np.flatnonzero(labels == cluster)
+        assert medoid in members
+        mean = features[members].mean(axis=0)
+        distances = ((features[members] - mean) ** 2).sum(axis=1)
+        assert medoid == members[distances.argmin()]
+
+
+def test_kmeans_numbers_clusters_in_the_order_of_their_medoids():
+    labels, medoids = converter.kmeans(separated_features(), 3)
+    assert (np.diff(medoids) > 0).all()
+    np.testing.assert_array_equal(labels[medoids], np.arange(len(medoids)))
+
+
+def test_kmeans_drops_empty_clusters():
+    # two distinct periods can not fill four clusters
+    features = np.array([[0.0, 0.0]] * 5 + [[1.0, 1.0]] * 5)
+    labels, medoids = converter.kmeans(features, 4)
+    assert len(medoids) == 2
+    np.testing.assert_array_equal(labels, [0] * 5 + [1] * 5)
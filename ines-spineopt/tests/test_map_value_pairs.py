@@ -0,0 +1,94 @@
+import json
+
+import pytest
+import spinedb_api as api
+
+import ines_to_spineopt as converter
+
+
+def parsed_pairs(raw):
+    """The (index, value) pairs of raw as spinedb_api parses them."""
+    parsed = api.from_database(raw, "map")
+    return [
+        (
+            (
+                str(index)
+                if not isinstance(index, api.DateTime)
+                else index.value.isoformat()
+            ),
+            value,
+        )
+        for index, value in zip(parsed.indexes, parsed.values)
+    ]
+
+
+def streamed_pairs(raw, chunk_size):
+    pairs = []
+    for index, value in converter.map_value_pairs(raw, chunk_size=chunk_size):
+        if isinstance(value, dict):
+            value = api.from_database(json.dumps(value).encode(), value["type"])
+        pairs.append((index, value))
+    return pairs
+
+
+escaped = api.Map(
+    ['quote " inside', "back\\slash", "tab\tnew\nline", "é ü ∞ 😀", "\\u0041"],
+    [1.0, -2.5, 1.25e-7, 123456789.125, None],
+    index_name="name",
+)
+nested = api.Map(
+    ["outer 1", "outer 2"],
+    [
+        api.Map(["inner 1", "inner 2"], [0.5, api.Map(["deep"], [3.0])]),
+        api.Map([], [], index_type=str),
+    ],
+)
+timestamps = api.Map(
+    [api.DateTime(f"2020-01-01T{hour:02d}:00:00") for hour in range(24)],
+    [hour * 0.1 for hour in range(24)],
+    index_name="time",
+)
+
+
+@pytest.mark.parametrize("value", [escaped, nested, timestamps], ids=str)
+@pytest.mark.parametrize("chunk_size", [1, 2, 3, 5, 7, 16, 1 << 20])
+def test_pairs_match_spinedb_api(value, chunk_size):
+    raw, _ = api.to_database(value)
+    assert streamed_pairs(raw, chunk_size) == parsed_pairs(raw)
+
+
+@pytest.mark.parametrize("chunk_size", range(1, 12))
+def test_chunk_boundaries_inside_multibyte_characters(chunk_size):
+    value = {
+        "type": "map",
+        "index_type": "str",
+        "data": [["é ü ∞ 😀", 1.5], ['"😀"', 2.0]],
+    }
+    raw = json.dumps(value, ensure_ascii=False, indent=2).encode()
+    assert streamed_pairs(raw, chunk_size) == parsed_pairs(raw)
+
+
+@pytest.mark.parametrize("chunk_size", [1, 4, 1 << 20])
+def test_numbers_cut_by_chunks_are_read_whole(chunk_size):
+    raw = b'{"index_type": "str", "data": [["a", 12345.678e-3], ["b", -0.000125]]}'
+    assert streamed_pairs(raw, chunk_size) == [("a", 12.345678), ("b", -0.000125)]
+
+
+@pytest.mark.parametrize("chunk_size", [1, 3, 1 << 20])
+def test_object_data_and_header(chunk_size):
+    raw = b'{"type": "map", "index_type": "str", "data": {"x": 1.0, "y\\"": 2.0}, "index_name": "k"}'
+    header = {}
+    pairs = list(converter.map_value_pairs(raw, header, chunk_size))
+    assert pairs == [("x", 1.0), ('y"', 2.0)]
+    assert header == {"type": "map", "index_type": "str", "index_name": "k"}
+
+
+def test_empty_maps():
+    assert list(converter.map_value_pairs(b"{}")) == []
+    assert list(converter.map_value_pairs(b'{"data": []}', chunk_size=1)) == []
+    assert list(converter.map_value_pairs(b'{"data": {}}', chunk_size=1)) == []
+
+
+def test_truncated_value_raises():
+    with pytest.raises(ValueError):
+        list(converter.map_value_pairs(b'{"data": [["a", 1.0], ["b"', chunk_size=4))
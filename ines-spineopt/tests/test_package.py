@@ -0,0 +1,96 @@
+import zipfile
+
+import pytest
+import spinedb_api as api
+
+import ines_to_spineopt as converter
+
+
+@pytest.fixture
+def filled_db(target_db):
+    target_db.add_entity_class_item(
+        name="node__node", dimension_name_list=("node", "node")
+    )
+    target_db.add_parameter_definition_item(
+        entity_class_name="node__node", name="capacity"
+    )
+    converter.add_entity(target_db, "node__node", ("north", "south"))
+    target_db.add_entity_item(entity_class_name="node", name="all_nodes")
+    for member in ("north", "south"):
+        target_db.add_entity_group_item(
+            entity_class_name="node", group_name="all_nodes", member_name=member
+        )
+    target_db.add_scenario_item(name="high")
+    target_db.add_scenario_alternative_item(
+        scenario_name="high", alternative_name="policy", rank=1
+    )
+    converter.add_parameter_value(target_db, "node", "demand", "Base", ("north",), 1.5)
+    converter.add_parameter_value(
+        target_db,
+        "node",
+        "demand",
+        "policy",
+        ("south",),
+        api.Map(["p2030", "p2040"], [2.0, 3.0]),
+    )
+    converter.add_parameter_value(
+        target_db, "node", "has_state", "Base", ("north",), "Törö"
+    )
+    converter.add_parameter_value(
+        target_db, "node__node", "capacity", "wy2018", ("north", "south"), 100.0
+    )
+    target_db.commit_session("Items")
+    return target_db
+
+
+def package_items(db_map):
+    return {
+        item_type: sorted(
+            (fields for _, fields in converter.delta_items(item_type, db_map).values()),
+            key=repr,
+        )
+        for item_type in converter.BulkWriter.item_types
+    }
+
+
+def test_read_package_returns_the_written_items(filled_db, tmp_path):
+    path = tmp_path / "package.zip"
+    counts = converter.write_package(filled_db, path)
+    assert counts["parameter_value"] == 4
+    assert counts["entity_group"] == 2
+    items = converter.read_package(path)
+    read = {item_type: sorted(rows, key=repr) for item_type, rows in items.items()}
+    assert read == package_items(filled_db)
+
+
+def test_read_package_orders_elements_before_multidimensional_entities(
+    filled_db, tmp_path
+):
+    path = tmp_path / "package.zip"
+    converter.write_package(filled_db, path)
+    lengths = [
+        len(entity["entity_byname"])
+        for entity in converter.read_package(path)["entity"]
+    ]
+    assert lengths == sorted(lengths)
+
+
+def test_imported_package_matches_the_source(filled_db, tmp_path):
+    path = tmp_path / "package.zip"
+    converter.write_package(filled_db, path)
+    template_url = f"sqlite:///{tmp_path / 'template.sqlite'}"
+    converter.create_from_template(
+        template_url, converter.template_data(filled_db)
+    ).close()
+    target_url = f"sqlite:///{tmp_path / 'imported.sqlite'}"
+    converter.import_package(str(path), target_url, template=template_url)
+    with api.DatabaseMapping(target_url) as imported_db:
+        assert package_items(imported_db) == package_items(filled_db)
+
+
+def test_read_package_rejects_other_zip_files(tmp_path):
+    path = tmp_path / "other.zip"
+    with zipfile.ZipFile(path, "w") as package:
+        package.writestr("package.json", '{"format": "other", "version": 1}')
+    with pytest.raises(RuntimeError, match="not an ines-spineopt import package"):
+        converter.read_package(path)
@@ -0,0 +1,68 @@
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+import spinedb_api as api
+
+import ines_to_spineopt as converter
+
+
+def timeline(factor, resolution="1h"):
+    """The fields of a TimelineContext resampling reads."""
+    resolution_td = np.timedelta64(int(resolution[:-1]), resolution[-1]).astype("m8[s]")
+    return SimpleNamespace(
+        resolution=resolution,
+        resolution_td=resolution_td,
+        model_resolution=f"{factor * int(resolution[:-1])}{resolution[-1]}",
+        resample_factor=factor,
+    )
+
+
+# seven hours into steps of three, the last step has one hour
+values = np.array([1.0, 5.0, 3.0, 2.0, 8.0, 4.0, 6.0])
+
+
+@pytest.mark.parametrize(
+    "aggregation, expected",
+    [
+        ("mean", [3.0, 14.0 / 3.0, 6.0]),
+        ("sum", [9.0, 14.0, 6.0]),
+        ("min", [1.0, 2.0, 6.0]),
+        ("max", [5.0, 8.0, 6.0]),
+    ],
+)
+def test_resample_values_aggregates_a_partial_last_step(aggregation, expected):
+    resampled = converter.resample_values(values, timeline(3), aggregation)
+    np.testing.assert_allclose(resampled, expected)
+
+
+def test_resample_values_passes_values_through_with_factor_one():
+    assert converter.resample_values(values, timeline(1), "sum") is values
+
+
+def test_resample_time_series_to_the_model_resolution():
+    series = api.TimeSeriesFixedResolution(
+        "2030-01-01T00:00:00", "1h", values, False, False
+    )
+    resampled = converter.resample_time_series(series, timeline(3), "sum")
+    assert resampled == api.TimeSeriesFixedResolution(
+        "2030-01-01T00:00:00", "3h", [9.0, 14.0, 6.0], False, False
+    )
+
+
+def test_resample_time_series_leaves_other_steps(capsys):
+    series = api.TimeSeriesVariableResolution(
+        ["2030-01-01T00:00:00", "2030-01-01T01:00:00", "2030-01-01T03:00:00"],
+        [1.0, 2.0, 3.0],
+        False,
+        False,
+    )
+    assert converter.resample_time_series(series, timeline(3)) is series
+    assert "steps other than 1h is not resampled" in capsys.readouterr().out
+
+
+def test_resample_time_series_passes_series_through_with_factor_one():
+    series = api.TimeSeriesFixedResolution(
+        "2030-01-01T00:00:00", "1h", values, False, False
+    )
+    assert converter.resample_time_series(series, timeline(1)) is series
@@ -0,0 +1,47 @@
+import spineopt_to_ines as reverse
+from ines_to_spineopt import add_parameter_value
+
+timeline = reverse.SpineOptTimeline(
+    "model", ("p2030",), ("2030-01-01T00:00:00",), (1.0,), "8760h", "1h"
+)
+
+inverse = {
+    ("node", "demand"): reverse.InverseMapping(
+        "node", "demand", "node", "flow_profile", (0,), multiplier=2.0
+    )
+}
+
+
+def add_demands(db_map, values):
+    for alternative, value in values.items():
+        add_parameter_value(db_map, "node", "demand", alternative, ("north",), value)
+    db_map.commit_session("Demands")
+
+
+def test_float_values_are_divided_by_the_multiplier(target_db):
+    add_demands(target_db, {"Base": 10.0, "policy": 4.0})
+    frame = reverse.parameter_value_frame(target_db, inverse)
+    values = reverse.convert_values(frame, timeline)
+    assert sorted(values) == [
+        ("node", "flow_profile", "Base", ("north",), 5.0),
+        ("node", "flow_profile", "policy", ("north",), 2.0),
+    ]
+
+
+def test_weather_year_floats_are_skipped(target_db, capsys):
+    add_demands(target_db, {"Base": 10.0, "wy2018": 6.0})
+    frame = reverse.parameter_value_frame(target_db, inverse)
+    values = reverse.convert_values(frame, timeline)
+    assert values == [("node", "flow_profile", "Base", ("north",), 5.0)]
+    assert "demand of ('north',) in wy2018, skipped" in capsys.readouterr().out
+
+
+def test_report_skipped_names_unmapped_classes_and_parameters(target_db, capsys):
+    add_parameter_value(target_db, "node", "has_state", "Base", ("north",), True)
+    add_parameter_value(target_db, "node", "has_state", "Base", ("south",), False)
+    add_demands(target_db, {"Base": 10.0})
+    reverse.report_skipped(target_db, {}, inverse)
+    assert capsys.readouterr().out.splitlines() == [
+        "no INES class for node, skipped 2 entities",
+        "no INES parameter for node has_state, skipped 2 values",
+    ]